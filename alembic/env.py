@@ -7,7 +7,13 @@ from sqlmodel import SQLModel, create_engine
 from sqlmodel.ext.asyncio.session import AsyncEngine
 
 from alembic import context
-from modalci.models import Namespace, Topic  # noqa
+from modalci.models import (  # noqa
+    Delivery,
+    Namespace,
+    Subscription,
+    Topic,
+    TopicMessage,
+)
 from settings import env
 
 # this is the Alembic Config object, which provides
@@ -0,0 +1,79 @@
+"""outbox
+
+Revision ID: 4be1b4f8118f
+Revises: 51252bb18e1f
+Create Date: 2026-10-17 09:00:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa  # noqa
+import sqlmodel  # noqa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "4be1b4f8118f"
+down_revision = "51252bb18e1f"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "messages",
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.Column("topic_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("data", sa.LargeBinary(), nullable=False),
+        sa.Column("id", sqlmodel.sql.sqltypes.GUID(), nullable=False),
+        sa.ForeignKeyConstraint(["topic_id"], ["topics.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_messages_id"), "messages", ["id"], unique=False)
+    op.create_index(
+        op.f("ix_messages_topic_id"), "messages", ["topic_id"], unique=False
+    )
+    op.create_table(
+        "deliveries",
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.Column("message_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("subscription_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("next_attempt_at", sa.DateTime(), nullable=False),
+        sa.Column("id", sqlmodel.sql.sqltypes.GUID(), nullable=False),
+        sa.Column("status", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("last_error", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.ForeignKeyConstraint(["message_id"], ["messages.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(
+            ["subscription_id"], ["subscriptions.id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("message_id", "subscription_id"),
+    )
+    op.create_index(op.f("ix_deliveries_id"), "deliveries", ["id"], unique=False)
+    op.create_index(
+        op.f("ix_deliveries_message_id"), "deliveries", ["message_id"], unique=False
+    )
+    op.create_index(
+        op.f("ix_deliveries_subscription_id"),
+        "deliveries",
+        ["subscription_id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_deliveries_status_next_attempt_at",
+        "deliveries",
+        ["status", "next_attempt_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_deliveries_status_next_attempt_at", table_name="deliveries")
+    op.drop_index(op.f("ix_deliveries_subscription_id"), table_name="deliveries")
+    op.drop_index(op.f("ix_deliveries_message_id"), table_name="deliveries")
+    op.drop_index(op.f("ix_deliveries_id"), table_name="deliveries")
+    op.drop_table("deliveries")
+    op.drop_index(op.f("ix_messages_topic_id"), table_name="messages")
+    op.drop_index(op.f("ix_messages_id"), table_name="messages")
+    op.drop_table("messages")
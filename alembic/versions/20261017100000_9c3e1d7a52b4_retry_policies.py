@@ -0,0 +1,65 @@
+"""retry policies
+
+Revision ID: 9c3e1d7a52b4
+Revises: 4be1b4f8118f
+Create Date: 2026-10-17 10:00:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa  # noqa
+import sqlmodel  # noqa
+
+# revision identifiers, used by Alembic.
+revision = "9c3e1d7a52b4"
+down_revision = "4be1b4f8118f"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "subscriptions",
+        sa.Column(
+            "max_delivery_attempts", sa.Integer(), nullable=False, server_default="5"
+        ),
+    )
+    op.add_column(
+        "subscriptions",
+        sa.Column(
+            "min_backoff_seconds", sa.Float(), nullable=False, server_default="10"
+        ),
+    )
+    op.add_column(
+        "subscriptions",
+        sa.Column(
+            "max_backoff_seconds", sa.Float(), nullable=False, server_default="600"
+        ),
+    )
+    op.add_column(
+        "subscriptions",
+        sa.Column(
+            "backoff_jitter", sa.Boolean(), nullable=False, server_default="true"
+        ),
+    )
+    op.add_column(
+        "subscriptions",
+        sa.Column(
+            "max_message_age_seconds",
+            sa.Integer(),
+            nullable=False,
+            server_default="604800",
+        ),
+    )
+    op.add_column(
+        "deliveries",
+        sa.Column("last_status_code", sa.Integer(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("deliveries", "last_status_code")
+    op.drop_column("subscriptions", "max_message_age_seconds")
+    op.drop_column("subscriptions", "backoff_jitter")
+    op.drop_column("subscriptions", "max_backoff_seconds")
+    op.drop_column("subscriptions", "min_backoff_seconds")
+    op.drop_column("subscriptions", "max_delivery_attempts")
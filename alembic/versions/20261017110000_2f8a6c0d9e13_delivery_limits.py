@@ -0,0 +1,32 @@
+"""delivery limits
+
+Revision ID: 2f8a6c0d9e13
+Revises: 9c3e1d7a52b4
+Create Date: 2026-10-17 11:00:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa  # noqa
+import sqlmodel  # noqa
+
+# revision identifiers, used by Alembic.
+revision = "2f8a6c0d9e13"
+down_revision = "9c3e1d7a52b4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "subscriptions",
+        sa.Column("max_in_flight", sa.Integer(), nullable=True),
+    )
+    op.add_column(
+        "subscriptions",
+        sa.Column("max_messages_per_second", sa.Float(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("subscriptions", "max_messages_per_second")
+    op.drop_column("subscriptions", "max_in_flight")
@@ -0,0 +1,43 @@
+"""push batching
+
+Revision ID: 7d41b0e3c6a8
+Revises: 2f8a6c0d9e13
+Create Date: 2026-10-17 12:00:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa  # noqa
+import sqlmodel  # noqa
+
+# revision identifiers, used by Alembic.
+revision = "7d41b0e3c6a8"
+down_revision = "2f8a6c0d9e13"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "subscriptions",
+        sa.Column(
+            "batch_max_messages", sa.Integer(), nullable=False, server_default="1"
+        ),
+    )
+    op.add_column(
+        "subscriptions",
+        sa.Column(
+            "batch_max_bytes", sa.Integer(), nullable=False, server_default="1000000"
+        ),
+    )
+    op.add_column(
+        "subscriptions",
+        sa.Column(
+            "batch_max_linger_ms", sa.Integer(), nullable=False, server_default="0"
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("subscriptions", "batch_max_linger_ms")
+    op.drop_column("subscriptions", "batch_max_bytes")
+    op.drop_column("subscriptions", "batch_max_messages")
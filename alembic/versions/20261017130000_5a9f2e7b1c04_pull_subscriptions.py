@@ -0,0 +1,29 @@
+"""pull subscriptions
+
+Revision ID: 5a9f2e7b1c04
+Revises: 7d41b0e3c6a8
+Create Date: 2026-10-17 13:00:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa  # noqa
+import sqlmodel  # noqa
+
+# revision identifiers, used by Alembic.
+revision = "5a9f2e7b1c04"
+down_revision = "7d41b0e3c6a8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "subscriptions",
+        sa.Column(
+            "ack_deadline_seconds", sa.Integer(), nullable=False, server_default="10"
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("subscriptions", "ack_deadline_seconds")
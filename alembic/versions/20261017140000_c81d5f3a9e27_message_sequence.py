@@ -0,0 +1,34 @@
+"""message sequence
+
+Revision ID: c81d5f3a9e27
+Revises: 5a9f2e7b1c04
+Create Date: 2026-10-17 14:00:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa  # noqa
+import sqlmodel  # noqa
+
+# revision identifiers, used by Alembic.
+revision = "c81d5f3a9e27"
+down_revision = "5a9f2e7b1c04"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "messages",
+        sa.Column("sequence", sa.BigInteger(), sa.Identity(), nullable=False),
+    )
+    op.create_index(
+        "ix_messages_topic_id_sequence",
+        "messages",
+        ["topic_id", "sequence"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_messages_topic_id_sequence", table_name="messages")
+    op.drop_column("messages", "sequence")
@@ -0,0 +1,32 @@
+"""message content type
+
+Revision ID: e4a7b2c9d610
+Revises: c81d5f3a9e27
+Create Date: 2026-10-17 15:00:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa  # noqa
+import sqlmodel  # noqa
+
+# revision identifiers, used by Alembic.
+revision = "e4a7b2c9d610"
+down_revision = "c81d5f3a9e27"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "messages",
+        sa.Column(
+            "content_type",
+            sa.String(),
+            nullable=False,
+            server_default="application/json",
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("messages", "content_type")
@@ -0,0 +1,50 @@
+"""ordering keys
+
+Revision ID: 3b6e9f1a7d52
+Revises: e4a7b2c9d610
+Create Date: 2026-10-17 16:00:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa  # noqa
+import sqlmodel  # noqa
+
+# revision identifiers, used by Alembic.
+revision = "3b6e9f1a7d52"
+down_revision = "e4a7b2c9d610"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "subscriptions",
+        sa.Column(
+            "enable_message_ordering",
+            sa.Boolean(),
+            nullable=False,
+            server_default=sa.false(),
+        ),
+    )
+    op.add_column("messages", sa.Column("ordering_key", sa.String(), nullable=True))
+    op.add_column(
+        "deliveries",
+        sa.Column(
+            "ordering_key", sqlmodel.sql.sqltypes.AutoString(), nullable=True
+        ),
+    )
+    op.create_index(
+        "ix_deliveries_subscription_id_ordering_key_status",
+        "deliveries",
+        ["subscription_id", "ordering_key", "status"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "ix_deliveries_subscription_id_ordering_key_status", table_name="deliveries"
+    )
+    op.drop_column("deliveries", "ordering_key")
+    op.drop_column("messages", "ordering_key")
+    op.drop_column("subscriptions", "enable_message_ordering")
@@ -0,0 +1,34 @@
+"""idempotency keys
+
+Revision ID: 8d2c4e6f1b93
+Revises: 3b6e9f1a7d52
+Create Date: 2026-10-17 17:00:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa  # noqa
+import sqlmodel  # noqa
+
+# revision identifiers, used by Alembic.
+revision = "8d2c4e6f1b93"
+down_revision = "3b6e9f1a7d52"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "messages", sa.Column("idempotency_key", sa.String(), nullable=True)
+    )
+    op.create_unique_constraint(
+        "uq_messages_topic_id_idempotency_key",
+        "messages",
+        ["topic_id", "idempotency_key"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint(
+        "uq_messages_topic_id_idempotency_key", "messages", type_="unique"
+    )
+    op.drop_column("messages", "idempotency_key")
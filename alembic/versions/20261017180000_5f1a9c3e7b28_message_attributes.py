@@ -0,0 +1,38 @@
+"""message attributes and subscription filters
+
+Revision ID: 5f1a9c3e7b28
+Revises: 8d2c4e6f1b93
+Create Date: 2026-10-17 18:00:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa  # noqa
+import sqlmodel  # noqa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "5f1a9c3e7b28"
+down_revision = "8d2c4e6f1b93"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "messages",
+        sa.Column(
+            "attributes",
+            postgresql.JSONB(astext_type=sa.Text()),
+            nullable=False,
+            server_default="{}",
+        ),
+    )
+    op.add_column(
+        "subscriptions",
+        sa.Column("filter", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("subscriptions", "filter")
+    op.drop_column("messages", "attributes")
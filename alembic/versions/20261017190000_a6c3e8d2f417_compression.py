@@ -0,0 +1,35 @@
+"""compression
+
+Revision ID: a6c3e8d2f417
+Revises: 5f1a9c3e7b28
+Create Date: 2026-10-17 19:00:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa  # noqa
+import sqlmodel  # noqa
+
+# revision identifiers, used by Alembic.
+revision = "a6c3e8d2f417"
+down_revision = "5f1a9c3e7b28"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "messages", sa.Column("content_encoding", sa.String(), nullable=True)
+    )
+    op.add_column(
+        "subscriptions",
+        sa.Column(
+            "push_content_encoding",
+            sqlmodel.sql.sqltypes.AutoString(),
+            nullable=True,
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("subscriptions", "push_content_encoding")
+    op.drop_column("messages", "content_encoding")
@@ -0,0 +1,39 @@
+"""message retention
+
+Revision ID: c2e7f4a9d815
+Revises: a6c3e8d2f417
+Create Date: 2026-10-17 20:00:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa  # noqa
+import sqlmodel  # noqa
+
+# revision identifiers, used by Alembic.
+revision = "c2e7f4a9d815"
+down_revision = "a6c3e8d2f417"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "topics",
+        sa.Column(
+            "message_retention_duration_minutes",
+            sa.Integer(),
+            nullable=False,
+            server_default="10080",
+        ),
+    )
+    op.create_index(
+        "ix_messages_topic_id_created_at",
+        "messages",
+        ["topic_id", "created_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_messages_topic_id_created_at", table_name="messages")
+    op.drop_column("topics", "message_retention_duration_minutes")
@@ -0,0 +1,212 @@
+"""partitioned messages
+
+Revision ID: d94b1e6c3a70
+Revises: c2e7f4a9d815
+Create Date: 2026-10-17 21:00:00.000000+00:00
+
+"""
+from datetime import datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa  # noqa
+import sqlmodel  # noqa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "d94b1e6c3a70"
+down_revision = "c2e7f4a9d815"
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    "messages": {
+        "ix_messages_id": ["id"],
+        "ix_messages_topic_id": ["topic_id"],
+        "ix_messages_topic_id_sequence": ["topic_id", "sequence"],
+        "ix_messages_topic_id_created_at": ["topic_id", "created_at"],
+    },
+    "deliveries": {
+        "ix_deliveries_id": ["id"],
+        "ix_deliveries_message_id": ["message_id"],
+        "ix_deliveries_subscription_id": ["subscription_id"],
+        "ix_deliveries_status_next_attempt_at": ["status", "next_attempt_at"],
+        "ix_deliveries_subscription_id_ordering_key_status": [
+            "subscription_id",
+            "ordering_key",
+            "status",
+        ],
+    },
+}
+
+
+def upgrade() -> None:
+    # the existing tables become the partition of everything published until
+    # the end of today, so no rows are copied
+    today = datetime.utcnow().date()
+    legacy = {table: f"{table}_p{today:%Y%m%d}" for table in INDEXES}
+    tomorrow = today + timedelta(days=1)
+
+    op.add_column("deliveries", sa.Column("published_at", sa.DateTime(), nullable=True))
+    op.execute(
+        "UPDATE deliveries SET published_at = messages.created_at "
+        "FROM messages WHERE messages.id = deliveries.message_id"
+    )
+    op.alter_column("deliveries", "published_at", nullable=False)
+    op.drop_constraint(
+        "fk_deliveries_message_id_messages", "deliveries", type_="foreignkey"
+    )
+
+    op.create_table(
+        "idempotency_keys",
+        sa.Column("topic_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("idempotency_key", sa.String(), nullable=False),
+        sa.Column("message_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["topic_id"], ["topics.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("topic_id", "idempotency_key"),
+    )
+    op.create_index(
+        op.f("ix_idempotency_keys_created_at"),
+        "idempotency_keys",
+        ["created_at"],
+        unique=False,
+    )
+    op.execute(
+        "INSERT INTO idempotency_keys "
+        "(topic_id, idempotency_key, message_id, created_at) "
+        "SELECT topic_id, idempotency_key, id, created_at FROM messages "
+        "WHERE idempotency_key IS NOT NULL"
+    )
+    op.drop_constraint(
+        "uq_messages_topic_id_idempotency_key", "messages", type_="unique"
+    )
+
+    op.execute("ALTER TABLE messages ALTER COLUMN sequence DROP IDENTITY")
+    op.execute("CREATE SEQUENCE messages_sequence_seq")
+    op.execute(
+        "SELECT setval('messages_sequence_seq', coalesce(max(sequence), 0) + 1, "
+        "false) FROM messages"
+    )
+
+    op.drop_constraint("pk_messages", "messages", type_="primary")
+    op.drop_constraint("pk_deliveries", "deliveries", type_="primary")
+    op.drop_constraint("uq_deliveries_message_id", "deliveries", type_="unique")
+    for table, indexes in INDEXES.items():
+        op.rename_table(table, legacy[table])
+        # equivalent indexes are reused when the table is attached
+        for name in indexes:
+            op.execute(
+                f"ALTER INDEX {name} RENAME TO "
+                f"{legacy[table]}_{name[len(f'ix_{table}_'):]}_idx"
+            )
+        op.execute(
+            f"CREATE TABLE {table} (LIKE {legacy[table]} INCLUDING DEFAULTS) "
+            f"PARTITION BY RANGE "
+            f"({'created_at' if table == 'messages' else 'published_at'})"
+        )
+
+    op.execute(
+        "ALTER TABLE messages ALTER COLUMN sequence "
+        "SET DEFAULT nextval('messages_sequence_seq')"
+    )
+    op.execute("ALTER SEQUENCE messages_sequence_seq OWNED BY messages.sequence")
+    op.create_primary_key("pk_messages", "messages", ["created_at", "id"])
+    op.create_foreign_key(
+        "fk_messages_topic_id_topics",
+        "messages",
+        "topics",
+        ["topic_id"],
+        ["id"],
+        ondelete="CASCADE",
+    )
+    op.create_primary_key("pk_deliveries", "deliveries", ["published_at", "id"])
+    op.create_unique_constraint(
+        "uq_deliveries_message_id",
+        "deliveries",
+        ["message_id", "subscription_id", "published_at"],
+    )
+    op.create_foreign_key(
+        "fk_deliveries_subscription_id_subscriptions",
+        "deliveries",
+        "subscriptions",
+        ["subscription_id"],
+        ["id"],
+        ondelete="CASCADE",
+    )
+    for table, indexes in INDEXES.items():
+        for name, columns in indexes.items():
+            op.create_index(name, table, columns, unique=False)
+        op.execute(
+            f"ALTER TABLE {table} ATTACH PARTITION {legacy[table]} "
+            f"FOR VALUES FROM (MINVALUE) TO ('{tomorrow}')"
+        )
+        op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+
+def downgrade() -> None:
+    # partitions are copied back into plain tables
+    for table, indexes in INDEXES.items():
+        op.rename_table(table, f"{table}_partitioned")
+        op.execute(
+            f"CREATE TABLE {table} (LIKE {table}_partitioned INCLUDING DEFAULTS)"
+        )
+        if table == "messages":
+            op.execute("ALTER TABLE messages ALTER COLUMN sequence DROP DEFAULT")
+        op.execute(f"INSERT INTO {table} SELECT * FROM {table}_partitioned")
+        # also drops messages_sequence_seq, which it owns
+        op.execute(f"DROP TABLE {table}_partitioned")
+        for name, columns in indexes.items():
+            op.create_index(name, table, columns, unique=False)
+
+    op.execute(
+        "ALTER TABLE messages ALTER COLUMN sequence "
+        "ADD GENERATED BY DEFAULT AS IDENTITY"
+    )
+    op.execute(
+        "SELECT setval(pg_get_serial_sequence('messages', 'sequence'), "
+        "coalesce(max(sequence), 0) + 1, false) FROM messages"
+    )
+    op.create_primary_key("pk_messages", "messages", ["id"])
+    op.create_foreign_key(
+        "fk_messages_topic_id_topics",
+        "messages",
+        "topics",
+        ["topic_id"],
+        ["id"],
+        ondelete="CASCADE",
+    )
+    op.create_unique_constraint(
+        "uq_messages_topic_id_idempotency_key",
+        "messages",
+        ["topic_id", "idempotency_key"],
+    )
+    op.create_primary_key("pk_deliveries", "deliveries", ["id"])
+    op.create_unique_constraint(
+        "uq_deliveries_message_id",
+        "deliveries",
+        ["message_id", "subscription_id"],
+    )
+    # deliveries of dropped partitions may have outlived their messages
+    op.execute(
+        "DELETE FROM deliveries WHERE NOT EXISTS "
+        "(SELECT 1 FROM messages WHERE messages.id = deliveries.message_id)"
+    )
+    op.create_foreign_key(
+        "fk_deliveries_message_id_messages",
+        "deliveries",
+        "messages",
+        ["message_id"],
+        ["id"],
+        ondelete="CASCADE",
+    )
+    op.create_foreign_key(
+        "fk_deliveries_subscription_id_subscriptions",
+        "deliveries",
+        "subscriptions",
+        ["subscription_id"],
+        ["id"],
+        ondelete="CASCADE",
+    )
+    op.drop_column("deliveries", "published_at")
+    op.drop_index(op.f("ix_idempotency_keys_created_at"), table_name="idempotency_keys")
+    op.drop_table("idempotency_keys")
@@ -0,0 +1,54 @@
+"""topic partitions
+
+Revision ID: 1e5d8a3f6b49
+Revises: d94b1e6c3a70
+Create Date: 2026-10-17 22:00:00.000000+00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa  # noqa
+import sqlmodel  # noqa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "1e5d8a3f6b49"
+down_revision = "d94b1e6c3a70"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "deliveries",
+        sa.Column(
+            "partition_hash", sa.BigInteger(), nullable=False, server_default="0"
+        ),
+    )
+    # delivered and dead-lettered deliveries are never claimed again
+    op.execute(
+        "UPDATE deliveries SET partition_hash = "
+        "abs(hashtext(coalesce(ordering_key, message_id::text))::bigint) "
+        "WHERE status = 'pending'"
+    )
+    op.create_table(
+        "delivery_worker_heartbeats",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("heartbeat_at", sa.DateTime(), nullable=False),
+        sa.Column("partitions", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_delivery_worker_heartbeats_heartbeat_at"),
+        "delivery_worker_heartbeats",
+        ["heartbeat_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f("ix_delivery_worker_heartbeats_heartbeat_at"),
+        table_name="delivery_worker_heartbeats",
+    )
+    op.drop_table("delivery_worker_heartbeats")
+    op.drop_column("deliveries", "partition_hash")
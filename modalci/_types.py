@@ -1,19 +1,70 @@
 import base64
 import json
-import sys
+import re
 from datetime import datetime
 from enum import Enum, unique
 from typing import Dict, List, Optional
 
-from pydantic import BaseModel, Json, StrictInt, StrictStr, validator
+from pydantic import (
+    UUID4,
+    BaseModel,
+    ConstrainedStr,
+    Field,
+    Json,
+    StrictInt,
+    StrictStr,
+    root_validator,
+    validator,
+)
+
+from modalci.filters import ATTRIBUTE_KEY_PATTERN
+from settings import env
+
+MESSAGE_MAX_ATTRIBUTES = 100
 
 
 @unique
 class DeliveryType(str, Enum):
-    # PULL = "pull" – TODO: coming soon!
+    PULL = "pull"
     PUSH = "push"
 
 
+@unique
+class DeliveryStatus(str, Enum):
+    PENDING = "pending"
+    DELIVERED = "delivered"
+    DEAD_LETTERED = "dead_lettered"
+
+
+@unique
+class ContentEncoding(str, Enum):
+    IDENTITY = "identity"
+    GZIP = "gzip"
+    ZSTD = "zstd"
+
+
+@unique
+class BreakerState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+@unique
+class StreamRequestType(str, Enum):
+    CREDIT = "credit"
+    ACKNOWLEDGE = "acknowledge"
+    MODIFY_ACK_DEADLINE = "modify_ack_deadline"
+
+
+@unique
+class StreamResponseType(str, Enum):
+    MESSAGES = "messages"
+    ACKNOWLEDGED = "acknowledged"
+    MODIFIED = "modified"
+    ERROR = "error"
+
+
 class HealthResponse(BaseModel):
     message: StrictStr
     version: StrictStr
@@ -48,22 +99,249 @@ class JsonResponseLoggerMessage(BaseModel):
     body: Json
 
 
+class DeliveryClientStats(BaseModel):
+    http2: bool
+    requests: StrictInt
+    errors: StrictInt
+    connections: StrictInt
+    idle_connections: StrictInt
+    in_flight: Dict[str, StrictInt]
+
+
+class QueueWaitStats(BaseModel):
+    waits: StrictInt = 0
+    waiting: StrictInt = 0
+    in_flight: StrictInt = 0
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+
+class DeliveryLimiterStats(BaseModel):
+    queues: Dict[str, QueueWaitStats]
+
+
+class CircuitBreakerStats(BaseModel):
+    state: BreakerState
+    requests: StrictInt
+    failures: StrictInt
+    parked: StrictInt
+    open_until: Optional[datetime]
+
+
+class DeliveryBreakerStats(BaseModel):
+    hosts: Dict[str, CircuitBreakerStats]
+
+
+class PartitionLeaseStats(BaseModel):
+    worker_id: UUID4
+    workers: int
+    partitions: List[int]
+
+
+class Base64Data(str):
+    """Base64Data.
+
+    Base64Data is a base64 string that keeps the bytes it was decoded to when
+    it was validated, so they don't have to be decoded again.
+    """
+
+    decoded: bytes
+
+
+class AckId(ConstrainedStr):
+    """AckId.
+
+    AckId identifies one lease of a pulled message, as its delivery id and
+    delivery attempt, so a lease that expired can't act on a redelivery.
+    """
+
+    strict = True
+    regex = re.compile(
+        r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.[0-9]{1,9}$"
+    )
+
+
 class Message(BaseModel):
     data: StrictStr
+    ordering_key: Optional[StrictStr] = Field(None, min_length=1, max_length=1024)
+    idempotency_key: Optional[StrictStr] = Field(None, min_length=1, max_length=1024)
+    attributes: Dict[StrictStr, StrictStr] = {}
 
     @validator("data", pre=True, always=True)
-    def validate_data_is_less_than_10mb(cls: BaseModel, v: str) -> str:
-        if sys.getsizeof(v) > 10_000_000:
-            raise ValueError("Message data must be less than or equal to 10MB.")
+    def validate_data_max_bytes(cls: BaseModel, v: str) -> str:
+        if not isinstance(v, str):
+            return v
+        too_big = (
+            f"Message data must be less than or equal to {env.MESSAGE_MAX_BYTES} "
+            "bytes."
+        )
+        # the decoded length is estimated before decoding anything, then checked
+        if len(v) * 3 // 4 > env.MESSAGE_MAX_BYTES + 2:
+            raise ValueError(too_big)
+        decoded = base64.b64decode(v.encode("utf-8"))
+        if len(decoded) > env.MESSAGE_MAX_BYTES:
+            raise ValueError(too_big)
         try:
-            json.loads(base64.b64decode(v.encode("utf-8")).decode("utf-8"))
+            json.loads(decoded.decode("utf-8"))
         except json.JSONDecodeError:
             raise ValueError("Message data must be a valid base64 encoded JSON string.")
+        data = Base64Data(v)
+        data.decoded = decoded
+        return data
+
+    @validator("attributes")
+    def validate_attributes(cls: BaseModel, v: Dict[str, str]) -> Dict[str, str]:
+        if len(v) > MESSAGE_MAX_ATTRIBUTES:
+            raise ValueError(
+                f"A message can have at most {MESSAGE_MAX_ATTRIBUTES} attributes."
+            )
+        for key, value in v.items():
+            if not re.fullmatch(ATTRIBUTE_KEY_PATTERN, key) or len(key) > 256:
+                raise ValueError(
+                    "Attribute keys must be at most 256 letters, digits, "
+                    "underscores or hyphens."
+                )
+            if len(value) > 1024:
+                raise ValueError("Attribute values must be at most 1024 characters.")
         return v
 
+    def decoded(self) -> bytes:
+        if isinstance(self.data, Base64Data):
+            return self.data.decoded
+        return base64.b64decode(self.data.encode("utf-8"))
+
     class Config:
         schema_extra = {
             "example": {
                 "data": {"message": "Hello world!"},
+                "attributes": {"region": "us"},
             }
         }
+
+
+class BatchMessage(Message):
+    topic_id: Optional[UUID4]
+
+
+class BatchPublishRequest(BaseModel):
+    messages: List[BatchMessage]
+
+    @validator("messages")
+    def validate_messages_batch_size(
+        cls: BaseModel, v: List[BatchMessage]
+    ) -> List[BatchMessage]:
+        if not 1 <= len(v) <= env.PUBLISH_BATCH_MAX_MESSAGES:
+            raise ValueError(
+                "A batch must contain between 1 and "
+                f"{env.PUBLISH_BATCH_MAX_MESSAGES} messages."
+            )
+        return v
+
+
+class PublishResponse(BaseModel):
+    message_id: UUID4
+
+
+@unique
+class PublishStatus(str, Enum):
+    ACCEPTED = "accepted"
+    TOPIC_NOT_FOUND = "topic_not_found"
+
+
+class PublishResult(BaseModel):
+    status: PublishStatus
+    message_id: Optional[UUID4]
+
+
+class BatchPublishResponse(BaseModel):
+    results: List[PublishResult]
+
+
+class RedriveResponse(BaseModel):
+    redriven: StrictInt
+    expired: StrictInt
+
+
+class SeekRequest(BaseModel):
+    time: Optional[datetime]
+    message_id: Optional[UUID4]
+    max_messages_per_second: Optional[float] = Field(None, gt=0)
+
+    @root_validator(skip_on_failure=True)
+    def validate_time_or_message_id(cls: BaseModel, values: Dict) -> Dict:
+        if (values.get("time") is None) == (values.get("message_id") is None):
+            raise ValueError("Exactly one of time and message_id must be set.")
+        return values
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "time": "2026-10-17T00:00:00",
+                "max_messages_per_second": 100,
+            }
+        }
+
+
+class SeekResponse(BaseModel):
+    replayed: StrictInt
+    acknowledged: StrictInt
+
+
+class PullRequest(BaseModel):
+    max_messages: int = Field(100, ge=1, le=1000)
+    max_bytes: int = Field(10_000_000, ge=1)
+    wait_seconds: float = Field(0, ge=0, le=env.PULL_MAX_WAIT_SECONDS)
+
+
+class ReceivedMessage(BaseModel):
+    ack_id: AckId
+    message_id: UUID4
+    data: StrictStr
+    content_type: StrictStr
+    delivery_attempt: StrictInt
+    attributes: Dict[StrictStr, StrictStr]
+    publish_time: datetime
+
+
+class StreamedMessage(BaseModel):
+    message_id: UUID4
+    data: StrictStr
+    content_type: StrictStr
+    attributes: Dict[StrictStr, StrictStr]
+    publish_time: datetime
+
+
+class PullResponse(BaseModel):
+    received_messages: List[ReceivedMessage]
+
+
+class AcknowledgeRequest(BaseModel):
+    ack_ids: List[AckId]
+
+
+class AcknowledgeResponse(BaseModel):
+    acknowledged: StrictInt
+
+
+class ModifyAckDeadlineRequest(BaseModel):
+    ack_ids: List[AckId]
+    ack_deadline_seconds: int = Field(..., ge=0, le=600)
+
+
+class ModifyAckDeadlineResponse(BaseModel):
+    modified: StrictInt
+
+
+class StreamRequest(BaseModel):
+    type: StreamRequestType
+    credits: int = Field(0, ge=0)
+    ack_ids: List[AckId] = []
+    ack_deadline_seconds: int = Field(0, ge=0, le=600)
+
+
+class StreamResponse(BaseModel):
+    type: StreamResponseType
+    received_messages: Optional[List[ReceivedMessage]]
+    acknowledged: Optional[StrictInt]
+    modified: Optional[StrictInt]
+    detail: Optional[StrictStr]
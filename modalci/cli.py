@@ -1,8 +1,12 @@
+import os
+import tempfile
+
 import typer
 import uvicorn
 
 from const import APP_IMPORT_STRING, modalci
 from modalci import __version__
+from settings import env
 
 name = f"{modalci} {__version__}"
 
@@ -50,6 +54,9 @@ def _server(
     ),
 ) -> None:
     """Start the modalci server."""
+    if workers > 1 and env.METRICS_DIR is None:  # pragma: no cover
+        # the workers share a directory so that /metrics can sum them up
+        os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="modalci-metrics-")
     uvicorn.run(  # pragma: no cover
         app=APP_IMPORT_STRING,
         port=port,
@@ -59,6 +66,45 @@ def _server(
     )
 
 
+@app.command("worker")
+def _worker(
+    processes: int = typer.Option(
+        1,
+        "--processes",
+        min=1,
+        help="Number of delivery processes to run.",
+    ),
+    concurrency_per_process: int = typer.Option(
+        env.DELIVERY_WORKERS,
+        "--concurrency-per-process",
+        min=1,
+        help="Number of delivery workers each process runs.",
+    ),
+) -> None:
+    """Start modalci delivery workers, separate from the server.
+
+    Run the server with `DELIVERY_WORKERS=0` to leave push delivery to the
+    workers, so that publishing and delivery can be scaled independently.
+    The workers serve no HTTP, so `METRICS_DIR` must be set to a directory the
+    server reads too, for /metrics to report push delivery. If a process dies,
+    the others are stopped and the command exits with an error.
+    """
+    if env.METRICS_DIR is None:
+        typer.echo(
+            "METRICS_DIR must be set to a directory shared with the server, "
+            "for its /metrics to report push delivery.",
+            err=True,
+        )
+        raise typer.Exit(code=1)
+    from modalci.server.worker import run_processes
+
+    exit_code = run_processes(  # pragma: no cover
+        processes=processes,
+        workers=concurrency_per_process,
+    )
+    raise typer.Exit(code=exit_code)  # pragma: no cover
+
+
 @app.command("test")
 def _test() -> None:
     """coming soon!"""
@@ -1,23 +1,38 @@
-from typing import AsyncGenerator
+import time
+from typing import Any, AsyncGenerator
 
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from modalci.server.metrics import db_pool_checkout_wait_seconds
 from settings import env
 
+
+class _TimedQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self) -> Any:
+        start = time.perf_counter()
+        try:
+            return super()._do_get()  # type: ignore
+        finally:
+            db_pool_checkout_wait_seconds.observe(time.perf_counter() - start)
+
+
 async_psql_engine = create_async_engine(
     url=env.PSQL_URL,
+    poolclass=_TimedQueuePool,
     pool_size=env.PSQL_POOL_SIZE,
     max_overflow=env.PSQL_MAX_OVERFLOW,
     pool_pre_ping=env.PSQL_POOL_PRE_PING,
     future=True,
 )
 
+async_session = sessionmaker(
+    async_psql_engine, class_=AsyncSession, expire_on_commit=False
+)
+
 
 async def psql_db() -> AsyncGenerator:
-    async_session = sessionmaker(
-        async_psql_engine, class_=AsyncSession, expire_on_commit=False
-    )
     async with async_session() as session:
         yield session
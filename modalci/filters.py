@@ -0,0 +1,250 @@
+import re
+from functools import lru_cache
+from typing import (
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from uuid import UUID
+
+ATTRIBUTE_KEY_PATTERN = r"[A-Za-z0-9_\-]+"
+
+_TOKENS = re.compile(
+    r"\s*(?:"
+    rf"(?P<attribute>attributes\.{ATTRIBUTE_KEY_PATTERN})"
+    r'|(?P<string>"(?:[^"\\]|\\.)*")'
+    r"|(?P<keyword>AND|OR|NOT|IN)\b"
+    r"|(?P<operator>!=|=|\(|\)|,)"
+    r")"
+)
+
+# an anchor is an attribute key and the values it must have for a filter to
+# match, if there is one
+Anchor = Tuple[str, FrozenSet[str]]
+
+
+class FilterSyntaxError(ValueError):
+    pass
+
+
+class Equals(NamedTuple):
+    key: str
+    value: str
+
+    def matches(self, attributes: Dict[str, str]) -> bool:
+        return attributes.get(self.key) == self.value
+
+    def anchor(self) -> Optional[Anchor]:
+        return self.key, frozenset([self.value])
+
+
+class In(NamedTuple):
+    key: str
+    values: FrozenSet[str]
+
+    def matches(self, attributes: Dict[str, str]) -> bool:
+        return attributes.get(self.key) in self.values
+
+    def anchor(self) -> Optional[Anchor]:
+        return self.key, self.values
+
+
+class Not(NamedTuple):
+    operand: "Filter"
+
+    def matches(self, attributes: Dict[str, str]) -> bool:
+        return not self.operand.matches(attributes)
+
+    def anchor(self) -> Optional[Anchor]:
+        return None
+
+
+class And(NamedTuple):
+    operands: Tuple["Filter", ...]
+
+    def matches(self, attributes: Dict[str, str]) -> bool:
+        return all(operand.matches(attributes) for operand in self.operands)
+
+    def anchor(self) -> Optional[Anchor]:
+        # any one operand's anchor will do, the narrowest is the most selective
+        anchors = [
+            anchor
+            for anchor in (operand.anchor() for operand in self.operands)
+            if anchor is not None
+        ]
+        return min(anchors, key=lambda anchor: len(anchor[1]), default=None)
+
+
+class Or(NamedTuple):
+    operands: Tuple["Filter", ...]
+
+    def matches(self, attributes: Dict[str, str]) -> bool:
+        return any(operand.matches(attributes) for operand in self.operands)
+
+    def anchor(self) -> Optional[Anchor]:
+        # only anchored if every operand is anchored on the same key
+        anchors = [operand.anchor() for operand in self.operands]
+        keys = {anchor[0] for anchor in anchors if anchor is not None}
+        if None in anchors or len(keys) != 1:
+            return None
+        return keys.pop(), frozenset().union(
+            *(anchor[1] for anchor in anchors if anchor is not None)
+        )
+
+
+Filter = Union[Equals, In, Not, And, Or]
+
+
+class _Parser:
+    def __init__(self, expression: str) -> None:
+        self.expression = expression
+        self.tokens: List[Tuple[str, str, int]] = []
+        position = 0
+        while expression[position:].strip():
+            match = _TOKENS.match(expression, position)
+            if match is None or match.lastgroup is None:
+                raise FilterSyntaxError(
+                    f"Unexpected character at position {position} of the filter."
+                )
+            self.tokens.append(
+                (match.lastgroup, match.group(match.lastgroup), match.start())
+            )
+            position = match.end()
+        self.position = 0
+
+    def _peek(self) -> Optional[Tuple[str, str, int]]:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def _accept(self, value: str) -> bool:
+        token = self._peek()
+        if token is not None and token[0] in ("keyword", "operator"):
+            if token[1] == value:
+                self.position += 1
+                return True
+        return False
+
+    def _expect(self, kind: str, value: Optional[str] = None) -> str:
+        token = self._peek()
+        if token is None or token[0] != kind or value not in (None, token[1]):
+            expected = value or kind
+            if token is None:
+                raise FilterSyntaxError(
+                    f"Expected {expected} at the end of the filter."
+                )
+            raise FilterSyntaxError(
+                f"Expected {expected} at position {token[2]} of the filter."
+            )
+        self.position += 1
+        return token[1]
+
+    def _string(self) -> str:
+        return re.sub(r"\\(.)", r"\1", self._expect("string")[1:-1])
+
+    def parse(self) -> Filter:
+        expression = self._or()
+        token = self._peek()
+        if token is not None:
+            raise FilterSyntaxError(
+                f"Unexpected {token[1]} at position {token[2]} of the filter."
+            )
+        return expression
+
+    def _or(self) -> Filter:
+        operands = [self._and()]
+        while self._accept("OR"):
+            operands.append(self._and())
+        return operands[0] if len(operands) == 1 else Or(tuple(operands))
+
+    def _and(self) -> Filter:
+        operands = [self._not()]
+        while self._accept("AND"):
+            operands.append(self._not())
+        return operands[0] if len(operands) == 1 else And(tuple(operands))
+
+    def _not(self) -> Filter:
+        if self._accept("NOT"):
+            return Not(self._not())
+        if self._accept("("):
+            expression = self._or()
+            self._expect("operator", ")")
+            return expression
+        return self._comparison()
+
+    def _comparison(self) -> Filter:
+        key = self._expect("attribute")[len("attributes.") :]
+        if self._accept("="):
+            return Equals(key, self._string())
+        if self._accept("!="):
+            return Not(Equals(key, self._string()))
+        negate = self._accept("NOT")
+        self._expect("keyword", "IN")
+        self._expect("operator", "(")
+        values = {self._string()}
+        while self._accept(","):
+            values.add(self._string())
+        self._expect("operator", ")")
+        expression = In(key, frozenset(values))
+        return Not(expression) if negate else expression
+
+
+@lru_cache(maxsize=4096)
+def compile_filter(expression: str) -> Filter:
+    """Compile a subscription filter expression.
+
+    A filter compares a message's attributes with string literals, e.g.
+    `attributes.region = "us" AND attributes.kind IN ("a", "b")`, and supports
+    =, !=, IN, NOT IN, AND, OR, NOT and parentheses. A missing attribute is
+    never equal to anything.
+
+    Args:
+        expression (str): The filter expression.
+
+    Raises:
+        FilterSyntaxError: If the expression is not a valid filter.
+
+    Returns:
+        Filter: The compiled filter.
+    """
+    return _Parser(expression).parse()
+
+
+class FilterIndex:
+    """FilterIndex.
+
+    FilterIndex finds the subscriptions of a topic whose filters match a
+    message. Filters that can only match when an attribute has one of a few
+    values are indexed on those values, so a message is only checked against
+    the filters that could match it and the filters that can't be indexed.
+    """
+
+    def __init__(self, filters: Iterable[Tuple[UUID, Filter]]) -> None:
+        self._anchored: Dict[Tuple[str, str], List[Tuple[UUID, Filter]]] = {}
+        self._unanchored: List[Tuple[UUID, Filter]] = []
+        for subscription_id, filter in filters:
+            anchor = filter.anchor()
+            if anchor is None:
+                self._unanchored.append((subscription_id, filter))
+                continue
+            key, values = anchor
+            for value in values:
+                self._anchored.setdefault((key, value), []).append(
+                    (subscription_id, filter)
+                )
+
+    def match(self, attributes: Dict[str, str]) -> Set[UUID]:
+        candidates = list(self._unanchored)
+        for key, value in attributes.items():
+            candidates.extend(self._anchored.get((key, value), ()))
+        return {
+            subscription_id
+            for subscription_id, filter in candidates
+            if filter.matches(attributes)
+        }
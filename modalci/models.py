@@ -1,13 +1,28 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 from uuid import uuid4
 
 from pydantic import UUID4, AnyHttpUrl, BaseModel, validator
-from sqlalchemy import Column, DateTime, UniqueConstraint
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import (
+    DDL,
+    BigInteger,
+    Column,
+    DateTime,
+    Index,
+    LargeBinary,
+    Sequence,
+    String,
+    UniqueConstraint,
+    event,
+)
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 from sqlmodel import Field, ForeignKey, Relationship, SQLModel
 
-from modalci._types import DeliveryType
+from modalci._types import ContentEncoding, DeliveryStatus, DeliveryType
+from modalci.filters import compile_filter
+
+# messages and deliveries are kept for at most this long, see partitions.py
+MAX_MESSAGE_RETENTION_MINUTES = 7 * 24 * 60
 
 
 class TimestampsMixin(BaseModel):
@@ -84,6 +99,9 @@ class NamespaceRead(
 
 class BaseTopic(SQLModel):
     name: str
+    message_retention_duration_minutes: int = Field(
+        MAX_MESSAGE_RETENTION_MINUTES, ge=10, le=MAX_MESSAGE_RETENTION_MINUTES
+    )
 
     class Config:
         schema_extra = {
@@ -150,9 +168,31 @@ class TopicRead(
 class BaseSubscription(SQLModel):
     name: str
     delivery_type: DeliveryType
-    # TODO: needed for pull
-    # message_retention_duration_minutes: int = Field(..., ge=0, le=7 * 24 * 60)
     push_endpoint: Optional[AnyHttpUrl]
+    ack_deadline_seconds: int = Field(10, ge=1, le=600)
+    max_delivery_attempts: int = Field(5, ge=1, le=100)
+    min_backoff_seconds: float = Field(10.0, ge=0, le=600)
+    max_backoff_seconds: float = Field(600.0, ge=0, le=3600)
+    backoff_jitter: bool = True
+    max_message_age_seconds: int = Field(7 * 24 * 60 * 60, ge=1, le=7 * 24 * 60 * 60)
+    max_in_flight: Optional[int] = Field(
+        None,
+        ge=1,
+        description="Max concurrent push deliveries in each delivery process; "
+        "unlimited if unset.",
+    )
+    max_messages_per_second: Optional[float] = Field(
+        None,
+        gt=0,
+        description="Max push deliveries per second from each delivery process; "
+        "unlimited if unset.",
+    )
+    batch_max_messages: int = Field(1, ge=1, le=1000)
+    batch_max_bytes: int = Field(1_000_000, ge=1, le=10_000_000)
+    batch_max_linger_ms: int = Field(0, ge=0, le=60_000)
+    enable_message_ordering: bool = False
+    filter: Optional[str] = Field(None, max_length=4096)
+    push_content_encoding: Optional[ContentEncoding] = None
 
     @validator("push_endpoint", pre=True, always=True)
     def validate_push_endpoint_https(
@@ -163,6 +203,28 @@ class BaseSubscription(SQLModel):
             raise ValueError("push_endpoint must be a HTTPS URL")
         return v
 
+    @validator("max_backoff_seconds")
+    def validate_max_backoff_seconds(
+        cls,
+        v: float,
+        values: Dict,
+    ) -> float:
+        if v < values.get("min_backoff_seconds", 0):
+            raise ValueError(
+                "max_backoff_seconds must be greater than or equal to "
+                "min_backoff_seconds"
+            )
+        return v
+
+    @validator("filter")
+    def validate_filter(
+        cls,
+        v: Optional[str],
+    ) -> Optional[str]:
+        if v is not None:
+            compile_filter(v)
+        return v
+
     class Config:
         schema_extra = {
             "example": {
@@ -218,5 +280,258 @@ class SubscriptionRead(
     topic: Topic
 
 
+MESSAGE_SEQUENCE: Sequence = Sequence(
+    "messages_sequence_seq", metadata=SQLModel.metadata
+)
+
+
+class TopicMessage(
+    SQLModel,
+    UUIDMixin,
+    TimestampsMixin,
+    table=True,
+):
+    __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_topic_id_sequence", "topic_id", "sequence"),
+        Index("ix_messages_topic_id_created_at", "topic_id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+    # part of the primary key, which must include the partition key
+    created_at: Optional[datetime] = Field(
+        sa_column=Column(
+            DateTime,
+            default=datetime.utcnow,
+            primary_key=True,
+            nullable=False,
+        )
+    )
+
+    topic_id: UUID4 = Field(
+        sa_column=Column(
+            UUID(as_uuid=True),
+            ForeignKey(
+                "topics.id",
+                ondelete="CASCADE",
+            ),
+            index=True,
+            nullable=False,
+        ),
+    )
+    data: bytes = Field(
+        sa_column=Column(
+            LargeBinary,
+            nullable=False,
+        ),
+    )
+    content_type: str = Field(
+        default="application/json",
+        sa_column=Column(
+            String,
+            nullable=False,
+            server_default="application/json",
+        ),
+    )
+    content_encoding: Optional[str] = Field(
+        sa_column=Column(
+            String,
+            nullable=True,
+        ),
+    )
+    ordering_key: Optional[str] = Field(
+        sa_column=Column(
+            String,
+            nullable=True,
+        ),
+    )
+    idempotency_key: Optional[str] = Field(
+        sa_column=Column(
+            String,
+            nullable=True,
+        ),
+    )
+    attributes: Dict[str, str] = Field(
+        default_factory=dict,
+        sa_column=Column(
+            JSONB,
+            nullable=False,
+            server_default="{}",
+        ),
+    )
+    sequence: Optional[int] = Field(
+        sa_column=Column(
+            BigInteger,
+            server_default=MESSAGE_SEQUENCE.next_value(),
+            nullable=False,
+        ),
+    )
+
+
+class BaseDelivery(SQLModel):
+    status: DeliveryStatus = Field(
+        default=DeliveryStatus.PENDING,
+        nullable=False,
+    )
+    attempts: int = Field(
+        default=0,
+        nullable=False,
+    )
+    last_status_code: Optional[int]
+    last_error: Optional[str]
+
+
+class Delivery(
+    BaseDelivery,
+    UUIDMixin,
+    TimestampsMixin,
+    table=True,
+):
+    __tablename__ = "deliveries"
+
+    __table_args__ = (
+        UniqueConstraint(
+            "message_id",
+            "subscription_id",
+            "published_at",
+        ),
+        Index(
+            "ix_deliveries_status_next_attempt_at",
+            "status",
+            "next_attempt_at",
+        ),
+        Index(
+            "ix_deliveries_subscription_id_ordering_key_status",
+            "subscription_id",
+            "ordering_key",
+            "status",
+        ),
+        {"postgresql_partition_by": "RANGE (published_at)"},
+    )
+
+    # no foreign key to messages, since a delivery's partition is dropped along
+    # with its message's
+    message_id: UUID4 = Field(
+        sa_column=Column(
+            UUID(as_uuid=True),
+            index=True,
+            nullable=False,
+        ),
+    )
+    # the message's created_at, which deliveries are partitioned by
+    published_at: Optional[datetime] = Field(
+        sa_column=Column(
+            DateTime,
+            primary_key=True,
+            nullable=False,
+        )
+    )
+    # a hash of the message's ordering key, or of its id, that decides the
+    # topic partition the delivery is claimed from, see leases.py
+    partition_hash: int = Field(
+        default=0,
+        sa_column=Column(
+            BigInteger,
+            nullable=False,
+            server_default="0",
+        ),
+    )
+    subscription_id: UUID4 = Field(
+        sa_column=Column(
+            UUID(as_uuid=True),
+            ForeignKey(
+                "subscriptions.id",
+                ondelete="CASCADE",
+            ),
+            index=True,
+            nullable=False,
+        ),
+    )
+    next_attempt_at: Optional[datetime] = Field(
+        sa_column=Column(
+            DateTime,
+            default=datetime.utcnow,
+            nullable=False,
+        )
+    )
+    # copied from the message so ordered deliveries can be claimed in order
+    ordering_key: Optional[str] = Field(default=None, nullable=True)
+
+
+class IdempotencyKey(SQLModel, table=True):
+    __tablename__ = "idempotency_keys"
+
+    topic_id: UUID4 = Field(
+        sa_column=Column(
+            UUID(as_uuid=True),
+            ForeignKey(
+                "topics.id",
+                ondelete="CASCADE",
+            ),
+            primary_key=True,
+        ),
+    )
+    idempotency_key: str = Field(
+        sa_column=Column(
+            String,
+            primary_key=True,
+        ),
+    )
+    message_id: UUID4 = Field(
+        sa_column=Column(
+            UUID(as_uuid=True),
+            nullable=False,
+        ),
+    )
+    created_at: Optional[datetime] = Field(
+        sa_column=Column(
+            DateTime,
+            default=datetime.utcnow,
+            index=True,
+            nullable=False,
+        )
+    )
+
+
+class DeliveryWorkerHeartbeat(SQLModel, table=True):
+    __tablename__ = "delivery_worker_heartbeats"
+
+    id: UUID4 = Field(
+        sa_column=Column(
+            UUID(as_uuid=True),
+            primary_key=True,
+        ),
+    )
+    heartbeat_at: datetime = Field(
+        sa_column=Column(
+            DateTime,
+            index=True,
+            nullable=False,
+        )
+    )
+    partitions: int = Field(
+        default=0,
+        nullable=False,
+    )
+
+
+class DeliveryRead(
+    BaseDelivery,
+    UUIDMixin,
+    TimestampsMixin,
+):
+    message_id: UUID4
+    subscription_id: UUID4
+    next_attempt_at: datetime
+
+
+# rows land in the default partitions until their daily partition exists
+for _table in (TopicMessage.__table__, Delivery.__table__):  # type: ignore
+    event.listen(
+        _table,
+        "after_create",
+        DDL("CREATE TABLE %(table)s_default PARTITION OF %(table)s DEFAULT"),
+    )
+
 NamespaceRead.update_forward_refs()
 TopicRead.update_forward_refs()
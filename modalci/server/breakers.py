@@ -0,0 +1,140 @@
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, Optional
+from urllib.parse import urlsplit
+
+from modalci._types import BreakerState, CircuitBreakerStats, DeliveryBreakerStats
+from modalci.models import Subscription
+from settings import env
+
+
+class CircuitBreaker:
+    """CircuitBreaker.
+
+    CircuitBreaker tracks the outcome of recent push requests to one host. It
+    opens when at least min_requests of the last window_size requests were
+    made and failure_rate of them failed, and then refuses requests for
+    open_seconds. After that it is half-open and lets one trial request
+    through at a time: a success closes it again and a failure reopens it.
+    """
+
+    def __init__(
+        self,
+        window_size: int,
+        min_requests: int,
+        failure_rate: float,
+        open_seconds: float,
+    ) -> None:
+        self.window_size = window_size
+        self.min_requests = min_requests
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.state = BreakerState.CLOSED
+        self.parked = 0
+        self._outcomes: Deque[bool] = deque(maxlen=window_size)
+        self._failures = 0
+        self._open_until = 0.0
+        self._trial_in_flight = False
+
+    def _record_outcome(self, failed: bool) -> None:
+        if len(self._outcomes) == self._outcomes.maxlen:
+            self._failures -= self._outcomes[0]
+        self._outcomes.append(failed)
+        self._failures += failed
+
+    def _open(self) -> None:
+        self.state = BreakerState.OPEN
+        self._open_until = time.monotonic() + self.open_seconds
+        self._outcomes.clear()
+        self._failures = 0
+
+    def acquire(self) -> Optional[float]:
+        """Ask to send a request through the breaker.
+
+        Returns:
+            Optional[float]: None if the request may be sent, and the result
+                must then be passed to release, otherwise the seconds to wait
+                before trying again.
+        """
+        if self.state == BreakerState.OPEN:
+            remaining = self._open_until - time.monotonic()
+            if remaining > 0:
+                self.parked += 1
+                return remaining
+            self.state = BreakerState.HALF_OPEN
+        if self.state == BreakerState.HALF_OPEN:
+            if self._trial_in_flight:
+                self.parked += 1
+                return env.DELIVERY_POLL_INTERVAL_SECONDS
+            self._trial_in_flight = True
+        return None
+
+    def release(self, failed: Optional[bool]) -> None:
+        """Record the outcome of a request that acquire let through.
+
+        Args:
+            failed (Optional[bool]): Whether the request failed, or None if it
+                was abandoned before it had an outcome.
+        """
+        if self.state == BreakerState.HALF_OPEN and self._trial_in_flight:
+            self._trial_in_flight = False
+            if failed:
+                self._open()
+            elif failed is not None:
+                self.state = BreakerState.CLOSED
+            return
+        if failed is None or self.state != BreakerState.CLOSED:
+            return
+        self._record_outcome(failed)
+        requests = len(self._outcomes)
+        if (
+            requests >= self.min_requests
+            and self._failures >= self.failure_rate * requests
+        ):
+            self._open()
+
+    def stats(self) -> CircuitBreakerStats:
+        remaining = self._open_until - time.monotonic()
+        return CircuitBreakerStats(
+            state=self.state,
+            requests=len(self._outcomes),
+            failures=self._failures,
+            parked=self.parked,
+            open_until=datetime.utcnow() + timedelta(seconds=remaining)
+            if self.state == BreakerState.OPEN and remaining > 0
+            else None,
+        )
+
+
+class DeliveryBreakers:
+    """DeliveryBreakers.
+
+    DeliveryBreakers keeps a CircuitBreaker per push endpoint host, so that a
+    host that is down is shed instead of holding a connection and a sender
+    until every request to it times out. Breakers are per process.
+    """
+
+    def __init__(self) -> None:
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, subscription: Subscription) -> CircuitBreaker:
+        host = urlsplit(str(subscription.push_endpoint)).netloc
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                window_size=env.DELIVERY_BREAKER_WINDOW_SIZE,
+                min_requests=env.DELIVERY_BREAKER_MIN_REQUESTS,
+                failure_rate=env.DELIVERY_BREAKER_FAILURE_RATE,
+                open_seconds=env.DELIVERY_BREAKER_OPEN_SECONDS,
+            )
+            self._breakers[host] = breaker
+        return breaker
+
+    def stats(self) -> DeliveryBreakerStats:
+        return DeliveryBreakerStats(
+            hosts={host: breaker.stats() for host, breaker in self._breakers.items()}
+        )
+
+
+delivery_breakers = DeliveryBreakers()
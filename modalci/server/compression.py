@@ -0,0 +1,132 @@
+import zlib
+from typing import Optional, Tuple
+
+from modalci._types import ContentEncoding
+from modalci.server.log import log
+from settings import env
+
+READ_CHUNK_BYTES = 1_000_000
+
+
+class DecompressionError(ValueError):
+    pass
+
+
+class DecompressedTooLarge(DecompressionError):
+    pass
+
+
+class UnsupportedEncoding(DecompressionError):
+    pass
+
+
+def zstd_available() -> bool:
+    try:
+        import zstandard  # noqa
+    except ImportError:  # pragma: no cover
+        return False
+    return True
+
+
+def compress(data: bytes, encoding: ContentEncoding) -> bytes:
+    if encoding == ContentEncoding.GZIP:
+        compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+    if encoding == ContentEncoding.ZSTD:
+        import zstandard
+
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def _gunzip(data: bytes, max_bytes: int) -> bytes:
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    try:
+        # max_length stops inflating as soon as the data is too large
+        decompressed = decompressor.decompress(data, max_bytes + 1)
+        if len(decompressed) > max_bytes:
+            return decompressed
+        decompressed += decompressor.flush()
+    except zlib.error as e:
+        raise DecompressionError(f"Data is not valid gzip: {e}") from e
+    if not decompressor.eof:
+        raise DecompressionError("Data is not valid gzip: it is truncated.")
+    return decompressed
+
+
+def _unzstd(data: bytes, max_bytes: int) -> bytes:
+    import zstandard
+
+    chunks = []
+    size = 0
+    try:
+        with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+            while size <= max_bytes:
+                chunk = reader.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+    except zstandard.ZstdError as e:
+        raise DecompressionError(f"Data is not valid zstd: {e}") from e
+    return b"".join(chunks)
+
+
+def decompress(data: bytes, encoding: Optional[str], max_bytes: int) -> bytes:
+    """Decompress data, without ever inflating more than max_bytes of it.
+
+    Args:
+        data (bytes): The compressed data.
+        encoding (Optional[str]): The data's content encoding, None or
+            identity if it isn't compressed.
+        max_bytes (int): The most bytes the data may decompress to.
+
+    Raises:
+        DecompressedTooLarge: If the data decompresses to more than max_bytes.
+        UnsupportedEncoding: If the encoding is not supported.
+        DecompressionError: If the data is corrupt.
+
+    Returns:
+        bytes: The decompressed data.
+    """
+    if encoding in (None, ContentEncoding.IDENTITY):
+        return data
+    if encoding == ContentEncoding.GZIP:
+        decompressed = _gunzip(data, max_bytes=max_bytes)
+    elif encoding == ContentEncoding.ZSTD and zstd_available():
+        decompressed = _unzstd(data, max_bytes=max_bytes)
+    else:
+        raise UnsupportedEncoding(f"Unsupported content encoding {encoding}.")
+    if len(decompressed) > max_bytes:
+        raise DecompressedTooLarge(f"Data decompresses to over {max_bytes} bytes.")
+    return decompressed
+
+
+def storage_encoding() -> ContentEncoding:
+    encoding = ContentEncoding(env.MESSAGE_COMPRESSION)
+    if encoding == ContentEncoding.ZSTD and not zstd_available():  # pragma: no cover
+        log.warning("MESSAGE_COMPRESSION is zstd but zstandard is not installed")
+        return ContentEncoding.GZIP
+    return encoding
+
+
+def compress_for_storage(data: bytes) -> Tuple[bytes, Optional[str]]:
+    """Compress message data for storage, if it is worth it.
+
+    Args:
+        data (bytes): The message data.
+
+    Returns:
+        Tuple[bytes, Optional[str]]: The data to store and its content
+            encoding, None if it is stored uncompressed.
+    """
+    encoding = storage_encoding()
+    if (
+        encoding == ContentEncoding.IDENTITY
+        or len(data) < env.MESSAGE_COMPRESSION_MIN_BYTES
+    ):
+        return data, None
+    compressed = compress(data, encoding)
+    if len(compressed) >= len(data):
+        return data, None
+    return compressed, encoding.value
@@ -0,0 +1,108 @@
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from modalci._types import DeliveryClientStats
+from modalci.server.log import log
+from settings import env
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa
+    except ImportError:
+        return False
+    return True
+
+
+class DeliveryClient:
+    """DeliveryClient.
+
+    DeliveryClient owns one pooled httpx.AsyncClient that is shared by every
+    push delivery so that connections to subscriber hosts are kept alive and
+    reused across publishes. It is started and closed with the app.
+    """
+
+    def __init__(self) -> None:
+        self._client: Optional[httpx.AsyncClient] = None
+        self._transport: Optional[httpx.AsyncHTTPTransport] = None
+        self._http2 = False
+        self._in_flight: Dict[str, int] = {}
+        self._requests = 0
+        self._errors = 0
+
+    def _build_client(self) -> httpx.AsyncClient:
+        self._http2 = env.DELIVERY_HTTP2
+        if self._http2 and not _http2_available():  # pragma: no cover
+            log.warning("DELIVERY_HTTP2 is set but h2 is not installed, using HTTP/1.1")
+            self._http2 = False
+        self._transport = httpx.AsyncHTTPTransport(
+            http2=self._http2,
+            limits=httpx.Limits(
+                max_connections=env.DELIVERY_MAX_CONNECTIONS,
+                max_keepalive_connections=env.DELIVERY_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=env.DELIVERY_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+        )
+        return httpx.AsyncClient(
+            transport=self._transport,
+            timeout=httpx.Timeout(
+                connect=env.DELIVERY_CONNECT_TIMEOUT_SECONDS,
+                read=env.DELIVERY_READ_TIMEOUT_SECONDS,
+                write=env.DELIVERY_WRITE_TIMEOUT_SECONDS,
+                pool=env.DELIVERY_POOL_TIMEOUT_SECONDS,
+            ),
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+
+    async def start(self) -> None:
+        self.client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+        self._client = None
+        self._transport = None
+
+    async def post(
+        self,
+        url: str,
+        content: bytes,
+        headers: Dict[str, str],
+    ) -> httpx.Response:
+        host = urlsplit(url).netloc
+        self._requests += 1
+        self._in_flight[host] = self._in_flight.get(host, 0) + 1
+        try:
+            return await self.client.post(url, content=content, headers=headers)
+        except httpx.HTTPError:
+            self._errors += 1
+            raise
+        finally:
+            self._in_flight[host] -= 1
+            if self._in_flight[host] == 0:
+                del self._in_flight[host]
+
+    def stats(self) -> DeliveryClientStats:
+        # httpx does not expose its connection pool publicly, so read it off of
+        # the underlying httpcore pool when it is there.
+        connections = getattr(
+            getattr(self._transport, "_pool", None), "connections", []
+        )
+        return DeliveryClientStats(
+            http2=self._http2,
+            requests=self._requests,
+            errors=self._errors,
+            connections=len(connections),
+            idle_connections=len([c for c in connections if c.is_idle()]),
+            in_flight=dict(self._in_flight),
+        )
+
+
+delivery_client = DeliveryClient()
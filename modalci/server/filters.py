@@ -0,0 +1,57 @@
+import time
+from typing import Dict, NamedTuple
+from uuid import UUID
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from modalci.filters import FilterIndex, compile_filter
+from modalci.models import Subscription
+from settings import env
+
+
+class _TopicFilters(NamedTuple):
+    filter_index: FilterIndex
+    expires_at: float
+
+
+class SubscriptionFilters:
+    """SubscriptionFilters.
+
+    SubscriptionFilters keeps a FilterIndex of the filtered subscriptions of
+    each topic that is published to, so that publishing doesn't load or
+    compile any filters. An index is rebuilt when a filtered subscription of
+    its topic is created or deleted by any process, and at the latest after
+    ttl_seconds.
+    """
+
+    def __init__(self, ttl_seconds: float) -> None:
+        self.ttl_seconds = ttl_seconds
+        self._topics: Dict[UUID, _TopicFilters] = {}
+
+    def invalidate(self, topic_id: UUID) -> None:
+        self._topics.pop(topic_id, None)
+
+    async def get(self, topic_id: UUID, psql: AsyncSession) -> FilterIndex:
+        topic_filters = self._topics.get(topic_id)
+        if topic_filters is None or topic_filters.expires_at <= time.monotonic():
+            results = await psql.execute(
+                select(Subscription.id, Subscription.filter).where(
+                    Subscription.topic_id == topic_id,
+                    Subscription.filter.isnot(None),  # type: ignore
+                )
+            )
+            topic_filters = _TopicFilters(
+                filter_index=FilterIndex(
+                    (subscription_id, compile_filter(filter))
+                    for subscription_id, filter in results.all()
+                ),
+                expires_at=time.monotonic() + self.ttl_seconds,
+            )
+            self._topics[topic_id] = topic_filters
+        return topic_filters.filter_index
+
+
+subscription_filters = SubscriptionFilters(
+    ttl_seconds=env.SUBSCRIPTION_FILTERS_TTL_SECONDS
+)
@@ -0,0 +1,82 @@
+import asyncio
+from typing import Awaitable, Callable, Generic, List, Optional, Set, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class GroupCommit(Generic[T]):
+    """GroupCommit.
+
+    GroupCommit collects the items that concurrent requests submit for up to
+    max_delay_seconds, or until max_items are waiting, and passes them to write
+    together. They then share one transaction and one commit. Each request
+    waits until the write that includes its items has committed. If a shared
+    write fails, each request's items are written again on their own, so one
+    bad request doesn't fail the others.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[List[T]], Awaitable[None]],
+        max_items: int,
+        max_delay_seconds: float,
+    ) -> None:
+        self.write = write
+        self.max_items = max_items
+        self.max_delay_seconds = max_delay_seconds
+        self._pending: List[Tuple[List[T], asyncio.Future]] = []
+        self._size = 0
+        self._full: Optional[asyncio.Event] = None
+        self._flushes: Set[asyncio.Task] = set()
+
+    async def submit(self, items: List[T]) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((items, future))
+        self._size += len(items)
+        if self._full is None:
+            self._full = asyncio.Event()
+            flush = asyncio.create_task(self._flush(self._full))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+        if self._size >= self.max_items:
+            self._full.set()
+        await future
+
+    async def _flush(self, full: asyncio.Event) -> None:
+        try:
+            await asyncio.wait_for(full.wait(), timeout=self.max_delay_seconds)
+        except asyncio.TimeoutError:
+            pass
+        batch = self._pending
+        self._pending, self._size, self._full = [], 0, None
+        try:
+            await self.write([item for items, _ in batch for item in items])
+        except Exception as e:
+            if len(batch) == 1:
+                _resolve(batch[0][1], e)
+                return
+            for items, future in batch:
+                try:
+                    await self.write(items)
+                except Exception as error:
+                    _resolve(future, error)
+                else:
+                    _resolve(future)
+        else:
+            for _, future in batch:
+                _resolve(future)
+
+    async def stop(self) -> None:
+        if self._full is not None:
+            self._full.set()
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+
+
+def _resolve(future: asyncio.Future, error: Optional[Exception] = None) -> None:
+    # the request may have been cancelled while its items were written
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
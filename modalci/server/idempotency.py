@@ -0,0 +1,52 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from pydantic import UUID4
+
+from settings import env
+
+IdempotencyKey = Tuple[UUID4, str]
+
+
+class IdempotencyCache:
+    """IdempotencyCache.
+
+    IdempotencyCache remembers the message id each recently published
+    idempotency key was accepted as, for ttl_seconds and up to max_keys keys,
+    so that a producer retrying a publish is answered without a round trip.
+    The idempotency_keys table is what guarantees a key is only published
+    once across processes; a key missing from the cache is checked there.
+    """
+
+    def __init__(self, max_keys: int, ttl_seconds: float) -> None:
+        self.max_keys = max_keys
+        self.ttl_seconds = ttl_seconds
+        self._message_ids: "OrderedDict[IdempotencyKey, Tuple[UUID4, float]]" = (
+            OrderedDict()
+        )
+
+    def get(self, key: IdempotencyKey) -> Optional[UUID4]:
+        entry = self._message_ids.get(key)
+        if entry is None:
+            return None
+        message_id, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._message_ids[key]
+            return None
+        self._message_ids.move_to_end(key)
+        return message_id
+
+    def put(self, key: IdempotencyKey, message_id: UUID4) -> None:
+        if self.max_keys <= 0:
+            return
+        self._message_ids[key] = (message_id, time.monotonic() + self.ttl_seconds)
+        self._message_ids.move_to_end(key)
+        while len(self._message_ids) > self.max_keys:
+            self._message_ids.popitem(last=False)
+
+
+published_messages = IdempotencyCache(
+    max_keys=env.IDEMPOTENCY_CACHE_KEYS,
+    ttl_seconds=env.IDEMPOTENCY_CACHE_TTL_SECONDS,
+)
@@ -0,0 +1,184 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Optional, Set
+from uuid import uuid4
+
+from sqlalchemy import BigInteger, String, cast, delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql import ColumnElement
+
+from modalci._types import PartitionLeaseStats
+from modalci.models import DeliveryWorkerHeartbeat, TopicMessage
+from modalci.server.log import log
+from settings import env
+
+# an arbitrary advisory lock class id, the partition is the object id
+PARTITION_LOCK_CLASS_ID = 72_640_113
+# a process that missed this many heartbeats is considered gone
+MISSED_HEARTBEATS = 3
+
+# session level advisory locks survive a connection's return to a pool, so the
+# leases' connection is never pooled and closing it releases them
+async_lease_engine = create_async_engine(
+    url=env.PSQL_URL, poolclass=NullPool, future=True
+)
+
+
+def partition_hash() -> ColumnElement:
+    # messages with the same ordering key land in the same partition, so its
+    # owner delivers them in order
+    key = func.coalesce(
+        TopicMessage.ordering_key, cast(TopicMessage.id, String)  # type: ignore
+    )
+    return func.abs(cast(func.hashtext(key), BigInteger))
+
+
+def topic_partition(hash_column: ColumnElement) -> ColumnElement:
+    return hash_column % env.TOPIC_PARTITIONS
+
+
+class PartitionLeases:
+    """PartitionLeases.
+
+    Push deliveries are split into TOPIC_PARTITIONS topic partitions by the
+    hash of their message's ordering key, or of its id, and only the server
+    process that leases a partition claims its deliveries. A lease is a
+    session level advisory lock held on a dedicated connection outside of the
+    app's pool, so it is released as soon as the process or its connection
+    goes away.
+
+    Every process heartbeats into the delivery_worker_heartbeats table, and
+    takes its fair share of the partitions among the live processes. Processes
+    release the partitions over their share when another one joins, and the
+    partitions of a process that left are taken over once its heartbeat
+    expires. Only the deliveries' hash is stored, so the number of partitions
+    can be changed at any time.
+    """
+
+    def __init__(self) -> None:
+        self.worker_id = uuid4()
+        self.owned: Set[int] = set()
+        self.workers = 0
+        self._connection: Optional[AsyncConnection] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _lock(self, function: str, partition: int) -> bool:
+        assert self._connection is not None
+        results = await self._connection.execute(
+            text(f"SELECT {function}(:class_id, :partition)"),
+            {"class_id": PARTITION_LOCK_CLASS_ID, "partition": partition},
+        )
+        return bool(results.scalar())
+
+    async def rebalance(self) -> Set[int]:
+        if self._connection is None:
+            self._connection = await async_lease_engine.connect()
+        now = datetime.utcnow()
+        try:
+            await self._connection.execute(
+                pg_insert(DeliveryWorkerHeartbeat)
+                .values(id=self.worker_id, heartbeat_at=now, partitions=len(self.owned))
+                .on_conflict_do_update(
+                    index_elements=["id"],
+                    set_={"heartbeat_at": now, "partitions": len(self.owned)},
+                )
+            )
+            expired = now - timedelta(
+                seconds=env.TOPIC_PARTITION_REBALANCE_INTERVAL_SECONDS
+                * MISSED_HEARTBEATS
+            )
+            await self._connection.execute(
+                delete(DeliveryWorkerHeartbeat).where(
+                    DeliveryWorkerHeartbeat.heartbeat_at < expired  # type: ignore
+                )
+            )
+            workers: List = (
+                (
+                    await self._connection.execute(
+                        select(DeliveryWorkerHeartbeat.id).order_by(  # type: ignore
+                            DeliveryWorkerHeartbeat.id
+                        )
+                    )
+                )
+                .scalars()
+                .all()
+            )
+            await self._connection.commit()
+            self.workers = len(workers)
+            index = workers.index(self.worker_id)
+            share = env.TOPIC_PARTITIONS // self.workers + (
+                index < env.TOPIC_PARTITIONS % self.workers
+            )
+            # partitions left over from a larger TOPIC_PARTITIONS are released too
+            kept = sorted(p for p in self.owned if p < env.TOPIC_PARTITIONS)[:share]
+            for partition in self.owned - set(kept):
+                await self._lock("pg_advisory_unlock", partition)
+            self.owned = set(kept)
+            # each process starts looking at a different partition, so they don't
+            # all contend for the same ones
+            start = index * env.TOPIC_PARTITIONS // self.workers
+            for offset in range(env.TOPIC_PARTITIONS):
+                if len(self.owned) >= share:
+                    break
+                partition = (start + offset) % env.TOPIC_PARTITIONS
+                if partition not in self.owned and await self._lock(
+                    "pg_try_advisory_lock", partition
+                ):
+                    self.owned.add(partition)
+            await self._connection.commit()
+        except Exception:
+            # the leases go away with the connection
+            await self._close()
+            raise
+        return self.owned
+
+    async def _close(self) -> None:
+        self.owned = set()
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            await connection.close()
+
+    def stats(self) -> PartitionLeaseStats:
+        return PartitionLeaseStats(
+            worker_id=self.worker_id,
+            workers=self.workers,
+            partitions=sorted(self.owned),
+        )
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(env.TOPIC_PARTITION_REBALANCE_INTERVAL_SECONDS)
+            try:
+                await self.rebalance()
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # pragma: no cover
+                log.exception("Failed to rebalance topic partition leases.")
+
+    async def start(self) -> None:
+        try:
+            await self.rebalance()
+        except Exception:  # pragma: no cover
+            log.exception("Failed to lease topic partitions.")
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._connection is not None:
+            try:
+                await self._connection.execute(
+                    delete(DeliveryWorkerHeartbeat).where(
+                        DeliveryWorkerHeartbeat.id == self.worker_id  # type: ignore
+                    )
+                )
+                await self._connection.commit()
+            finally:
+                await self._close()
+
+
+partition_leases = PartitionLeases()
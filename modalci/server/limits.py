@@ -0,0 +1,185 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from modalci._types import DeliveryLimiterStats, QueueWaitStats
+from modalci.models import Subscription
+from settings import env
+
+
+class TokenBucket:
+    """TokenBucket.
+
+    TokenBucket hands out tokens at a fixed rate with bursts of up to capacity
+    tokens. Callers reserve a token up front and sleep until it is theirs, so
+    waiters are served in arrival order without polling.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    async def acquire(self, timeout: Optional[float] = None) -> None:
+        delay = self.reserve()
+        if timeout is not None and delay > timeout:
+            # hand the reservation back, the caller won't wait for it
+            self.tokens += 1
+            raise asyncio.TimeoutError
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.0)
+
+
+class DeliveryLimiter:
+    """DeliveryLimiter.
+
+    DeliveryLimiter enforces the max in-flight and messages-per-second limits
+    of each subscription and each destination host. Deliveries over a limit
+    wait their turn instead of being dropped, and the time spent waiting is
+    tracked per queue so the limits can be sized. Limits are per process, and
+    only the DELIVERY_LIMITER_MAX_QUEUES most recently used queues are kept.
+    """
+
+    def __init__(self) -> None:
+        self._semaphores: Dict[str, Tuple[int, asyncio.Semaphore]] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._stats: "OrderedDict[str, QueueWaitStats]" = OrderedDict()
+
+    def _semaphore(self, key: str, limit: int) -> asyncio.Semaphore:
+        current = self._semaphores.get(key)
+        if current is None or current[0] != limit:
+            current = (limit, asyncio.Semaphore(limit))
+            self._semaphores[key] = current
+        return current[1]
+
+    def _bucket(self, key: str, rate: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None or bucket.rate != rate:
+            bucket = TokenBucket(rate=rate)
+            self._buckets[key] = bucket
+        return bucket
+
+    def _queue_stats(self, key: str) -> QueueWaitStats:
+        stats = self._stats.get(key)
+        if stats is None:
+            self._prune()
+            stats = QueueWaitStats()
+            self._stats[key] = stats
+        else:
+            self._stats.move_to_end(key)
+        return stats
+
+    def _prune(self) -> None:
+        # makes room for one more queue; queues with waiters or requests in
+        # flight are never dropped, their semaphore is still in use
+        excess = len(self._stats) - env.DELIVERY_LIMITER_MAX_QUEUES + 1
+        if excess <= 0:
+            return
+        idle = [
+            key
+            for key, stats in self._stats.items()
+            if stats.waiting == 0 and stats.in_flight == 0
+        ]
+        for key in idle[:excess]:
+            del self._stats[key]
+            self._semaphores.pop(key, None)
+            self._buckets.pop(key, None)
+
+    @asynccontextmanager
+    async def _limit(
+        self,
+        key: str,
+        max_in_flight: Optional[int],
+        max_messages_per_second: Optional[float],
+        deadline: Optional[float],
+    ) -> AsyncIterator[None]:
+        stats = self._queue_stats(key)
+        stats.waiting += 1
+        start = time.monotonic()
+        acquired = False
+        semaphore: Optional[asyncio.Semaphore] = None
+        try:
+            if max_messages_per_second:
+                await self._bucket(key, max_messages_per_second).acquire(
+                    timeout=_remaining(deadline)
+                )
+            if max_in_flight:
+                semaphore = self._semaphore(key, max_in_flight)
+                if deadline is None or not semaphore.locked():
+                    await semaphore.acquire()
+                else:
+                    await asyncio.wait_for(
+                        semaphore.acquire(), timeout=_remaining(deadline)
+                    )
+            try:
+                acquired = True
+                wait = time.monotonic() - start
+                stats.waiting -= 1
+                stats.waits += 1
+                stats.total_wait_seconds += wait
+                stats.max_wait_seconds = max(stats.max_wait_seconds, wait)
+                stats.in_flight += 1
+                try:
+                    yield
+                finally:
+                    stats.in_flight -= 1
+            finally:
+                if semaphore is not None:
+                    semaphore.release()
+        finally:
+            if not acquired:
+                stats.waiting -= 1
+
+    @asynccontextmanager
+    async def acquire(
+        self, subscription: Subscription, timeout: Optional[float] = None
+    ) -> AsyncIterator[None]:
+        """Wait for the subscription's and its host's limits.
+
+        Raises asyncio.TimeoutError if the limits don't let the delivery through
+        within timeout seconds.
+        """
+        host = urlsplit(str(subscription.push_endpoint)).netloc
+        deadline = None if timeout is None else time.monotonic() + timeout
+        async with self._limit(
+            key=f"subscription:{subscription.id}",
+            max_in_flight=subscription.max_in_flight,
+            max_messages_per_second=subscription.max_messages_per_second,
+            deadline=deadline,
+        ):
+            async with self._limit(
+                key=f"host:{host}",
+                max_in_flight=env.DELIVERY_MAX_CONNECTIONS_PER_HOST,
+                max_messages_per_second=env.DELIVERY_MAX_MESSAGES_PER_SECOND_PER_HOST,
+                deadline=deadline,
+            ):
+                yield
+
+    def stats(self) -> DeliveryLimiterStats:
+        return DeliveryLimiterStats(
+            queues={k: v.copy() for k, v in self._stats.items()}
+        )
+
+
+delivery_limiter = DeliveryLimiter()
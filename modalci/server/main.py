@@ -8,10 +8,23 @@ from fastapi.staticfiles import StaticFiles
 from const import modalci
 from modalci import __version__
 from modalci.server import routers
+from modalci.server.delivery import delivery_client
+from modalci.server.metrics import http_request_duration_seconds, metrics
+from modalci.server.notify import message_listener
+from modalci.server.partitions import partition_maintenance
+from modalci.server.services import topics_service
+from modalci.server.utils import MaxBodySizeMiddleware, RequestDecompressionMiddleware
+from modalci.server.workers import delivery_workers
+from settings import env
 
 os.environ["TZ"] = "UTC"
 
 app = FastAPI(title=modalci, version=__version__)
+# compressed bodies are limited before and after they are decompressed
+app.add_middleware(
+    RequestDecompressionMiddleware, max_body_bytes=env.MAX_REQUEST_BODY_BYTES
+)
+app.add_middleware(MaxBodySizeMiddleware, max_body_bytes=env.MAX_REQUEST_BODY_BYTES)
 app.mount(
     path="/static",
     app=StaticFiles(directory="static"),
@@ -21,13 +34,42 @@ app.mount(
 app.include_router(routers.health_router)
 app.include_router(routers.namespace_router)
 app.include_router(routers.pubsub_router)
+app.include_router(routers.delivery_router)
 app.include_router(routers.home_router)
 
 
+@app.on_event("startup")
+async def _startup() -> None:
+    await metrics.start()
+    await delivery_client.start()
+    await delivery_workers.start()
+    await partition_maintenance.start()
+    if env.PSQL_LISTEN:
+        await message_listener.start()
+
+
+@app.on_event("shutdown")
+async def _shutdown() -> None:
+    await message_listener.stop()
+    await topics_service.group_commit.stop()
+    await partition_maintenance.stop()
+    await delivery_workers.stop()
+    await delivery_client.close()
+    await metrics.stop()
+
+
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next: Callable) -> Response:
     start_time = time.time()
     response = await call_next(request)
     process_time = time.time() - start_time
     response.headers["X-Process-Time-Seconds"] = str(process_time)
+    # the route's path template keeps the number of label values bounded
+    route = request.scope.get("route")
+    http_request_duration_seconds.observe(
+        process_time,
+        method=request.method,
+        route=getattr(route, "path", "unmatched"),
+        status_code=response.status_code,
+    )
     return response
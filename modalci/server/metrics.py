@@ -0,0 +1,296 @@
+import asyncio
+import json
+import os
+from bisect import bisect_left
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from modalci.server.log import log
+from settings import env
+
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+Labels = Tuple[str, ...]
+
+
+class _Metric:
+    type = ""
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Labels, Any] = {}
+
+    def _labels(self, labels: Dict[str, Any]) -> Labels:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self) -> List[Tuple[Labels, Any]]:
+        return list(self._values.items())
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._labels(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._labels(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name=name, documentation=documentation, labelnames=labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._labels(labels)
+        observed = self._values.get(key)
+        if observed is None:
+            # one count per bucket, one for +Inf, then the sum
+            observed = [0.0] * (len(self.buckets) + 2)
+            self._values[key] = observed
+        observed[bisect_left(self.buckets, value)] += 1
+        observed[-1] += value
+
+    def snapshot(self) -> List[Tuple[Labels, Any]]:
+        return [(labels, list(observed)) for labels, observed in self._values.items()]
+
+
+def _merge(
+    metric: _Metric, into: Dict[Labels, Any], labels: Labels, value: Any
+) -> None:
+    if isinstance(metric, Histogram):
+        merged = into.setdefault(labels, [0.0] * len(value))
+        for i, v in enumerate(value):
+            merged[i] += v
+    else:
+        into[labels] = into.get(labels, 0.0) + value
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # pragma: no cover
+        return True
+    return True
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class MetricsRegistry:
+    """MetricsRegistry.
+
+    MetricsRegistry holds the server's counters, gauges and histograms and
+    renders them in the Prometheus text format. Metrics are plain dicts only
+    ever updated from the event loop, so recording them takes no locks. With
+    several server processes, each one periodically writes a snapshot of its
+    metrics to METRICS_DIR and the metrics of every process are summed when
+    rendered; the gauges of processes that have exited are left out.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric: Any) -> Any:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> Dict[str, List[Tuple[Labels, Any]]]:
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(str(env.METRICS_DIR), f"{pid}.json")
+
+    def write_snapshot(self) -> None:
+        if env.METRICS_DIR is None:
+            return
+        path = self._snapshot_path(os.getpid())
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f"{path}.tmp", path)
+
+    def _snapshots(self) -> Iterator[Tuple[bool, Dict[str, List]]]:
+        yield True, self.snapshot()
+        if env.METRICS_DIR is None:
+            return
+        for filename in os.listdir(env.METRICS_DIR):
+            pid, ext = os.path.splitext(filename)
+            if ext != ".json" or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                with open(os.path.join(env.METRICS_DIR, filename)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):  # pragma: no cover
+                continue
+            yield _is_alive(int(pid)), snapshot
+
+    def render(self) -> str:
+        merged: Dict[str, Dict[Labels, Any]] = {name: {} for name in self._metrics}
+        for alive, snapshot in self._snapshots():
+            for name, values in snapshot.items():
+                metric = self._metrics.get(name)
+                if metric is None or (isinstance(metric, Gauge) and not alive):
+                    continue
+                for labels, value in values:
+                    _merge(metric, merged[name], tuple(labels), value)
+        lines: List[str] = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for labels, value in sorted(merged[name].items()):
+                if not isinstance(metric, Histogram):
+                    lines.append(
+                        f"{name}{_format_labels(metric.labelnames, labels)} {value}"
+                    )
+                    continue
+                cumulative = 0.0
+                for bound, count in zip(
+                    [*(str(b) for b in metric.buckets), "+Inf"], value[:-1]
+                ):
+                    cumulative += count
+                    bucket_labels = _format_labels(
+                        (*metric.labelnames, "le"), (*labels, bound)
+                    )
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                series = _format_labels(metric.labelnames, labels)
+                lines.append(f"{name}_sum{series} {value[-1]}")
+                lines.append(f"{name}_count{series} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    async def _flush(self) -> None:
+        while True:
+            await asyncio.sleep(env.METRICS_FLUSH_INTERVAL_SECONDS)
+            try:
+                self.write_snapshot()
+            except OSError:  # pragma: no cover
+                log.exception("Failed to write a metrics snapshot.")
+
+    async def start(self) -> None:
+        if env.METRICS_DIR is not None:
+            os.makedirs(env.METRICS_DIR, exist_ok=True)
+            self._task = asyncio.create_task(self._flush())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self.write_snapshot()
+
+
+metrics = MetricsRegistry()
+
+http_request_duration_seconds = metrics.histogram(
+    "modalci_http_request_duration_seconds",
+    "HTTP request latency by route.",
+    ["method", "route", "status_code"],
+)
+messages_published_total = metrics.counter(
+    "modalci_messages_published_total",
+    "Messages published, by topic.",
+    ["topic_id"],
+)
+messages_pulled_total = metrics.counter(
+    "modalci_messages_pulled_total",
+    "Messages handed out by pull and streaming pull, by subscription.",
+    ["subscription_id"],
+)
+push_requests_total = metrics.counter(
+    "modalci_push_requests_total",
+    "Push requests by subscription and response status code, or error.",
+    ["subscription_id", "status_code"],
+)
+push_messages_total = metrics.counter(
+    "modalci_push_messages_total",
+    "Messages sent in push requests, by subscription.",
+    ["subscription_id"],
+)
+push_messages_parked_total = metrics.counter(
+    "modalci_push_messages_parked_total",
+    "Messages not sent because their host's circuit breaker was open, by "
+    "subscription.",
+    ["subscription_id"],
+)
+push_request_duration_seconds = metrics.histogram(
+    "modalci_push_request_duration_seconds",
+    "Push request latency by subscription, including queueing for limits.",
+    ["subscription_id"],
+)
+push_requests_in_flight = metrics.gauge(
+    "modalci_push_requests_in_flight",
+    "Push requests currently being sent, by subscription.",
+    ["subscription_id"],
+)
+publish_group_commit_messages = metrics.histogram(
+    "modalci_publish_group_commit_messages",
+    "Messages written to the outbox per group commit.",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+db_pool_checkout_wait_seconds = metrics.histogram(
+    "modalci_db_pool_checkout_wait_seconds",
+    "Time spent waiting for a database connection from the pool.",
+)
@@ -0,0 +1,99 @@
+import asyncio
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Set
+from uuid import UUID
+
+import asyncpg
+from sqlalchemy.engine import make_url
+
+from modalci.server.filters import subscription_filters
+from modalci.server.log import log
+from modalci.server.workers import delivery_workers
+from settings import env
+
+NOTIFY_CHANNEL = "modalci_messages"
+SUBSCRIPTIONS_CHANNEL = "modalci_subscriptions"
+
+
+class Notifier:
+    """Notifier.
+
+    Notifier wakes up coroutines in this process that are waiting for new
+    messages on a topic, such as long-polling pulls. It is notified by local
+    publishes and by the MessageListener for publishes made by other
+    processes.
+    """
+
+    def __init__(self) -> None:
+        self._events: Dict[UUID, Set[asyncio.Event]] = {}
+
+    @contextmanager
+    def watch(self, topic_id: UUID) -> Iterator[asyncio.Event]:
+        event = asyncio.Event()
+        self._events.setdefault(topic_id, set()).add(event)
+        try:
+            yield event
+        finally:
+            events = self._events[topic_id]
+            events.discard(event)
+            if not events:
+                del self._events[topic_id]
+
+    def notify(self, topic_id: UUID) -> None:
+        for event in self._events.get(topic_id, ()):
+            event.set()
+
+
+class MessageListener:
+    """MessageListener.
+
+    MessageListener holds one Postgres connection that LISTENs for the
+    NOTIFY sent with every publish, and forwards it to the local Notifier and
+    delivery workers so they react to publishes made by any server process.
+    It also LISTENs for changes to filtered subscriptions, so that the topic's
+    subscription filters are reloaded.
+    """
+
+    def __init__(self) -> None:
+        self._task: Optional[asyncio.Task] = None
+
+    def _on_notify(self, connection: Any, pid: int, channel: str, payload: str) -> None:
+        if channel == SUBSCRIPTIONS_CHANNEL:
+            subscription_filters.invalidate(UUID(payload))
+            return
+        notifier.notify(UUID(payload))
+        delivery_workers.notify()
+
+    async def _listen(self) -> None:
+        dsn = make_url(env.PSQL_URL).set(drivername="postgresql")
+        while True:
+            try:
+                connection = await asyncpg.connect(
+                    dsn.render_as_string(hide_password=False)
+                )
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                await connection.add_listener(NOTIFY_CHANNEL, self._on_notify)
+                await connection.add_listener(SUBSCRIPTIONS_CHANNEL, self._on_notify)
+                try:
+                    await closed.wait()
+                finally:
+                    await connection.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # pragma: no cover
+                log.exception("Message listener lost its connection.")
+            await asyncio.sleep(env.DELIVERY_POLL_INTERVAL_SECONDS)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+
+notifier = Notifier()
+message_listener = MessageListener()
@@ -0,0 +1,75 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+from sqlalchemy import and_, exists, or_
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import ColumnElement
+
+from modalci._types import DeliveryStatus
+from modalci.models import Delivery, TopicMessage
+
+T = TypeVar("T")
+
+
+def in_order() -> ColumnElement:
+    """Filter deliveries down to the next one of each ordering key.
+
+    A delivery with an ordering key can only go out once every delivery of an
+    earlier message with the same key to the same subscription has been
+    delivered or dead-lettered. The query this is used in must select from
+    both Delivery and TopicMessage.
+
+    Returns:
+        ColumnElement: The filter clause.
+    """
+    earlier = aliased(Delivery)
+    earlier_message = aliased(TopicMessage)
+    return or_(
+        Delivery.ordering_key.is_(None),  # type: ignore
+        ~exists().where(
+            and_(
+                earlier.subscription_id == Delivery.subscription_id,
+                earlier.ordering_key == Delivery.ordering_key,
+                earlier.status == DeliveryStatus.PENDING,
+                earlier.message_id == earlier_message.id,
+                earlier.published_at == earlier_message.created_at,
+                earlier_message.sequence < TopicMessage.sequence,
+            )
+        ),
+    )
+
+
+class _Key:
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.waiters = 0
+
+
+class KeyedExecutor:
+    """KeyedExecutor.
+
+    KeyedExecutor runs coroutines with the same key one at a time, in the
+    order they were submitted, and coroutines with different keys in
+    parallel. A key is forgotten as soon as nothing is running or waiting on
+    it, so idle keys take no memory however many keys there are.
+    """
+
+    def __init__(self) -> None:
+        self._keys: Dict[Hashable, _Key] = {}
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        entry = self._keys.get(key)
+        if entry is None:
+            entry = _Key()
+            self._keys[key] = entry
+        entry.waiters += 1
+        try:
+            async with entry.lock:
+                return await fn()
+        finally:
+            entry.waiters -= 1
+            if entry.waiters == 0:
+                del self._keys[key]
+
+
+ordered_deliveries = KeyedExecutor()
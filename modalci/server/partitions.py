@@ -0,0 +1,158 @@
+import asyncio
+import re
+from datetime import date, datetime, timedelta
+from typing import Dict, NamedTuple, Optional
+
+from sqlalchemy import delete, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from modalci.db import async_session
+from modalci.models import MAX_MESSAGE_RETENTION_MINUTES, IdempotencyKey
+from modalci.server.log import log
+from settings import env
+
+# each table and the column it is range partitioned by
+PARTITIONED_TABLES = {"messages": "created_at", "deliveries": "published_at"}
+# an arbitrary key, so only one process at a time maintains the partitions
+PARTITION_LOCK_KEY = 7_261_840_195
+
+
+class MaintenanceResult(NamedTuple):
+    created: int = 0
+    dropped: int = 0
+
+
+def partition_name(table: str, day: date) -> str:
+    return f"{table}_p{day:%Y%m%d}"
+
+
+class PartitionMaintenance:
+    """PartitionMaintenance.
+
+    Messages and deliveries are range partitioned by the day a message was
+    published. PartitionMaintenance creates the partitions of the next
+    PARTITION_PRECREATE_DAYS days ahead of time, and drops a day's partitions
+    once every message in them is older than the longest a topic may retain
+    messages, which is as cheap as dropping a table whatever its size. Rows
+    without a daily partition land in the default partition, and are moved
+    into the day's partition when it is created.
+
+    A topic's shorter retention bounds what a seek replays, so expired messages
+    don't cost a DELETE each. Idempotency keys are kept for as long as the
+    messages they point to.
+    """
+
+    def __init__(self) -> None:
+        self._task: Optional[asyncio.Task] = None
+
+    async def _partitions(self, table: str, psql: AsyncSession) -> Dict[date, str]:
+        results = await psql.execute(
+            text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = CAST(:table AS regclass)"
+            ),
+            {"table": table},
+        )
+        pattern = re.compile(rf"^{table}_p(\d{{8}})$")
+        partitions = {}
+        for (name,) in results.all():
+            match = pattern.match(name)
+            if match is not None:
+                day = datetime.strptime(match.group(1), "%Y%m%d").date()
+                partitions[day] = name
+        return partitions
+
+    async def _create(
+        self, table: str, column: str, day: date, psql: AsyncSession
+    ) -> None:
+        start, end = day, day + timedelta(days=1)
+        name = partition_name(table, day)
+        # creating the partition locks the default one anyway, taking the lock
+        # first keeps rows for the day from landing there in the meantime
+        await psql.execute(text(f"LOCK TABLE {table}_default IN ACCESS EXCLUSIVE MODE"))
+        # a partition can't be created over rows in the default one, so they
+        # are moved out and back into the new partition
+        await psql.execute(
+            text(
+                f"CREATE TEMPORARY TABLE {name}_moved "
+                f"(LIKE {table}_default) ON COMMIT DROP"
+            )
+        )
+        moved = await psql.execute(
+            text(
+                f"WITH moved AS (DELETE FROM {table}_default "
+                f"WHERE {column} >= :start AND {column} < :end RETURNING *) "
+                f"INSERT INTO {name}_moved SELECT * FROM moved"
+            ),
+            {"start": start, "end": end},
+        )
+        await psql.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {name} "
+                f"PARTITION OF {table} FOR VALUES FROM ('{start}') TO ('{end}')"
+            )
+        )
+        count = moved.rowcount  # type: ignore
+        if count:
+            await psql.execute(text(f"INSERT INTO {table} SELECT * FROM {name}_moved"))
+            log.warning(f"Moved {count} rows from {table}_default to {name}.")
+
+    async def run_once(self) -> MaintenanceResult:
+        now = datetime.utcnow()
+        expired_before = now - timedelta(minutes=MAX_MESSAGE_RETENTION_MINUTES)
+        created = dropped = 0
+        async with async_session() as psql:
+            locked = await psql.execute(
+                text("SELECT pg_try_advisory_xact_lock(:key)"),
+                {"key": PARTITION_LOCK_KEY},
+            )
+            if not locked.scalar():
+                return MaintenanceResult()
+            # don't stall publishes if a partition is busy, try again next time
+            await psql.execute(text("SET LOCAL lock_timeout = '10s'"))
+            for table, column in PARTITIONED_TABLES.items():
+                partitions = await self._partitions(table=table, psql=psql)
+                for days in range(env.PARTITION_PRECREATE_DAYS + 1):
+                    day = now.date() + timedelta(days=days)
+                    if day not in partitions:
+                        await self._create(
+                            table=table, column=column, day=day, psql=psql
+                        )
+                        created += 1
+                for day, name in partitions.items():
+                    # the partition holds messages published before day + 1
+                    if day < expired_before.date():
+                        await psql.execute(text(f"DROP TABLE {name}"))
+                        dropped += 1
+            await psql.execute(
+                delete(IdempotencyKey).where(
+                    IdempotencyKey.created_at < expired_before  # type: ignore
+                )
+            )
+            await psql.commit()
+        return MaintenanceResult(created=created, dropped=dropped)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                result = await self.run_once()
+                if result.created or result.dropped:
+                    log.info(f"Partition maintenance: {result}")
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # pragma: no cover
+                log.exception("Failed to maintain message partitions.")
+            await asyncio.sleep(env.PARTITION_MAINTENANCE_INTERVAL_SECONDS)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+partition_maintenance = PartitionMaintenance()
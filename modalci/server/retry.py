@@ -0,0 +1,58 @@
+import random
+from datetime import datetime, timedelta
+
+from modalci.models import Delivery, Subscription, TopicMessage
+
+
+def backoff_seconds(subscription: Subscription, attempts: int) -> float:
+    """Get the delay before the next delivery attempt.
+
+    The delay doubles with every attempt, from the subscription's
+    min_backoff_seconds up to its max_backoff_seconds. With backoff_jitter the
+    delay is spread uniformly between the minimum and the exponential delay so
+    that deliveries which failed together don't all come back together.
+
+    Args:
+        subscription (Subscription): The subscription being delivered to.
+        attempts (int): The number of attempts made so far.
+
+    Returns:
+        float: Seconds to wait before the next attempt.
+    """
+    delay = min(
+        subscription.max_backoff_seconds,
+        subscription.min_backoff_seconds * 2 ** max(attempts - 1, 0),
+    )
+    if subscription.backoff_jitter:
+        return random.uniform(subscription.min_backoff_seconds, delay)
+    return delay
+
+
+def is_expired(
+    subscription: Subscription, message: TopicMessage, now: datetime
+) -> bool:
+    return message.created_at is not None and now - message.created_at > timedelta(
+        seconds=subscription.max_message_age_seconds
+    )
+
+
+def is_exhausted(
+    subscription: Subscription,
+    delivery: Delivery,
+    message: TopicMessage,
+    now: datetime,
+) -> bool:
+    """Check whether a failed delivery should be dead-lettered.
+
+    Args:
+        subscription (Subscription): The subscription being delivered to.
+        delivery (Delivery): The failed delivery.
+        message (TopicMessage): The message being delivered.
+        now (datetime): The current time.
+
+    Returns:
+        bool: True if the delivery is out of attempts or the message is too old.
+    """
+    return delivery.attempts >= subscription.max_delivery_attempts or is_expired(
+        subscription=subscription, message=message, now=now
+    )
@@ -1,16 +1,51 @@
+import json
 from datetime import datetime
-from typing import List, Optional
-
-from fastapi import APIRouter, Body, Depends, HTTPException, Request, Response
-from fastapi.responses import HTMLResponse
+from typing import List, Optional, Tuple
+
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    Header,
+    HTTPException,
+    Request,
+    Response,
+    WebSocket,
+    status,
+)
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from pydantic import UUID4
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from modalci import __version__
-from modalci._types import HealthResponse, Message
-from modalci.db import psql_db
+from modalci._types import (
+    AcknowledgeRequest,
+    AcknowledgeResponse,
+    BatchPublishRequest,
+    BatchPublishResponse,
+    DeliveryBreakerStats,
+    DeliveryClientStats,
+    DeliveryLimiterStats,
+    DeliveryType,
+    HealthResponse,
+    Message,
+    ModifyAckDeadlineRequest,
+    ModifyAckDeadlineResponse,
+    PartitionLeaseStats,
+    PublishResponse,
+    PublishResult,
+    PublishStatus,
+    PullRequest,
+    PullResponse,
+    RedriveResponse,
+    SeekRequest,
+    SeekResponse,
+)
+from modalci.db import async_session, psql_db
 from modalci.models import (
+    Delivery,
+    DeliveryRead,
     Namespace,
     NamespaceCreate,
     NamespaceRead,
@@ -21,20 +56,30 @@ from modalci.models import (
     TopicCreate,
     TopicRead,
 )
+from modalci.server.breakers import delivery_breakers
+from modalci.server.delivery import delivery_client
+from modalci.server.leases import partition_leases
+from modalci.server.limits import delivery_limiter
 from modalci.server.log import log
+from modalci.server.metrics import metrics
 from modalci.server.services import (
     namespace_service,
     subscriptions_service,
     topics_service,
 )
+from modalci.server.streams import SubscriptionStream, topic_broadcaster
 from modalci.server.utils import _APIRoute
+from settings import env
 
 home_router = APIRouter(route_class=_APIRoute, tags=["home"])
 health_router = APIRouter(route_class=_APIRoute, tags=["health"])
 namespace_router = APIRouter(route_class=_APIRoute, tags=["namespace"])
 pubsub_router = APIRouter(route_class=_APIRoute, tags=["pubsub"])
+delivery_router = APIRouter(route_class=_APIRoute, tags=["delivery"])
 templates = Jinja2Templates(directory="templates")
 
+RAW_CONTENT_TYPES = ("application/json", "application/octet-stream")
+
 
 @home_router.get("/", response_class=HTMLResponse)
 async def _index(request: Request) -> Response:
@@ -52,6 +97,59 @@ async def get_health() -> HealthResponse:
     return HealthResponse(message="⛵️", version=__version__, time=datetime.utcnow())
 
 
+@health_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    """Get the server's metrics in the Prometheus text format.
+
+    Returns:
+        PlainTextResponse: The metrics of every server process.
+    """
+    return PlainTextResponse(
+        content=metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@delivery_router.get("/delivery/stats", response_model=DeliveryClientStats)
+async def get_delivery_stats() -> DeliveryClientStats:
+    """Get the push delivery client connection pool stats.
+
+    Returns:
+        DeliveryClientStats: The push delivery client stats.
+    """
+    return delivery_client.stats()
+
+
+@delivery_router.get("/delivery/limits", response_model=DeliveryLimiterStats)
+async def get_delivery_limits() -> DeliveryLimiterStats:
+    """Get the queue wait stats of the per-subscription and per-host limits.
+
+    Returns:
+        DeliveryLimiterStats: The wait stats of each delivery queue.
+    """
+    return delivery_limiter.stats()
+
+
+@delivery_router.get("/delivery/breakers", response_model=DeliveryBreakerStats)
+async def get_delivery_breakers() -> DeliveryBreakerStats:
+    """Get the circuit breaker state of each push endpoint host.
+
+    Returns:
+        DeliveryBreakerStats: The circuit breaker stats of each host.
+    """
+    return delivery_breakers.stats()
+
+
+@delivery_router.get("/delivery/partitions", response_model=PartitionLeaseStats)
+async def get_delivery_partitions() -> PartitionLeaseStats:
+    """Get the topic partitions this server process leases.
+
+    Returns:
+        PartitionLeaseStats: The process's worker id, the number of live
+            processes and the partitions it claims deliveries from.
+    """
+    return partition_leases.stats()
+
+
 @namespace_router.post("/namespaces", response_model=NamespaceRead)
 async def create_namespaces(
     namespace_create: NamespaceCreate = Body(...),
@@ -306,32 +404,517 @@ async def delete_subscriptions(
     )
 
 
+@pubsub_router.get(
+    "/namespaces/{namespace_id}/topics/{topic_id}/subscriptions/{subscription_id}"
+    "/dead-letters",
+    response_model=List[DeliveryRead],
+)
+async def get_dead_letters(
+    namespace_id: UUID4,
+    topic_id: UUID4,
+    subscription_id: UUID4,
+    psql: AsyncSession = Depends(psql_db),
+) -> List[Delivery]:
+    """Get the dead-lettered deliveries of a subscription.
+
+    Args:
+        namespace_id (UUID4): The namespace id.
+        topic_id (UUID4): The topic id.
+        subscription_id (UUID4): The subscription id.
+
+    Returns:
+        List[Delivery]: The deliveries that ran out of attempts.
+    """
+    subscription = await subscriptions_service.get(
+        subscription_id=subscription_id,
+        topic_id=topic_id,
+        namespace_id=namespace_id,
+        psql=psql,
+    )
+    if subscription is None:
+        raise HTTPException(status_code=400, detail="Subscription not found.")
+    return await subscriptions_service.list_dead_letters(
+        subscription_id=subscription_id, psql=psql
+    )
+
+
+@pubsub_router.post(
+    "/namespaces/{namespace_id}/topics/{topic_id}/subscriptions/{subscription_id}"
+    "/redrive",
+    response_model=RedriveResponse,
+)
+async def redrive_dead_letters(
+    namespace_id: UUID4,
+    topic_id: UUID4,
+    subscription_id: UUID4,
+    psql: AsyncSession = Depends(psql_db),
+) -> RedriveResponse:
+    """Schedule every dead-lettered delivery of a subscription for delivery again.
+
+    Deliveries of messages older than the subscription's max_message_age_seconds
+    can't be delivered anymore, so they stay dead-lettered and are counted as
+    expired.
+
+    Args:
+        namespace_id (UUID4): The namespace id.
+        topic_id (UUID4): The topic id.
+        subscription_id (UUID4): The subscription id.
+
+    Returns:
+        RedriveResponse: The number of redriven and expired deliveries.
+    """
+    subscription = await subscriptions_service.get(
+        subscription_id=subscription_id,
+        topic_id=topic_id,
+        namespace_id=namespace_id,
+        psql=psql,
+    )
+    if subscription is None:
+        raise HTTPException(status_code=400, detail="Subscription not found.")
+    return await subscriptions_service.redrive(subscription=subscription, psql=psql)
+
+
+@pubsub_router.post(
+    "/namespaces/{namespace_id}/topics/{topic_id}/subscriptions/{subscription_id}"
+    "/seek",
+    response_model=SeekResponse,
+)
+async def seek_subscription(
+    namespace_id: UUID4,
+    topic_id: UUID4,
+    subscription_id: UUID4,
+    seek_request: SeekRequest = Body(...),
+    psql: AsyncSession = Depends(psql_db),
+) -> SeekResponse:
+    """Reset a subscription to a point in its topic's retained messages.
+
+    Messages published at or after the given time, or from the given message on,
+    are delivered again in publish order, at most max_messages_per_second of
+    them a second. Earlier messages are acknowledged. Replayed messages older
+    than the subscription's max_message_age_seconds are dead-lettered.
+
+    Args:
+        namespace_id (UUID4): The namespace id.
+        topic_id (UUID4): The topic id.
+        subscription_id (UUID4): The subscription id.
+        seek_request (SeekRequest): The time or message id to seek to.
+
+    Returns:
+        SeekResponse: The number of replayed and acknowledged messages.
+    """
+    subscription = await subscriptions_service.get(
+        subscription_id=subscription_id,
+        topic_id=topic_id,
+        namespace_id=namespace_id,
+        psql=psql,
+    )
+    if subscription is None:
+        raise HTTPException(status_code=400, detail="Subscription not found.")
+    sequence = None
+    if seek_request.message_id is not None:
+        message = await topics_service.get_message(
+            message_id=seek_request.message_id, topic_id=topic_id, psql=psql
+        )
+        if message is None:
+            raise HTTPException(status_code=400, detail="Message not found.")
+        sequence = message.sequence
+    return await subscriptions_service.seek(
+        subscription=subscription,
+        max_messages_per_second=seek_request.max_messages_per_second
+        or env.SEEK_MAX_MESSAGES_PER_SECOND,
+        timestamp=seek_request.time,
+        sequence=sequence,
+        psql=psql,
+    )
+
+
+async def _get_pull_subscription(
+    namespace_id: UUID4,
+    topic_id: UUID4,
+    subscription_id: UUID4,
+    psql: AsyncSession,
+) -> Subscription:
+    subscription = await subscriptions_service.get(
+        subscription_id=subscription_id,
+        topic_id=topic_id,
+        namespace_id=namespace_id,
+        psql=psql,
+    )
+    if subscription is None:
+        raise HTTPException(status_code=400, detail="Subscription not found.")
+    if subscription.delivery_type != DeliveryType.PULL:
+        raise HTTPException(
+            status_code=400, detail="Subscription is not a pull subscription."
+        )
+    return subscription
+
+
+@pubsub_router.post(
+    "/namespaces/{namespace_id}/topics/{topic_id}/subscriptions/{subscription_id}"
+    "/pull",
+    response_model=PullResponse,
+)
+async def pull_messages(
+    namespace_id: UUID4,
+    topic_id: UUID4,
+    subscription_id: UUID4,
+    pull_request: PullRequest = Body(...),
+    psql: AsyncSession = Depends(psql_db),
+) -> PullResponse:
+    """Pull messages from a pull subscription.
+
+    Pulled messages are leased to the caller for the subscription's
+    ack_deadline_seconds and are delivered again if they are not acknowledged
+    in time. Leases are taken with SKIP LOCKED so that many consumers can pull
+    from one subscription in parallel. With wait_seconds the request waits
+    for messages to be published instead of returning empty right away.
+
+    Args:
+        namespace_id (UUID4): The namespace id.
+        topic_id (UUID4): The topic id.
+        subscription_id (UUID4): The subscription id.
+        pull_request (PullRequest): How many messages and bytes to pull, and
+            how long to wait for them.
+
+    Returns:
+        PullResponse: The pulled messages.
+    """
+    subscription = await _get_pull_subscription(
+        namespace_id=namespace_id,
+        topic_id=topic_id,
+        subscription_id=subscription_id,
+        psql=psql,
+    )
+    received_messages = await subscriptions_service.pull(
+        subscription=subscription,
+        max_messages=pull_request.max_messages,
+        max_bytes=pull_request.max_bytes,
+        psql=psql,
+        wait_seconds=pull_request.wait_seconds,
+    )
+    return PullResponse(received_messages=received_messages)
+
+
+@pubsub_router.post(
+    "/namespaces/{namespace_id}/topics/{topic_id}/subscriptions/{subscription_id}"
+    "/acknowledge",
+    response_model=AcknowledgeResponse,
+)
+async def acknowledge_messages(
+    namespace_id: UUID4,
+    topic_id: UUID4,
+    subscription_id: UUID4,
+    acknowledge_request: AcknowledgeRequest = Body(...),
+    psql: AsyncSession = Depends(psql_db),
+) -> AcknowledgeResponse:
+    """Acknowledge pulled messages so they are not delivered again.
+
+    Args:
+        namespace_id (UUID4): The namespace id.
+        topic_id (UUID4): The topic id.
+        subscription_id (UUID4): The subscription id.
+        acknowledge_request (AcknowledgeRequest): The ack ids to acknowledge.
+
+    Returns:
+        AcknowledgeResponse: The number of acknowledged messages.
+    """
+    await _get_pull_subscription(
+        namespace_id=namespace_id,
+        topic_id=topic_id,
+        subscription_id=subscription_id,
+        psql=psql,
+    )
+    acknowledged = await subscriptions_service.acknowledge(
+        subscription_id=subscription_id,
+        ack_ids=acknowledge_request.ack_ids,
+        psql=psql,
+    )
+    return AcknowledgeResponse(acknowledged=acknowledged)
+
+
+@pubsub_router.post(
+    "/namespaces/{namespace_id}/topics/{topic_id}/subscriptions/{subscription_id}"
+    "/modify-ack-deadline",
+    response_model=ModifyAckDeadlineResponse,
+)
+async def modify_ack_deadline(
+    namespace_id: UUID4,
+    topic_id: UUID4,
+    subscription_id: UUID4,
+    modify_ack_deadline_request: ModifyAckDeadlineRequest = Body(...),
+    psql: AsyncSession = Depends(psql_db),
+) -> ModifyAckDeadlineResponse:
+    """Extend or shorten the lease of pulled messages.
+
+    A deadline of 0 seconds makes the messages available to pull again right
+    away.
+
+    Args:
+        namespace_id (UUID4): The namespace id.
+        topic_id (UUID4): The topic id.
+        subscription_id (UUID4): The subscription id.
+        modify_ack_deadline_request (ModifyAckDeadlineRequest): The ack ids and
+            their new deadline.
+
+    Returns:
+        ModifyAckDeadlineResponse: The number of modified leases.
+    """
+    await _get_pull_subscription(
+        namespace_id=namespace_id,
+        topic_id=topic_id,
+        subscription_id=subscription_id,
+        psql=psql,
+    )
+    modified = await subscriptions_service.modify_ack_deadline(
+        subscription_id=subscription_id,
+        ack_ids=modify_ack_deadline_request.ack_ids,
+        ack_deadline_seconds=modify_ack_deadline_request.ack_deadline_seconds,
+        psql=psql,
+    )
+    return ModifyAckDeadlineResponse(modified=modified)
+
+
+@pubsub_router.websocket(
+    "/namespaces/{namespace_id}/topics/{topic_id}/subscriptions/{subscription_id}"
+    "/stream"
+)
+async def stream_messages(
+    websocket: WebSocket,
+    namespace_id: UUID4,
+    topic_id: UUID4,
+    subscription_id: UUID4,
+) -> None:
+    """Stream messages from a pull subscription over a WebSocket.
+
+    The client sends JSON frames to grant credits ({"type": "credit",
+    "credits": n}), acknowledge messages ({"type": "acknowledge", "ack_ids":
+    [...]}) and modify ack deadlines ({"type": "modify_ack_deadline",
+    "ack_ids": [...], "ack_deadline_seconds": n}). The server sends each
+    message as soon as it is published, as long as the client has credits
+    left.
+
+    Args:
+        websocket (WebSocket): The client's WebSocket.
+        namespace_id (UUID4): The namespace id.
+        topic_id (UUID4): The topic id.
+        subscription_id (UUID4): The subscription id.
+    """
+    # the stream outlives any one request, so don't hold a session for it
+    async with async_session() as psql:
+        try:
+            subscription = await _get_pull_subscription(
+                namespace_id=namespace_id,
+                topic_id=topic_id,
+                subscription_id=subscription_id,
+                psql=psql,
+            )
+        except HTTPException as e:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=e.detail)
+            return
+    await websocket.accept()
+    await SubscriptionStream(websocket=websocket, subscription=subscription).run()
+
+
+@pubsub_router.get(
+    "/namespaces/{namespace_id}/topics/{topic_id}/stream",
+    response_class=StreamingResponse,
+)
+async def stream_topic(
+    namespace_id: UUID4,
+    topic_id: UUID4,
+    last_event_id: Optional[int] = Header(None),
+) -> StreamingResponse:
+    """Stream a topic's messages as Server-Sent Events.
+
+    Each event's id is the message's sequence in the topic, so a client that
+    reconnects with a Last-Event-ID header is first sent the messages it
+    missed from the message log.
+
+    Args:
+        namespace_id (UUID4): The namespace id.
+        topic_id (UUID4): The topic id.
+        last_event_id (Optional[int]): The id of the last event received.
+
+    Returns:
+        StreamingResponse: The event stream.
+    """
+    async with async_session() as psql:
+        topic = await topics_service.get(
+            topic_id=topic_id,
+            namespace_id=namespace_id,
+            psql=psql,
+            with_subscriptions=False,
+        )
+    if topic is None:
+        raise HTTPException(status_code=400, detail="Topic not found.")
+    return StreamingResponse(
+        topic_broadcaster.events(topic_id=topic.id, last_event_id=last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _get_publish_topic(namespace_id: UUID4, topic_id: UUID4) -> Topic:
+    # a publish waits for its group commit, which writes with a connection of
+    # its own, so the lookup's connection is returned to the pool before then
+    async with async_session() as psql:
+        namespace = await namespace_service.get(namespace_id=namespace_id, psql=psql)
+        if namespace is None:
+            raise HTTPException(status_code=400, detail="Namespace not found.")
+        topic = await topics_service.get(
+            topic_id=topic_id,
+            namespace_id=namespace_id,
+            psql=psql,
+            with_subscriptions=False,
+        )
+    if topic is None:
+        raise HTTPException(status_code=400, detail="Topic not found.")
+    return topic
+
+
 @pubsub_router.post(
     "/namespaces/{namespace_id}/topics/{topic_id}/publish",
-    response_model=None,
+    response_model=PublishResponse,
+    status_code=202,
 )
 async def publish_message_to_topic(
     namespace_id: UUID4,
     topic_id: UUID4,
     message: Message = Body(...),
-    psql: AsyncSession = Depends(psql_db),
-) -> None:
+) -> PublishResponse:
     """Publish a message to a topic in a namespace.
 
+    The message is written to the outbox in one commit with the messages of
+    concurrent publishes, and delivered to the topic's push subscriptions by
+    the background delivery workers.
+
     Args:
         namespace_id (UUID4): The namespace id.
         topic_id (UUID4): The topic id.
         message (Message): The message to publish.
 
     Returns:
-        None.
+        PublishResponse: The id of the accepted message.
     """
-    namespace = await namespace_service.get(namespace_id=namespace_id, psql=psql)
-    if namespace is None:
-        raise HTTPException(status_code=400, detail="Namespace not found.")
-    topic = await topics_service.get(
-        topic_id=topic_id, namespace_id=namespace_id, psql=psql
+    topic = await _get_publish_topic(namespace_id=namespace_id, topic_id=topic_id)
+    topic_message = await topics_service.publish_message(topic=topic, message=message)
+    return PublishResponse(message_id=topic_message.id)
+
+
+@pubsub_router.post(
+    "/namespaces/{namespace_id}/topics/{topic_id}/publish/raw",
+    response_model=PublishResponse,
+    status_code=202,
+)
+async def publish_raw_message_to_topic(
+    namespace_id: UUID4,
+    topic_id: UUID4,
+    request: Request,
+    ordering_key: Optional[str] = Header(
+        None, alias="X-Ordering-Key", min_length=1, max_length=1024
+    ),
+    idempotency_key: Optional[str] = Header(
+        None, alias="Idempotency-Key", min_length=1, max_length=1024
+    ),
+) -> PublishResponse:
+    """Publish the raw request body to a topic in a namespace.
+
+    The body is published as is, without base64 encoding, and is delivered
+    with the request's Content-Type, which must be application/json or
+    application/octet-stream. It may be sent gzip or zstd compressed, with a
+    Content-Encoding header.
+
+    Args:
+        namespace_id (UUID4): The namespace id.
+        topic_id (UUID4): The topic id.
+        request (Request): The request whose body is the message data.
+        ordering_key (Optional[str]): The message's ordering key, from the
+            X-Ordering-Key header.
+        idempotency_key (Optional[str]): The message's idempotency key, from
+            the Idempotency-Key header.
+
+    Returns:
+        PublishResponse: The id of the accepted message.
+    """
+    content_type = request.headers.get("content-type", "")
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type not in RAW_CONTENT_TYPES:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Content-Type must be one of {', '.join(RAW_CONTENT_TYPES)}.",
+        )
+    data = await request.body()
+    if len(data) > env.MESSAGE_MAX_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Message data must be at most {env.MESSAGE_MAX_BYTES} bytes.",
+        )
+    if media_type == "application/json":
+        try:
+            json.loads(data)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Message data is not JSON.")
+    topic = await _get_publish_topic(namespace_id=namespace_id, topic_id=topic_id)
+    topic_message = await topics_service.publish_raw_message(
+        topic=topic,
+        data=data,
+        content_type=content_type,
+        ordering_key=ordering_key,
+        idempotency_key=idempotency_key,
+    )
+    return PublishResponse(message_id=topic_message.id)
+
+
+@pubsub_router.post(
+    "/namespaces/{namespace_id}/topics/{topic_id}/publish/batch",
+    response_model=BatchPublishResponse,
+    status_code=202,
+)
+async def publish_messages_to_topics(
+    namespace_id: UUID4,
+    topic_id: UUID4,
+    batch: BatchPublishRequest = Body(...),
+) -> BatchPublishResponse:
+    """Publish a batch of messages to one or more topics in a namespace.
+
+    Messages without a topic_id are published to the topic in the path. All of
+    the topics are looked up with one query and every accepted message is
+    written to the outbox in one transaction.
+
+    Args:
+        namespace_id (UUID4): The namespace id.
+        topic_id (UUID4): The default topic id.
+        batch (BatchPublishRequest): The messages to publish.
+
+    Returns:
+        BatchPublishResponse: The status and id of each message, in order.
+    """
+    # closed before the group commit, see _get_publish_topic
+    async with async_session() as psql:
+        namespace = await namespace_service.get(namespace_id=namespace_id, psql=psql)
+        if namespace is None:
+            raise HTTPException(status_code=400, detail="Namespace not found.")
+        topics = await topics_service.get_many(
+            topic_ids={message.topic_id or topic_id for message in batch.messages},
+            namespace_id=namespace_id,
+            psql=psql,
+            with_subscriptions=False,
+        )
+    accepted: List[Tuple[Topic, Message]] = [
+        (topics[message.topic_id or topic_id], message)
+        for message in batch.messages
+        if (message.topic_id or topic_id) in topics
+    ]
+    topic_messages = iter(
+        await topics_service.publish_messages(messages=accepted) if accepted else []
+    )
+    return BatchPublishResponse(
+        results=[
+            PublishResult(
+                status=PublishStatus.ACCEPTED, message_id=next(topic_messages).id
+            )
+            if (message.topic_id or topic_id) in topics
+            else PublishResult(status=PublishStatus.TOPIC_NOT_FOUND, message_id=None)
+            for message in batch.messages
+        ]
     )
-    if topic is None:
-        raise HTTPException(status_code=400, detail="Topic not found.")
-    return await topics_service.publish_message(topic=topic, message=message)
@@ -1,21 +1,77 @@
 import asyncio
 import base64
-from typing import List, Optional
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
 
-import httpx
 from pydantic import UUID4
+from sqlalchemy import (
+    BigInteger,
+    DateTime,
+    Float,
+    Integer,
+    Interval,
+    String,
+    all_,
+    and_,
+    any_,
+    cast,
+    func,
+    insert,
+    literal,
+    literal_column,
+    or_,
+    text,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import defer, noload
+from sqlalchemy.sql import ColumnElement
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from modalci._types import Message
+from modalci._types import (
+    AckId,
+    DeliveryStatus,
+    DeliveryType,
+    Message,
+    ReceivedMessage,
+    RedriveResponse,
+    SeekResponse,
+)
+from modalci.db import async_session
+from modalci.filters import compile_filter
 from modalci.models import (
+    Delivery,
+    IdempotencyKey,
     Namespace,
     NamespaceCreate,
     Subscription,
     SubscriptionCreate,
     Topic,
     TopicCreate,
+    TopicMessage,
+)
+from modalci.server.compression import compress_for_storage, decompress
+from modalci.server.filters import subscription_filters
+from modalci.server.group_commit import GroupCommit
+from modalci.server.idempotency import published_messages
+from modalci.server.leases import partition_hash
+from modalci.server.metrics import (
+    messages_published_total,
+    messages_pulled_total,
+    publish_group_commit_messages,
 )
+from modalci.server.notify import NOTIFY_CHANNEL, SUBSCRIPTIONS_CHANNEL, notifier
+from modalci.server.ordering import in_order
+from modalci.server.retry import is_exhausted
+from modalci.server.workers import delivery_workers
+from settings import env
+
+SEEK_BACKFILL_CHUNK_SIZE = 1000
 
 
 class NamespaceService:
@@ -90,6 +146,14 @@ class NamespaceService:
 
 
 class TopicsService:
+    def __init__(self) -> None:
+        # concurrent publishes are written to the outbox together
+        self.group_commit: GroupCommit[Tuple[Topic, TopicMessage]] = GroupCommit(
+            write=self._write,
+            max_items=env.PUBLISH_GROUP_COMMIT_MAX_MESSAGES,
+            max_delay_seconds=env.PUBLISH_GROUP_COMMIT_MAX_DELAY_SECONDS,
+        )
+
     async def list(
         self,
         namespace_id: UUID4,
@@ -130,13 +194,15 @@ class TopicsService:
         topic_id: UUID4,
         namespace_id: UUID4,
         psql: AsyncSession,
+        with_subscriptions: bool = True,
     ) -> Optional[Topic]:
-        results = await psql.execute(
-            select(Topic).where(
-                Topic.id == topic_id,
-                Topic.namespace_id == namespace_id,
-            )
+        query = select(Topic).where(
+            Topic.id == topic_id,
+            Topic.namespace_id == namespace_id,
         )
+        if not with_subscriptions:
+            query = query.options(noload(Topic.subscriptions))  # type: ignore
+        results = await psql.execute(query)
         return results.scalars().first()
 
     async def create(
@@ -177,37 +243,333 @@ class TopicsService:
             await psql.commit()
         return topic
 
+    async def get_many(
+        self,
+        topic_ids: Set[UUID4],
+        namespace_id: UUID4,
+        psql: AsyncSession,
+        with_subscriptions: bool = True,
+    ) -> Dict[UUID4, Topic]:
+        query = select(Topic).where(
+            Topic.id.in_(topic_ids),  # type: ignore
+            Topic.namespace_id == namespace_id,
+        )
+        if not with_subscriptions:
+            query = query.options(noload(Topic.subscriptions))  # type: ignore
+        results = await psql.execute(query)
+        return {topic.id: topic for topic in results.scalars().all()}
+
+    async def list_messages(
+        self,
+        topic_id: UUID4,
+        after_sequence: int,
+        limit: int,
+        psql: AsyncSession,
+        until_sequence: Optional[int] = None,
+        exclude_sequences: Optional[Set[int]] = None,
+    ) -> List[TopicMessage]:
+        query = select(TopicMessage).where(
+            TopicMessage.topic_id == topic_id,
+            TopicMessage.sequence > after_sequence,  # type: ignore
+        )
+        if until_sequence is not None:
+            query = query.where(TopicMessage.sequence <= until_sequence)  # type: ignore
+        if exclude_sequences:
+            # one array parameter, however many sequences are excluded
+            query = query.where(
+                TopicMessage.sequence  # type: ignore
+                != all_(literal(sorted(exclude_sequences), ARRAY(BigInteger)))
+            )
+        results = await psql.execute(query.order_by(TopicMessage.sequence).limit(limit))
+        return results.scalars().all()
+
+    async def get_message(
+        self,
+        message_id: UUID4,
+        topic_id: UUID4,
+        psql: AsyncSession,
+    ) -> Optional[TopicMessage]:
+        results = await psql.execute(
+            select(TopicMessage)
+            .where(
+                TopicMessage.id == message_id,
+                TopicMessage.topic_id == topic_id,
+            )
+            .options(defer(TopicMessage.data))  # type: ignore
+        )
+        return results.scalars().first()
+
+    async def last_sequence(self, topic_id: UUID4, psql: AsyncSession) -> int:
+        results = await psql.execute(
+            select(func.max(TopicMessage.sequence)).where(  # type: ignore
+                TopicMessage.topic_id == topic_id
+            )
+        )
+        return results.scalar() or 0
+
     async def publish_message(
         self,
         topic: Topic,
         message: Message,
+    ) -> TopicMessage:
+        (topic_message,) = await self.publish_messages(messages=[(topic, message)])
+        return topic_message
+
+    async def publish_messages(
+        self,
+        messages: List[Tuple[Topic, Message]],
+    ) -> List[TopicMessage]:
+        topic_messages = [
+            (
+                topic,
+                TopicMessage(
+                    topic_id=topic.id,
+                    data=message.decoded(),
+                    ordering_key=message.ordering_key,
+                    idempotency_key=message.idempotency_key,
+                    attributes=message.attributes,
+                ),
+            )
+            for topic, message in messages
+        ]
+        await self.group_commit.submit(topic_messages)
+        return [topic_message for _, topic_message in topic_messages]
+
+    async def publish_raw_message(
+        self,
+        topic: Topic,
+        data: bytes,
+        content_type: str,
+        ordering_key: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> TopicMessage:
+        topic_message = TopicMessage(
+            topic_id=topic.id,
+            data=data,
+            content_type=content_type,
+            ordering_key=ordering_key,
+            idempotency_key=idempotency_key,
+        )
+        await self.group_commit.submit([(topic, topic_message)])
+        return topic_message
+
+    async def _write(self, messages: List[Tuple[Topic, TopicMessage]]) -> None:
+        publish_group_commit_messages.observe(len(messages))
+        async with async_session() as psql:
+            await self._publish(messages=messages, psql=psql)
+
+    async def _publish(
+        self,
+        messages: List[Tuple[Topic, TopicMessage]],
+        psql: AsyncSession,
     ) -> None:
-        # TODO: modalci supports http-push publishing to HTTPS endpoints.
-        # modalci should support other modes and other protocols in the future
-        # e.g. pull, gRPC, websocket, carrier pigeon, idk, etc.
-        await asyncio.gather(
-            *[
-                self.publish_message_to_subscription(
-                    subscription=sub,
-                    message=base64.b64decode(message.data.encode("utf-8")).decode(
-                        "utf-8"
-                    ),
+        # TODO: modalci supports http-push, pull and websocket streaming.
+        # modalci should support other protocols in the future
+        # e.g. gRPC, carrier pigeon, idk, etc.
+        # a message whose idempotency key was already published to its topic
+        # takes the original message's id and is not delivered again
+        fresh: List[TopicMessage] = []
+        for _, topic_message in messages:
+            if topic_message.idempotency_key is not None:
+                message_id = published_messages.get(
+                    (topic_message.topic_id, topic_message.idempotency_key)
                 )
-                for sub in topic.subscriptions
-            ]
-        )
+                if message_id is not None:
+                    topic_message.id = message_id
+                    continue
+            fresh.append(topic_message)
+        if not fresh:
+            return
+        # large payloads are compressed off the event loop
+        stored = [topic_message.data for topic_message in fresh]
+        if any(len(data) >= env.MESSAGE_COMPRESSION_MIN_BYTES for data in stored):
+            encoded = await asyncio.to_thread(
+                lambda: [compress_for_storage(data) for data in stored]
+            )
+        else:
+            encoded = [(data, None) for data in stored]
+        # keys another process already published are dropped by the primary key
+        keyed = [m for m in fresh if m.idempotency_key is not None]
+        if keyed:
+            results = await psql.execute(
+                pg_insert(IdempotencyKey)
+                .values(
+                    [
+                        dict(
+                            topic_id=topic_message.topic_id,
+                            idempotency_key=topic_message.idempotency_key,
+                            message_id=topic_message.id,
+                        )
+                        for topic_message in keyed
+                    ]
+                )
+                .on_conflict_do_nothing(index_elements=["topic_id", "idempotency_key"])
+                .returning(IdempotencyKey.message_id)
+            )
+            claimed = set(results.scalars().all())
+        else:
+            claimed = set()
+        published = [
+            (topic_message, stored)
+            for topic_message, stored in zip(fresh, encoded)
+            if topic_message.idempotency_key is None or topic_message.id in claimed
+        ]
+        duplicates = {
+            (topic_message.topic_id, topic_message.idempotency_key)
+            for topic_message in keyed
+            if topic_message.id not in claimed
+        }
+        if duplicates:
+            results = await psql.execute(
+                select(  # type: ignore
+                    IdempotencyKey.topic_id,
+                    IdempotencyKey.idempotency_key,
+                    IdempotencyKey.message_id,
+                ).where(
+                    tuple_(  # type: ignore
+                        IdempotencyKey.topic_id, IdempotencyKey.idempotency_key
+                    ).in_(duplicates)
+                )
+            )
+            originals = {
+                (topic_id, idempotency_key): message_id
+                for topic_id, idempotency_key, message_id in results.all()
+            }
+            for topic_message in keyed:
+                if topic_message.id not in claimed:
+                    topic_message.id = originals[
+                        (topic_message.topic_id, topic_message.idempotency_key)
+                    ]
+        topic_ids = {topic_message.topic_id for topic_message, _ in published}
+        if published:
+            # one multi-row insert keeps the messages' sequence in publish order
+            now = datetime.utcnow()
+            for topic_message, _ in published:
+                topic_message.created_at = topic_message.updated_at = now
+            await psql.execute(
+                insert(TopicMessage).values(
+                    [
+                        dict(
+                            id=topic_message.id,
+                            topic_id=topic_message.topic_id,
+                            data=data,
+                            content_type=topic_message.content_type,
+                            content_encoding=content_encoding,
+                            ordering_key=topic_message.ordering_key,
+                            idempotency_key=topic_message.idempotency_key,
+                            attributes=topic_message.attributes,
+                            created_at=now,
+                            updated_at=now,
+                        )
+                        for topic_message, (data, content_encoding) in published
+                    ]
+                )
+            )
+            filtered: List[Tuple[UUID4, UUID4]] = []
+            for topic_message, _ in published:
+                index = await subscription_filters.get(
+                    topic_id=topic_message.topic_id, psql=psql
+                )
+                filtered.extend(
+                    (topic_message.id, subscription_id)
+                    for subscription_id in index.match(topic_message.attributes)
+                )
+            await self._fan_out(
+                message_ids={topic_message.id for topic_message, _ in published},
+                published_at=now,
+                filtered=filtered,
+                psql=psql,
+            )
+            # NOTIFY is only sent on commit, which wakes up other processes
+            for topic_id in topic_ids:
+                await psql.execute(
+                    text("SELECT pg_notify(:channel, :topic_id)"),
+                    {"channel": NOTIFY_CHANNEL, "topic_id": str(topic_id)},
+                )
+        await psql.commit()
+        for topic_message in fresh:
+            if topic_message.idempotency_key is not None:
+                published_messages.put(
+                    (topic_message.topic_id, topic_message.idempotency_key),
+                    topic_message.id,
+                )
+        for topic_message, _ in published:
+            messages_published_total.inc(topic_id=topic_message.topic_id)
+        for topic_id in topic_ids:
+            notifier.notify(topic_id)
+        if published:
+            delivery_workers.notify()
 
-    async def publish_message_to_subscription(
+    async def _fan_out(
         self,
-        subscription: Subscription,
-        message: str,
+        message_ids: Set[UUID4],
+        published_at: datetime,
+        filtered: List[Tuple[UUID4, UUID4]],
+        psql: AsyncSession,
     ) -> None:
-        async with httpx.AsyncClient() as client:
-            await client.post(
-                str(subscription.push_endpoint),
-                json=message,
-                headers={"Content-Type": "application/json"},
+        # filtered subscriptions only get the messages their filter matched; ids
+        # are passed as arrays, since a bind parameter each could exceed the
+        # 32767 parameters a query may have
+        matched = Subscription.filter.is_(None)  # type: ignore
+        if filtered:
+            pairs = func.unnest(
+                literal([m for m, _ in filtered], ARRAY(UUID(as_uuid=True))),
+                literal([s for _, s in filtered], ARRAY(UUID(as_uuid=True))),
+            ).table_valued("message_id", "subscription_id")
+            matched = or_(
+                matched,
+                tuple_(TopicMessage.id, Subscription.id).in_(  # type: ignore
+                    select(pairs.c.message_id, pairs.c.subscription_id)
+                ),
+            )
+        # fan out in the database so subscriptions are never loaded into memory,
+        # however many a topic has
+        now = cast(literal(datetime.utcnow()), DateTime)
+        await psql.execute(
+            insert(Delivery).from_select(
+                [
+                    "id",
+                    "message_id",
+                    "subscription_id",
+                    "status",
+                    "attempts",
+                    "next_attempt_at",
+                    "created_at",
+                    "updated_at",
+                    "ordering_key",
+                    "published_at",
+                    "partition_hash",
+                ],
+                select(  # type: ignore
+                    func.gen_random_uuid(),
+                    TopicMessage.id,
+                    Subscription.id,
+                    cast(literal(DeliveryStatus.PENDING.value), String),
+                    cast(literal(0), Integer),
+                    # batching subscriptions linger so that a batch can fill up
+                    now
+                    + Subscription.batch_max_linger_ms
+                    * literal_column("interval '1 millisecond'", Interval),
+                    now,
+                    now,
+                    TopicMessage.ordering_key,
+                    TopicMessage.created_at,
+                    partition_hash(),
+                )
+                .join(Subscription, Subscription.topic_id == TopicMessage.topic_id)
+                .where(
+                    # only the partition the messages were just written to
+                    TopicMessage.created_at == published_at,
+                    TopicMessage.id  # type: ignore
+                    == any_(literal(list(message_ids), ARRAY(UUID(as_uuid=True)))),
+                    matched,
+                    or_(
+                        Subscription.delivery_type == DeliveryType.PULL,
+                        Subscription.push_endpoint.isnot(None),  # type: ignore
+                    ),
+                ),
             )
+        )
 
 
 class SubscriptionsService:
@@ -227,10 +589,25 @@ class SubscriptionsService:
             return subscription
         subscription = Subscription(**subscription_create.dict())
         psql.add(subscription)
+        if subscription.filter is not None:
+            await self._notify_filters_changed(
+                topic_id=subscription.topic_id, psql=psql
+            )
         await psql.commit()
         await psql.refresh(subscription)
+        if subscription.filter is not None:
+            subscription_filters.invalidate(subscription.topic_id)
         return subscription
 
+    async def _notify_filters_changed(
+        self, topic_id: UUID4, psql: AsyncSession
+    ) -> None:
+        # other processes reload the topic's filters once this commits
+        await psql.execute(
+            text("SELECT pg_notify(:channel, :topic_id)"),
+            {"channel": SUBSCRIPTIONS_CHANNEL, "topic_id": str(topic_id)},
+        )
+
     async def list(
         self,
         namespace_id: UUID4,
@@ -315,10 +692,398 @@ class SubscriptionsService:
         )
         subscription = results.scalars().first()
         if subscription:
+            filtered = subscription.filter is not None
+            if filtered:
+                await self._notify_filters_changed(topic_id=topic_id, psql=psql)
             await psql.delete(subscription)
             await psql.commit()
+            if filtered:
+                subscription_filters.invalidate(topic_id)
         return subscription
 
+    async def list_dead_letters(
+        self,
+        subscription_id: UUID4,
+        psql: AsyncSession,
+    ) -> List[Delivery]:
+        results = await psql.execute(
+            select(Delivery)
+            .where(
+                Delivery.subscription_id == subscription_id,
+                Delivery.status == DeliveryStatus.DEAD_LETTERED,
+            )
+            .order_by(Delivery.updated_at)
+        )
+        return results.scalars().all()
+
+    async def redrive(
+        self,
+        subscription: Subscription,
+        psql: AsyncSession,
+    ) -> RedriveResponse:
+        now = datetime.utcnow()
+        dead_lettered = and_(
+            Delivery.subscription_id == subscription.id,
+            Delivery.status == DeliveryStatus.DEAD_LETTERED,
+        )
+        # messages older than max_message_age_seconds would be dead-lettered
+        # again without an attempt, so they are left where they are
+        expired = Delivery.published_at < now - timedelta(  # type: ignore
+            seconds=subscription.max_message_age_seconds
+        )
+        results = await psql.execute(
+            update(Delivery)
+            .where(dead_lettered, ~expired)
+            .values(
+                status=DeliveryStatus.PENDING,
+                attempts=0,
+                next_attempt_at=now,
+            )
+        )
+        skipped = await psql.execute(
+            select(func.count()).select_from(Delivery).where(dead_lettered, expired)
+        )
+        await psql.commit()
+        delivery_workers.notify()
+        return RedriveResponse(
+            redriven=results.rowcount,  # type: ignore
+            expired=skipped.scalar() or 0,
+        )
+
+    async def seek(
+        self,
+        subscription: Subscription,
+        max_messages_per_second: float,
+        psql: AsyncSession,
+        timestamp: Optional[datetime] = None,
+        sequence: Optional[int] = None,
+    ) -> SeekResponse:
+        now = datetime.utcnow()
+        seek_point: ColumnElement = (
+            TopicMessage.created_at >= timestamp  # type: ignore
+            if sequence is None
+            else TopicMessage.sequence >= sequence  # type: ignore
+        )
+        # expired messages are only deleted when their partition is dropped
+        replayed = and_(
+            seek_point,
+            TopicMessage.created_at  # type: ignore
+            >= now
+            - timedelta(minutes=subscription.topic.message_retention_duration_minutes),
+        )
+        await self._backfill(
+            subscription=subscription, replayed=replayed, now=now, psql=psql
+        )
+        # messages before the seek point count as acknowledged
+        acknowledged = await psql.execute(
+            update(Delivery)
+            .where(
+                Delivery.subscription_id == subscription.id,
+                Delivery.status == DeliveryStatus.PENDING,
+                Delivery.message_id.in_(  # type: ignore
+                    select(TopicMessage.id).where(
+                        TopicMessage.topic_id == subscription.topic_id,
+                        ~seek_point,
+                    )
+                ),
+            )
+            .values(status=DeliveryStatus.DELIVERED)
+            .execution_options(synchronize_session=False)
+        )
+        # replayed messages are spaced out in log order, so the replay is paced
+        # however many workers pick it up and the live traffic isn't starved
+        ranked = (
+            select(  # type: ignore
+                Delivery.id,
+                func.row_number()
+                .over(order_by=TopicMessage.sequence)  # type: ignore
+                .label("position"),
+            )
+            .join(
+                TopicMessage,
+                and_(
+                    Delivery.message_id == TopicMessage.id,  # type: ignore
+                    Delivery.published_at == TopicMessage.created_at,
+                ),
+            )
+            .where(Delivery.subscription_id == subscription.id, replayed)
+            .subquery()
+        )
+        results = await psql.execute(
+            update(Delivery)
+            .where(Delivery.id == ranked.c.id)
+            .values(
+                status=DeliveryStatus.PENDING,
+                attempts=0,
+                last_status_code=None,
+                last_error=None,
+                next_attempt_at=cast(literal(now), DateTime)
+                + literal_column("interval '1 second'", Interval)
+                * (
+                    (ranked.c.position - 1)
+                    * cast(literal(1 / max_messages_per_second), Float)
+                ),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        await psql.commit()
+        delivery_workers.notify()
+        notifier.notify(subscription.topic_id)
+        return SeekResponse(
+            replayed=results.rowcount,  # type: ignore
+            acknowledged=acknowledged.rowcount,  # type: ignore
+        )
+
+    async def _backfill(
+        self,
+        subscription: Subscription,
+        replayed: ColumnElement,
+        now: datetime,
+        psql: AsyncSession,
+    ) -> None:
+        # retained messages published before the subscription was created, or
+        # not matched by its filter, have no delivery yet
+        if subscription.delivery_type == DeliveryType.PUSH and (
+            subscription.push_endpoint is None
+        ):
+            return
+        missing: List[ColumnElement] = [
+            TopicMessage.topic_id == subscription.topic_id,  # type: ignore
+            replayed,
+            ~select(Delivery.id)
+            .where(
+                Delivery.message_id == TopicMessage.id,
+                Delivery.published_at == TopicMessage.created_at,
+                Delivery.subscription_id == subscription.id,
+            )
+            .exists(),
+        ]
+        if subscription.filter is None:
+            await self._insert_deliveries(
+                subscription=subscription, where=missing, now=now, psql=psql
+            )
+            return
+        results = await psql.execute(
+            select(TopicMessage.id, TopicMessage.attributes).where(*missing)
+        )
+        matches = compile_filter(subscription.filter).matches
+        matched = [
+            message_id
+            for message_id, attributes in results.all()
+            if matches(attributes)
+        ]
+        for i in range(0, len(matched), SEEK_BACKFILL_CHUNK_SIZE):
+            await self._insert_deliveries(
+                subscription=subscription,
+                where=[
+                    TopicMessage.id.in_(  # type: ignore
+                        matched[i : i + SEEK_BACKFILL_CHUNK_SIZE]
+                    )
+                ],
+                now=now,
+                psql=psql,
+            )
+
+    async def _insert_deliveries(
+        self,
+        subscription: Subscription,
+        where: List[ColumnElement],
+        now: datetime,
+        psql: AsyncSession,
+    ) -> None:
+        now_column = cast(literal(now), DateTime)
+        await psql.execute(
+            pg_insert(Delivery)
+            .from_select(
+                [
+                    "id",
+                    "message_id",
+                    "subscription_id",
+                    "status",
+                    "attempts",
+                    "next_attempt_at",
+                    "created_at",
+                    "updated_at",
+                    "ordering_key",
+                    "published_at",
+                    "partition_hash",
+                ],
+                select(  # type: ignore
+                    func.gen_random_uuid(),
+                    TopicMessage.id,
+                    cast(literal(subscription.id), UUID(as_uuid=True)),
+                    cast(literal(DeliveryStatus.PENDING.value), String),
+                    cast(literal(0), Integer),
+                    now_column,
+                    now_column,
+                    now_column,
+                    TopicMessage.ordering_key,
+                    TopicMessage.created_at,
+                    partition_hash(),
+                ).where(*where),
+            )
+            .on_conflict_do_nothing(
+                index_elements=["message_id", "subscription_id", "published_at"]
+            )
+        )
+
+    async def pull(
+        self,
+        subscription: Subscription,
+        max_messages: int,
+        max_bytes: int,
+        psql: AsyncSession,
+        wait_seconds: float = 0,
+    ) -> List[ReceivedMessage]:
+        deadline = time.monotonic() + wait_seconds
+        with notifier.watch(subscription.topic_id) as published:
+            while True:
+                # clear before pulling so a publish during the pull isn't missed
+                published.clear()
+                received = await self._pull(
+                    subscription=subscription,
+                    max_messages=max_messages,
+                    max_bytes=max_bytes,
+                    psql=psql,
+                )
+                remaining = deadline - time.monotonic()
+                if received or remaining <= 0:
+                    return received
+                # leases expire without a notification, so check back regularly
+                try:
+                    await asyncio.wait_for(
+                        published.wait(),
+                        timeout=min(remaining, env.PULL_POLL_INTERVAL_SECONDS),
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _pull(
+        self,
+        subscription: Subscription,
+        max_messages: int,
+        max_bytes: int,
+        psql: AsyncSession,
+    ) -> List[ReceivedMessage]:
+        now = datetime.utcnow()
+        query = (
+            select(Delivery, TopicMessage)
+            .join(
+                TopicMessage,
+                and_(
+                    Delivery.message_id == TopicMessage.id,  # type: ignore
+                    Delivery.published_at == TopicMessage.created_at,
+                ),
+            )
+            .where(
+                Delivery.subscription_id == subscription.id,
+                Delivery.status == DeliveryStatus.PENDING,
+                Delivery.next_attempt_at <= now,  # type: ignore
+            )
+        )
+        if subscription.enable_message_ordering:
+            query = query.where(in_order())
+        results = await psql.execute(
+            query.order_by(Delivery.next_attempt_at)
+            .limit(max_messages)
+            .with_for_update(of=Delivery, skip_locked=True)  # type: ignore
+        )
+        received: List[ReceivedMessage] = []
+        size = 0
+        for delivery, message in results.all():
+            if is_exhausted(
+                subscription=subscription, delivery=delivery, message=message, now=now
+            ):
+                delivery.status = DeliveryStatus.DEAD_LETTERED
+                continue
+            if message.content_encoding is None:
+                data = message.data
+            else:
+                data = await asyncio.to_thread(
+                    decompress,
+                    message.data,
+                    message.content_encoding,
+                    max_bytes=env.MESSAGE_MAX_BYTES,
+                )
+            size += len(data)
+            # always hand out at least one message, even when it is over max_bytes
+            if received and size > max_bytes:
+                break
+            delivery.attempts += 1
+            delivery.next_attempt_at = now + timedelta(
+                seconds=subscription.ack_deadline_seconds
+            )
+            received.append(
+                ReceivedMessage(
+                    ack_id=AckId(f"{delivery.id}.{delivery.attempts}"),
+                    message_id=message.id,
+                    data=base64.b64encode(data).decode("utf-8"),
+                    content_type=message.content_type,
+                    attributes=message.attributes,
+                    delivery_attempt=delivery.attempts,
+                    publish_time=message.created_at,
+                )
+            )
+        await psql.commit()
+        if received:
+            messages_pulled_total.inc(len(received), subscription_id=subscription.id)
+        return received
+
+    def _leased(self, ack_ids: List[AckId]) -> ColumnElement:
+        # an ack id is the delivery id and the attempt it was pulled on, so
+        # once a lease expires it no longer matches the delivery's next one
+        leases = [ack_id.split(".") for ack_id in ack_ids]
+        pairs = func.unnest(
+            literal(
+                [uuid.UUID(delivery_id) for delivery_id, _ in leases],
+                ARRAY(UUID(as_uuid=True)),
+            ),
+            literal([int(attempt) for _, attempt in leases], ARRAY(Integer)),
+        ).table_valued("delivery_id", "attempts")
+        return tuple_(Delivery.id, Delivery.attempts).in_(  # type: ignore
+            select(pairs.c.delivery_id, pairs.c.attempts)
+        )
+
+    async def acknowledge(
+        self,
+        subscription_id: UUID4,
+        ack_ids: List[AckId],
+        psql: AsyncSession,
+    ) -> int:
+        results = await psql.execute(
+            update(Delivery)
+            .where(
+                self._leased(ack_ids),
+                Delivery.subscription_id == subscription_id,
+                Delivery.status == DeliveryStatus.PENDING,
+            )
+            .values(status=DeliveryStatus.DELIVERED)
+        )
+        await psql.commit()
+        return results.rowcount  # type: ignore
+
+    async def modify_ack_deadline(
+        self,
+        subscription_id: UUID4,
+        ack_ids: List[AckId],
+        ack_deadline_seconds: int,
+        psql: AsyncSession,
+    ) -> int:
+        results = await psql.execute(
+            update(Delivery)
+            .where(
+                self._leased(ack_ids),
+                Delivery.subscription_id == subscription_id,
+                Delivery.status == DeliveryStatus.PENDING,
+            )
+            .values(
+                next_attempt_at=datetime.utcnow()
+                + timedelta(seconds=ack_deadline_seconds)
+            )
+        )
+        await psql.commit()
+        return results.rowcount  # type: ignore
+
 
 namespace_service = NamespaceService()
 topics_service = TopicsService()
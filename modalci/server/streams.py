@@ -0,0 +1,378 @@
+import asyncio
+import base64
+import heapq
+import json
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import (
+    AsyncIterator,
+    Deque,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+from uuid import UUID
+
+from fastapi import WebSocket, WebSocketDisconnect, status
+from pydantic import ValidationError
+
+from modalci._types import (
+    PullRequest,
+    StreamedMessage,
+    StreamRequest,
+    StreamRequestType,
+    StreamResponse,
+    StreamResponseType,
+)
+from modalci.db import async_session
+from modalci.models import Subscription, TopicMessage
+from modalci.server.compression import decompress
+from modalci.server.log import log
+from modalci.server.notify import notifier
+from modalci.server.services import subscriptions_service, topics_service
+from settings import env
+
+READ_BATCH_SIZE = 500
+# the most recently broadcast sequences a tail excludes from its re-reads
+MAX_RECENT_SEQUENCES = 1000
+
+
+class SubscriptionStream:
+    """SubscriptionStream.
+
+    SubscriptionStream serves a streaming pull from a pull subscription over
+    one WebSocket. The client grants credits and is sent at most that many
+    messages, as they are published, and acknowledges them over the same
+    socket. Messages are leased exactly as with pull, so messages that are
+    not acknowledged when a stream drops are delivered again after their ack
+    deadline. A malformed frame closes the stream.
+    """
+
+    def __init__(self, websocket: WebSocket, subscription: Subscription) -> None:
+        self.websocket = websocket
+        self.subscription = subscription
+        self.credits = 0
+        self._credited = asyncio.Event()
+        self._write_lock = asyncio.Lock()
+
+    async def _write(self, response: StreamResponse) -> None:
+        async with self._write_lock:
+            await self.websocket.send_text(response.json(exclude_none=True))
+
+    async def _close(self, code: int, reason: str) -> None:
+        async with self._write_lock:
+            await self.websocket.close(code=code, reason=reason)
+
+    async def _receive(self) -> None:
+        async with async_session() as psql:
+            while True:
+                try:
+                    frame = await self.websocket.receive_json()
+                except json.JSONDecodeError:
+                    await self._close(
+                        code=status.WS_1007_INVALID_FRAME_PAYLOAD_DATA,
+                        reason="Frame is not valid JSON.",
+                    )
+                    return
+                try:
+                    request = StreamRequest.parse_obj(frame)
+                except ValidationError as e:
+                    await self._write(
+                        StreamResponse(type=StreamResponseType.ERROR, detail=str(e))
+                    )
+                    await self._close(
+                        code=status.WS_1003_UNSUPPORTED_DATA,
+                        reason="Frame is not a valid stream request.",
+                    )
+                    return
+                if request.type == StreamRequestType.CREDIT:
+                    self.credits += request.credits
+                    if self.credits > 0:
+                        self._credited.set()
+                elif request.type == StreamRequestType.ACKNOWLEDGE:
+                    acknowledged = await subscriptions_service.acknowledge(
+                        subscription_id=self.subscription.id,
+                        ack_ids=request.ack_ids,
+                        psql=psql,
+                    )
+                    await self._write(
+                        StreamResponse(
+                            type=StreamResponseType.ACKNOWLEDGED,
+                            acknowledged=acknowledged,
+                        )
+                    )
+                elif request.type == StreamRequestType.MODIFY_ACK_DEADLINE:
+                    modified = await subscriptions_service.modify_ack_deadline(
+                        subscription_id=self.subscription.id,
+                        ack_ids=request.ack_ids,
+                        ack_deadline_seconds=request.ack_deadline_seconds,
+                        psql=psql,
+                    )
+                    await self._write(
+                        StreamResponse(
+                            type=StreamResponseType.MODIFIED, modified=modified
+                        )
+                    )
+
+    async def _send(self) -> None:
+        defaults = PullRequest()
+        async with async_session() as psql:
+            while True:
+                await self._credited.wait()
+                received_messages = await subscriptions_service.pull(
+                    subscription=self.subscription,
+                    max_messages=min(self.credits, defaults.max_messages),
+                    max_bytes=defaults.max_bytes,
+                    psql=psql,
+                    wait_seconds=env.PULL_POLL_INTERVAL_SECONDS,
+                )
+                if not received_messages:
+                    continue
+                self.credits -= len(received_messages)
+                if self.credits <= 0:
+                    self._credited.clear()
+                await self._write(
+                    StreamResponse(
+                        type=StreamResponseType.MESSAGES,
+                        received_messages=received_messages,
+                    )
+                )
+
+    async def run(self) -> None:
+        tasks = [
+            asyncio.create_task(self._receive()),
+            asyncio.create_task(self._send()),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class _Broadcast(NamedTuple):
+    sequence: int
+    late: bool
+    event: str
+
+
+class _Tail:
+    def __init__(self) -> None:
+        self.queues: Set[asyncio.Queue] = set()
+        self.sequence = 0
+        # the tail's sequence over the last STREAM_LATE_COMMIT_SECONDS, and the
+        # sequences broadcast since the oldest of them, also kept as a heap
+        self.checkpoints: Deque[Tuple[float, int]] = deque()
+        self.recent: Set[int] = set()
+        self.oldest: List[int] = []
+        self.dropped = 0
+        self.started = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def floor(self) -> int:
+        floor = self.checkpoints[0][1] if self.checkpoints else self.sequence
+        # past MAX_RECENT_SEQUENCES the oldest sequences are no longer re-read
+        return max(floor, self.dropped)
+
+    def add(self, sequence: int) -> None:
+        self.recent.add(sequence)
+        heapq.heappush(self.oldest, sequence)
+
+    def checkpoint(self) -> None:
+        now = time.monotonic()
+        self.checkpoints.append((now, self.sequence))
+        while (
+            len(self.checkpoints) > 1
+            and self.checkpoints[1][0] <= now - env.STREAM_LATE_COMMIT_SECONDS
+        ):
+            self.checkpoints.popleft()
+        while self.oldest and (
+            self.oldest[0] <= self.floor or len(self.oldest) > MAX_RECENT_SEQUENCES
+        ):
+            sequence = heapq.heappop(self.oldest)
+            self.recent.discard(sequence)
+            self.dropped = max(self.dropped, sequence)
+
+
+class TopicBroadcaster:
+    """TopicBroadcaster.
+
+    TopicBroadcaster tails the message log of every watched topic once per
+    process and fans new messages out to all of the topic's watchers, so any
+    number of watchers share one upstream read. Watchers that fall too far
+    behind are disconnected and can resume from their last event id. The tail
+    re-reads the last STREAM_LATE_COMMIT_SECONDS of the message sequence, or
+    its last MAX_RECENT_SEQUENCES messages if fewer, so a publish that commits
+    after a later one is still sent, without an event id
+    so that resuming doesn't replay what came after it. Publishes that commit
+    later than that are only seen by watchers that resume from before them.
+    """
+
+    def __init__(self) -> None:
+        self._tails: Dict[UUID, _Tail] = {}
+
+    def _broadcast(self, tail: _Tail, broadcast: _Broadcast) -> None:
+        for queue in list(tail.queues):
+            if queue.qsize() >= env.STREAM_MAX_QUEUED_MESSAGES:
+                tail.queues.discard(queue)
+                queue.put_nowait(None)
+            else:
+                queue.put_nowait(broadcast)
+
+    async def _tail(self, topic_id: UUID, tail: _Tail) -> None:
+        with notifier.watch(topic_id) as published:
+            while True:
+                published.clear()
+                messages = []
+                try:
+                    async with async_session() as psql:
+                        if not tail.started.is_set():
+                            # watchers replay anything before the tail's start
+                            tail.sequence = await topics_service.last_sequence(
+                                topic_id=topic_id, psql=psql
+                            )
+                            tail.started.set()
+                        tail.checkpoint()
+                        messages = await topics_service.list_messages(
+                            topic_id=topic_id,
+                            after_sequence=tail.floor,
+                            exclude_sequences=tail.recent,
+                            limit=READ_BATCH_SIZE,
+                            psql=psql,
+                        )
+                except Exception:  # pragma: no cover
+                    log.exception(f"Failed to read messages for topic {topic_id}.")
+                for message in messages:
+                    sequence: int = message.sequence  # type: ignore
+                    late = sequence < tail.sequence
+                    tail.sequence = max(tail.sequence, sequence)
+                    tail.add(sequence)
+                    try:
+                        # encoded once for all of the topic's watchers
+                        event = await _encode(message, with_id=not late)
+                    except Exception:  # pragma: no cover
+                        log.exception(f"Failed to encode message {message.id}.")
+                        continue
+                    self._broadcast(
+                        tail=tail,
+                        broadcast=_Broadcast(sequence=sequence, late=late, event=event),
+                    )
+                if len(messages) < READ_BATCH_SIZE:
+                    try:
+                        await asyncio.wait_for(
+                            published.wait(), timeout=env.PULL_POLL_INTERVAL_SECONDS
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+
+    @asynccontextmanager
+    async def watch(
+        self, topic_id: UUID
+    ) -> AsyncIterator[Tuple[asyncio.Queue, int, int]]:
+        tail = self._tails.get(topic_id)
+        if tail is None:
+            tail = _Tail()
+            tail.task = asyncio.create_task(self._tail(topic_id=topic_id, tail=tail))
+            self._tails[topic_id] = tail
+        queue: asyncio.Queue = asyncio.Queue()
+        tail.queues.add(queue)
+        try:
+            await tail.started.wait()
+            # messages after the tail's current sequence will arrive on the
+            # queue, as will late ones after its floor
+            yield queue, tail.sequence, tail.floor
+        finally:
+            tail.queues.discard(queue)
+            if not tail.queues and self._tails.get(topic_id) is tail:
+                del self._tails[topic_id]
+                if tail.task is not None:
+                    tail.task.cancel()
+
+    async def events(
+        self, topic_id: UUID, last_event_id: Optional[int] = None
+    ) -> AsyncIterator[str]:
+        """Stream a topic's messages as Server-Sent Events.
+
+        Args:
+            topic_id (UUID): The topic id.
+            last_event_id (Optional[int]): The sequence of the last message the
+                watcher has seen, to replay the messages published since.
+
+        Returns:
+            AsyncIterator[str]: The events, with keepalive comments while idle.
+        """
+        async with self.watch(topic_id) as (queue, until_sequence, floor):
+            sequence = last_event_id
+            # late publishes may be both replayed and broadcast
+            replayed: Set[int] = set()
+            if last_event_id is not None:
+                while True:
+                    async with async_session() as psql:
+                        messages = await topics_service.list_messages(
+                            topic_id=topic_id,
+                            after_sequence=sequence or 0,
+                            until_sequence=until_sequence,
+                            limit=READ_BATCH_SIZE,
+                            psql=psql,
+                        )
+                    for message in messages:
+                        sequence = message.sequence
+                        if message.sequence > floor:  # type: ignore
+                            replayed.add(message.sequence)  # type: ignore
+                        yield await _encode(message)
+                    if len(messages) < READ_BATCH_SIZE:
+                        break
+            while True:
+                try:
+                    broadcast = await asyncio.wait_for(
+                        queue.get(), timeout=env.STREAM_KEEPALIVE_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if broadcast is None:
+                    return
+                if broadcast.sequence in replayed:
+                    replayed.discard(broadcast.sequence)
+                    continue
+                if not broadcast.late:
+                    if sequence is not None and broadcast.sequence <= sequence:
+                        continue
+                    sequence = broadcast.sequence
+                yield broadcast.event
+
+
+async def _encode(message: TopicMessage, with_id: bool = True) -> str:
+    if message.content_encoding is None:
+        return _event(message, with_id=with_id)
+    # compressed messages are inflated off the event loop
+    return await asyncio.to_thread(_event, message, with_id=with_id)
+
+
+def _event(message: TopicMessage, with_id: bool = True) -> str:
+    data = StreamedMessage(
+        message_id=message.id,
+        data=base64.b64encode(
+            decompress(
+                message.data, message.content_encoding, max_bytes=env.MESSAGE_MAX_BYTES
+            )
+        ).decode("utf-8"),
+        content_type=message.content_type,
+        attributes=message.attributes,
+        publish_time=message.created_at,  # type: ignore
+    ).json()
+    event = f"event: message\ndata: {data}\n\n"
+    return f"id: {message.sequence}\n{event}" if with_id else event
+
+
+topic_broadcaster = TopicBroadcaster()
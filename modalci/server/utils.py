@@ -1,15 +1,25 @@
+import asyncio
 import json
 from typing import Callable, Union
 from uuid import uuid4
 
-from fastapi import Request, Response
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi.routing import APIRoute
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from modalci._types import (
+    ContentEncoding,
     JsonResponseLoggerMessage,
     RequestLoggerMessage,
     ResponseLoggerMessage,
 )
+from modalci.server.compression import (
+    DecompressedTooLarge,
+    DecompressionError,
+    UnsupportedEncoding,
+    decompress,
+)
 from modalci.server.log import log
 
 
@@ -45,3 +55,123 @@ class _APIRoute(APIRoute):
             return response
 
         return custom_route_handler
+
+
+class MaxBodySizeMiddleware:
+    """MaxBodySizeMiddleware.
+
+    MaxBodySizeMiddleware rejects requests whose body is larger than
+    max_body_bytes with a 413. A too large Content-Length is rejected before
+    the body is read, and other bodies are counted as they stream in, so an
+    oversized body is never buffered whole.
+    """
+
+    def __init__(self, app: ASGIApp, max_body_bytes: int) -> None:
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        detail = f"Request body must be at most {self.max_body_bytes} bytes."
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_body_bytes:
+            response = JSONResponse(status_code=413, content={"detail": detail})
+            await response(scope, receive, send)
+            return
+        received = 0
+
+        async def _receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, _receive, send)
+
+
+class RequestDecompressionMiddleware:
+    """RequestDecompressionMiddleware.
+
+    RequestDecompressionMiddleware decompresses request bodies sent with a
+    gzip or zstd Content-Encoding before they reach the routes. A body that
+    inflates to more than max_body_bytes is rejected with a 413 as soon as it
+    gets that large, so a small compressed body can't exhaust memory.
+    """
+
+    def __init__(self, app: ASGIApp, max_body_bytes: int) -> None:
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        encoding = headers.get(b"content-encoding", b"").decode("latin-1")
+        encoding = encoding.strip().lower()
+        if encoding in ("", ContentEncoding.IDENTITY):
+            await self.app(scope, receive, send)
+            return
+        chunks = []
+        more_body = True
+        try:
+            while more_body:
+                message = await receive()
+                chunks.append(message.get("body", b""))
+                more_body = message.get("more_body", False)
+        except HTTPException as e:
+            # raised by MaxBodySizeMiddleware outside of the app's handlers
+            response = JSONResponse(
+                status_code=e.status_code, content={"detail": e.detail}
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            body = await asyncio.to_thread(
+                decompress,
+                b"".join(chunks),
+                encoding,
+                max_bytes=self.max_body_bytes,
+            )
+        except UnsupportedEncoding as e:
+            response = JSONResponse(status_code=415, content={"detail": str(e)})
+            await response(scope, receive, send)
+            return
+        except DecompressedTooLarge:
+            response = JSONResponse(
+                status_code=413,
+                content={
+                    "detail": "Request body must decompress to at most "
+                    f"{self.max_body_bytes} bytes."
+                },
+            )
+            await response(scope, receive, send)
+            return
+        except DecompressionError as e:
+            response = JSONResponse(status_code=400, content={"detail": str(e)})
+            await response(scope, receive, send)
+            return
+        scope = {
+            **scope,
+            "headers": [
+                (name, value)
+                for name, value in scope["headers"]
+                if name not in (b"content-encoding", b"content-length")
+            ]
+            + [(b"content-length", str(len(body)).encode("latin-1"))],
+        }
+        sent = False
+
+        async def _receive() -> Message:
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app(scope, _receive, send)
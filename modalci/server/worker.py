@@ -0,0 +1,73 @@
+import asyncio
+import multiprocessing
+import multiprocessing.connection
+import signal
+from typing import List
+
+from modalci.server.delivery import delivery_client
+from modalci.server.log import log
+from modalci.server.metrics import metrics
+from modalci.server.notify import message_listener
+from modalci.server.workers import delivery_workers
+from settings import env
+
+
+async def serve(workers: int) -> None:
+    # like a server process, a delivery process leases its share of the topic
+    # partitions, and is woken up by publishes through the message listener
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+    await metrics.start()
+    await delivery_client.start()
+    await delivery_workers.start(workers=workers)
+    if env.PSQL_LISTEN:
+        await message_listener.start()
+    log.info(f"Delivery process started with {workers} workers.")
+    try:
+        await stopping.wait()
+    finally:
+        await message_listener.stop()
+        await delivery_workers.stop()
+        await delivery_client.close()
+        await metrics.stop()
+
+
+def run(workers: int) -> None:
+    asyncio.run(serve(workers=workers))
+
+
+def run_processes(processes: int, workers: int) -> int:
+    if processes == 1:
+        run(workers=workers)
+        return 0
+    context = multiprocessing.get_context("spawn")
+    children: List[multiprocessing.process.BaseProcess] = [
+        context.Process(target=run, kwargs={"workers": workers})
+        for _ in range(processes)
+    ]
+    for child in children:
+        child.start()
+    stopping = False
+
+    # the processes stop their workers and release their leases on SIGTERM
+    def _terminate(signum: int, frame: object) -> None:
+        nonlocal stopping
+        stopping = True
+        for child in children:
+            if child.is_alive():
+                child.terminate()
+
+    signal.signal(signal.SIGTERM, _terminate)
+    signal.signal(signal.SIGINT, _terminate)
+    multiprocessing.connection.wait([child.sentinel for child in children])
+    failed = not stopping
+    if failed:
+        # a process died on its own, so the others are stopped too and
+        # whatever supervises the command can restart it
+        log.error("A delivery process exited, stopping the others.")
+        _terminate(signal.SIGTERM, None)
+    for child in children:
+        child.join()
+    return 1 if failed else 0
@@ -0,0 +1,666 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional
+
+import httpx
+from pydantic import UUID4
+from sqlalchemy import and_, or_, update
+from sqlalchemy.orm import defer
+from sqlalchemy.sql import ColumnElement, Select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from modalci._types import ContentEncoding, DeliveryStatus, DeliveryType
+from modalci.db import async_session
+from modalci.models import Delivery, Subscription, TopicMessage
+from modalci.server.breakers import delivery_breakers
+from modalci.server.compression import compress, decompress, zstd_available
+from modalci.server.delivery import delivery_client
+from modalci.server.leases import PartitionLeases, partition_leases, topic_partition
+from modalci.server.limits import delivery_limiter
+from modalci.server.log import log
+from modalci.server.metrics import (
+    push_messages_parked_total,
+    push_messages_total,
+    push_request_duration_seconds,
+    push_requests_in_flight,
+    push_requests_total,
+)
+from modalci.server.ordering import in_order, ordered_deliveries
+from modalci.server.retry import backoff_seconds, is_exhausted, is_expired
+from settings import env
+
+
+class DeliveryBody(NamedTuple):
+    """DeliveryBody.
+
+    DeliveryBody is a push request body with its headers. It is built once
+    per message and shared, unmodified, by every delivery of the message.
+    """
+
+    content: bytes
+    headers: Dict[str, str]
+
+    @property
+    def is_json(self) -> bool:
+        content_type = self.headers["Content-Type"].split(";")[0]
+        return content_type.strip().lower() == "application/json"
+
+    @classmethod
+    def from_data(
+        cls, data: bytes, content_type: str, content_encoding: Optional[str] = None
+    ) -> "DeliveryBody":
+        headers = {"Content-Type": content_type, "Content-Length": str(len(data))}
+        if content_encoding is not None:
+            headers["Content-Encoding"] = content_encoding
+        return cls(content=data, headers=headers)
+
+    @classmethod
+    def from_batch(cls, bodies: List["DeliveryBody"]) -> "DeliveryBody":
+        content = b"[" + b",".join(b.content for b in bodies) + b"]"
+        return cls(
+            content=content,
+            headers={
+                "Content-Type": "application/json",
+                "Content-Length": str(len(content)),
+            },
+        )
+
+    def encode(self, encoding: ContentEncoding) -> "DeliveryBody":
+        content = compress(self.content, encoding)
+        return DeliveryBody(
+            content=content,
+            headers={
+                **self.headers,
+                "Content-Encoding": encoding.value,
+                "Content-Length": str(len(content)),
+            },
+        )
+
+
+class DeliveryBodyCache:
+    """DeliveryBodyCache.
+
+    DeliveryBodyCache keeps the bodies of recently delivered messages, up to
+    max_bytes, so that a message fanned out to many subscriptions is loaded
+    and encoded once instead of once per claim. Bodies are keyed by message
+    id, and compressed bodies by message id and content encoding.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._bodies: "OrderedDict[Hashable, DeliveryBody]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[DeliveryBody]:
+        body = self._bodies.get(key)
+        if body is not None:
+            self._bodies.move_to_end(key)
+        return body
+
+    def put(self, key: Hashable, body: DeliveryBody) -> None:
+        if key in self._bodies or len(body.content) > self.max_bytes:
+            return
+        self._bodies[key] = body
+        self.bytes += len(body.content)
+        while self.bytes > self.max_bytes:
+            _, evicted = self._bodies.popitem(last=False)
+            self.bytes -= len(evicted.content)
+
+
+def _push_encoding(subscription: Subscription) -> Optional[ContentEncoding]:
+    encoding = subscription.push_content_encoding
+    if encoding in (None, ContentEncoding.IDENTITY):
+        return None
+    if encoding == ContentEncoding.ZSTD and not zstd_available():  # pragma: no cover
+        return None
+    return ContentEncoding(encoding)
+
+
+def _ordering_key(subscription: Subscription, delivery: Delivery) -> Optional[str]:
+    if not subscription.enable_message_ordering:
+        return None
+    return delivery.ordering_key
+
+
+def _limiter_timeout(leased_until: Optional[float]) -> Optional[float]:
+    # a delivery may only wait for the limits while its lease still has room
+    # for the request itself
+    if leased_until is None:
+        return None
+    request_seconds = (
+        env.DELIVERY_CONNECT_TIMEOUT_SECONDS + env.DELIVERY_READ_TIMEOUT_SECONDS
+    )
+    return max(leased_until - time.monotonic() - request_seconds, 0.0)
+
+
+class DeliveryResult(NamedTuple):
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+    parked_until: Optional[datetime] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code is not None and 200 <= self.status_code < 300
+
+    @property
+    def failed(self) -> bool:
+        # client errors other than 429 mean the endpoint is up
+        return self.status_code is None or (
+            self.status_code >= 500 or self.status_code == 429
+        )
+
+
+class DeliveryWorker:
+    """DeliveryWorker.
+
+    DeliveryWorker drains pending push deliveries from the outbox. Rows are
+    claimed with SELECT ... FOR UPDATE SKIP LOCKED and leased by moving their
+    next_attempt_at forward, so any number of workers can share the table and
+    a delivery whose worker dies is picked up again once its lease expires.
+
+    Deliveries that don't get a 2xx response are scheduled for another attempt
+    using the subscription's retry policy, and are dead-lettered once they run
+    out of attempts or the message gets too old. Deliveries to a host whose
+    circuit breaker is open aren't sent; they are parked until the breaker
+    lets requests through again, without using up an attempt.
+
+    A worker given leases only claims deliveries from the topic partitions they
+    hold, see PartitionLeases.
+
+    Subscriptions with message ordering enabled only get the oldest pending
+    delivery of each ordering key claimed, so messages with the same key go
+    out one at a time and in order, while different keys go out in parallel.
+
+    Messages are delivered as the bytes they were published with. Deliveries
+    of JSON messages to subscriptions with batching enabled are coalesced into
+    one JSON array POST per batch, and a single 2xx acks the whole batch.
+    """
+
+    def __init__(
+        self, wakeup: asyncio.Event, leases: Optional[PartitionLeases] = None
+    ) -> None:
+        self.wakeup = wakeup
+        self.leases = leases
+
+    def _owned(self) -> List[ColumnElement]:
+        # without leases, the worker claims from every topic partition
+        if self.leases is None:
+            return []
+        return [
+            topic_partition(Delivery.partition_hash).in_(  # type: ignore
+                self.leases.owned
+            )
+        ]
+
+    async def _lease(
+        self,
+        psql: AsyncSession,
+        query: Select,
+        now: datetime,
+    ) -> List[Delivery]:
+        results = await psql.execute(
+            query.with_for_update(of=Delivery, skip_locked=True)  # type: ignore
+        )
+        deliveries = results.scalars().all()
+        for delivery in deliveries:
+            delivery.attempts += 1
+            delivery.next_attempt_at = now + timedelta(
+                seconds=env.DELIVERY_LEASE_SECONDS
+            )
+        return deliveries
+
+    async def claim(self, psql: AsyncSession) -> List[Delivery]:
+        if self.leases is not None and not self.leases.owned:
+            return []
+        now = datetime.utcnow()
+        deliveries = await self._lease(
+            psql=psql,
+            query=select(Delivery)
+            .join(Subscription, Delivery.subscription_id == Subscription.id)
+            .join(
+                TopicMessage,
+                and_(
+                    Delivery.message_id == TopicMessage.id,  # type: ignore
+                    Delivery.published_at == TopicMessage.created_at,
+                ),
+            )
+            .where(
+                Subscription.delivery_type == DeliveryType.PUSH,
+                Delivery.status == DeliveryStatus.PENDING,
+                Delivery.next_attempt_at <= now,  # type: ignore
+                or_(
+                    Subscription.enable_message_ordering.is_(False),  # type: ignore
+                    in_order(),
+                ),
+                *self._owned(),
+            )
+            .order_by(Delivery.next_attempt_at)
+            .limit(env.DELIVERY_CLAIM_BATCH_SIZE),
+            now=now,
+        )
+        if deliveries:
+            # once a batching subscription has a due delivery, fill its batch up
+            # with deliveries that are still lingering. Only never attempted
+            # deliveries that are due within the linger are taken, so retries
+            # keep their backoff, and paced replays and parked deliveries wait.
+            batching = (
+                await psql.execute(
+                    select(  # type: ignore
+                        Subscription.id,
+                        Subscription.batch_max_messages,
+                        Subscription.batch_max_linger_ms,
+                    ).where(
+                        Subscription.id.in_(  # type: ignore
+                            {d.subscription_id for d in deliveries}
+                        ),
+                        Subscription.batch_max_messages > 1,
+                    )
+                )
+            ).all()
+            claimed = [d.id for d in deliveries]
+            for subscription_id, batch_max_messages, batch_max_linger_ms in batching:
+                count = len(
+                    [d for d in deliveries if d.subscription_id == subscription_id]
+                )
+                if count >= batch_max_messages:
+                    continue
+                deliveries += await self._lease(
+                    psql=psql,
+                    query=select(Delivery)
+                    .join(Subscription, Delivery.subscription_id == Subscription.id)
+                    .join(
+                        TopicMessage,
+                        and_(
+                            Delivery.message_id == TopicMessage.id,
+                            Delivery.published_at == TopicMessage.created_at,
+                        ),
+                    )
+                    .where(
+                        Delivery.subscription_id == subscription_id,
+                        Delivery.status == DeliveryStatus.PENDING,
+                        Delivery.attempts == 0,
+                        Delivery.next_attempt_at  # type: ignore
+                        <= now + timedelta(milliseconds=batch_max_linger_ms),
+                        Delivery.id.not_in(claimed),  # type: ignore
+                        # ordered deliveries aren't batched, see batch()
+                        or_(
+                            Subscription.enable_message_ordering.is_(  # type: ignore
+                                False
+                            ),
+                            Delivery.ordering_key.is_(None),  # type: ignore
+                        ),
+                        *self._owned(),
+                    )
+                    .order_by(Delivery.created_at)
+                    .limit(batch_max_messages - count),
+                    now=now,
+                )
+        await psql.commit()
+        return deliveries
+
+    def batch(
+        self,
+        deliveries: List[Delivery],
+        bodies: Dict[UUID4, DeliveryBody],
+        subscriptions: Dict[UUID4, Subscription],
+    ) -> List[List[Delivery]]:
+        batches: List[List[Delivery]] = []
+        open_batches: Dict[UUID4, List[Delivery]] = {}
+        open_bytes: Dict[UUID4, int] = {}
+        for d in deliveries:
+            body = bodies[d.message_id]
+            subscription = subscriptions[d.subscription_id]
+            # only JSON messages can be coalesced into a JSON array, and ordered
+            # messages go out on their own
+            if not body.is_json or _ordering_key(subscription, d) is not None:
+                batches.append([d])
+                continue
+            size = len(body.content)
+            batch = open_batches.get(d.subscription_id)
+            if (
+                batch is None
+                or len(batch) >= subscription.batch_max_messages
+                or open_bytes[d.subscription_id] + size > subscription.batch_max_bytes
+            ):
+                batch = []
+                batches.append(batch)
+                open_batches[d.subscription_id] = batch
+                open_bytes[d.subscription_id] = 0
+            batch.append(d)
+            open_bytes[d.subscription_id] += size
+        return batches
+
+    async def body(
+        self,
+        subscription: Subscription,
+        batch: List[Delivery],
+        bodies: Dict[UUID4, DeliveryBody],
+    ) -> DeliveryBody:
+        if len(batch) > 1:
+            body = DeliveryBody.from_batch([bodies[d.message_id] for d in batch])
+        else:
+            body = bodies[batch[0].message_id]
+        encoding = _push_encoding(subscription)
+        if encoding is None or len(body.content) < env.MESSAGE_COMPRESSION_MIN_BYTES:
+            return body
+        if len(batch) > 1:
+            return await asyncio.to_thread(body.encode, encoding)
+        # a message is compressed once for every subscription that wants it so
+        key = (batch[0].message_id, encoding)
+        encoded = delivery_bodies.get(key)
+        if encoded is None:
+            encoded = await asyncio.to_thread(body.encode, encoding)
+            delivery_bodies.put(key, encoded)
+        return encoded
+
+    async def deliver(
+        self,
+        subscription: Subscription,
+        body: DeliveryBody,
+        leased_until: Optional[float] = None,
+    ) -> DeliveryResult:
+        subscription_id = str(subscription.id)
+        breaker = delivery_breakers.get(subscription=subscription)
+        parked_seconds = breaker.acquire()
+        if parked_seconds is not None:
+            return DeliveryResult(
+                error="Circuit breaker open for the push endpoint host.",
+                parked_until=datetime.utcnow() + timedelta(seconds=parked_seconds),
+            )
+        push_requests_in_flight.inc(subscription_id=subscription_id)
+        start = time.perf_counter()
+        result: Optional[DeliveryResult] = None
+        try:
+            async with delivery_limiter.acquire(
+                subscription=subscription,
+                timeout=_limiter_timeout(leased_until=leased_until),
+            ):
+                response = await delivery_client.post(
+                    str(subscription.push_endpoint),
+                    content=body.content,
+                    headers=body.headers,
+                )
+            result = DeliveryResult(status_code=response.status_code)
+        except httpx.HTTPError as e:
+            result = DeliveryResult(error=repr(e))
+        except asyncio.TimeoutError:
+            # the lease would lapse before the request is sent, and another
+            # worker would claim the delivery again, so it is parked instead
+            result = DeliveryResult(
+                error="Timed out waiting for the delivery limits.",
+                parked_until=datetime.utcnow(),
+            )
+        finally:
+            push_requests_in_flight.dec(subscription_id=subscription_id)
+            breaker.release(
+                failed=(
+                    result.failed
+                    if result is not None and result.parked_until is None
+                    else None
+                )
+            )
+        if result.parked_until is not None:
+            return result
+        push_request_duration_seconds.observe(
+            time.perf_counter() - start, subscription_id=subscription_id
+        )
+        push_requests_total.inc(
+            subscription_id=subscription_id,
+            status_code=result.status_code or "error",
+        )
+        return result
+
+    async def record(
+        self,
+        psql: AsyncSession,
+        deliveries: List[Delivery],
+        messages: Dict[UUID4, TopicMessage],
+        subscriptions: Dict[UUID4, Subscription],
+        results: List[DeliveryResult],
+    ) -> None:
+        now = datetime.utcnow()
+        delivered = [d.id for d, result in zip(deliveries, results) if result.ok]
+        if delivered:
+            await psql.execute(
+                update(Delivery)
+                .where(Delivery.id.in_(delivered))  # type: ignore
+                .values(status=DeliveryStatus.DELIVERED, last_error=None)
+            )
+        for d, result in zip(deliveries, results):
+            if result.ok:
+                continue
+            subscription = subscriptions[d.subscription_id]
+            values: Dict[str, Any] = {
+                "last_status_code": result.status_code,
+                "last_error": result.error,
+            }
+            if result.parked_until is not None:
+                # the request was never sent, so give the attempt back
+                values["attempts"] = d.attempts - 1
+                values["next_attempt_at"] = result.parked_until
+            elif is_exhausted(
+                subscription=subscription,
+                delivery=d,
+                message=messages[d.message_id],
+                now=now,
+            ):
+                log.warning(f"Delivery {d.id} dead-lettered: {result}")
+                values["status"] = DeliveryStatus.DEAD_LETTERED
+            else:
+                values["next_attempt_at"] = now + timedelta(
+                    seconds=backoff_seconds(
+                        subscription=subscription, attempts=d.attempts
+                    )
+                )
+            await psql.execute(
+                update(Delivery).where(Delivery.id == d.id).values(**values)
+            )
+        await psql.commit()
+
+    async def run_once(self) -> int:
+        leased_until = time.monotonic() + env.DELIVERY_LEASE_SECONDS
+        async with async_session() as psql:
+            deliveries = await self.claim(psql=psql)
+            if not deliveries:
+                return 0
+            # message data is only loaded for messages whose body isn't cached
+            messages: Dict[UUID4, TopicMessage] = {
+                m.id: m
+                for m in (
+                    await psql.execute(
+                        select(TopicMessage)
+                        .options(defer(TopicMessage.data))  # type: ignore
+                        .where(
+                            TopicMessage.id.in_(  # type: ignore
+                                {d.message_id for d in deliveries}
+                            )
+                        )
+                    )
+                ).scalars()
+            }
+            bodies: Dict[UUID4, DeliveryBody] = {}
+            for message_id in messages:
+                body = delivery_bodies.get(message_id)
+                if body is not None:
+                    bodies[message_id] = body
+            uncached = [
+                message_id for message_id in messages if message_id not in bodies
+            ]
+            if uncached:
+                stored = (
+                    await psql.execute(
+                        select(TopicMessage.id, TopicMessage.data).where(
+                            TopicMessage.id.in_(uncached)  # type: ignore
+                        )
+                    )
+                ).all()
+                for message_id, data in stored:
+                    message = messages[message_id]
+                    if message.content_encoding is None:
+                        body = DeliveryBody.from_data(
+                            data=data, content_type=message.content_type
+                        )
+                    else:
+                        # the stored data is pushed as is to subscriptions
+                        # that accept its encoding
+                        delivery_bodies.put(
+                            (message_id, ContentEncoding(message.content_encoding)),
+                            DeliveryBody.from_data(
+                                data=data,
+                                content_type=message.content_type,
+                                content_encoding=message.content_encoding,
+                            ),
+                        )
+                        body = DeliveryBody.from_data(
+                            data=await asyncio.to_thread(
+                                decompress,
+                                data,
+                                message.content_encoding,
+                                max_bytes=env.MESSAGE_MAX_BYTES,
+                            ),
+                            content_type=message.content_type,
+                        )
+                    bodies[message_id] = body
+                    delivery_bodies.put(message_id, body)
+            subscriptions: Dict[UUID4, Subscription] = {
+                s.id: s
+                for s in (
+                    await psql.execute(
+                        select(Subscription).where(
+                            Subscription.id.in_(  # type: ignore
+                                {d.subscription_id for d in deliveries}
+                            )
+                        )
+                    )
+                ).scalars()
+            }
+        # the message or subscription may have been deleted since the claim
+        deliveries = [
+            d
+            for d in deliveries
+            if d.message_id in messages and d.subscription_id in subscriptions
+        ]
+        now = datetime.utcnow()
+        results: Dict[UUID4, DeliveryResult] = {
+            d.id: DeliveryResult(error="Message exceeded max_message_age_seconds.")
+            for d in deliveries
+            if is_expired(
+                subscription=subscriptions[d.subscription_id],
+                message=messages[d.message_id],
+                now=now,
+            )
+        }
+        batches = self.batch(
+            deliveries=[d for d in deliveries if d.id not in results],
+            bodies=bodies,
+            subscriptions=subscriptions,
+        )
+        # a fixed number of senders drain the batches, so a large claim doesn't
+        # start a task per batch
+        batch_results: List[DeliveryResult] = [DeliveryResult()] * len(batches)
+        pending = iter(enumerate(batches))
+
+        async def _drain() -> None:
+            for i, batch in pending:
+                subscription = subscriptions[batch[0].subscription_id]
+                deliver = partial(
+                    self.deliver,
+                    subscription=subscription,
+                    body=await self.body(
+                        subscription=subscription, batch=batch, bodies=bodies
+                    ),
+                    leased_until=leased_until,
+                )
+                ordering_key = _ordering_key(subscription, batch[0])
+                if ordering_key is None:
+                    batch_results[i] = await deliver()
+                else:
+                    batch_results[i] = await ordered_deliveries.run(
+                        key=(subscription.id, ordering_key), fn=deliver
+                    )
+                if batch_results[i].parked_until is None:
+                    push_messages_total.inc(len(batch), subscription_id=subscription.id)
+                else:
+                    push_messages_parked_total.inc(
+                        len(batch), subscription_id=subscription.id
+                    )
+
+        await asyncio.gather(
+            *[_drain() for _ in range(min(env.DELIVERY_CONCURRENCY, len(batches)))]
+        )
+        for batch, result in zip(batches, batch_results):
+            results.update({d.id: result for d in batch})
+        async with async_session() as psql:
+            await self.record(
+                psql=psql,
+                deliveries=deliveries,
+                messages=messages,
+                subscriptions=subscriptions,
+                results=[results[d.id] for d in deliveries],
+            )
+        return len(deliveries)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                claimed = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # pragma: no cover
+                log.exception("Delivery worker failed to process deliveries.")
+                claimed = 0
+            if claimed == 0:
+                try:
+                    await asyncio.wait_for(
+                        self.wakeup.wait(),
+                        timeout=env.DELIVERY_POLL_INTERVAL_SECONDS,
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+
+
+class DeliveryWorkerPool:
+    """DeliveryWorkerPool.
+
+    DeliveryWorkerPool runs the server's background delivery workers and wakes
+    them up when new deliveries are written so they don't wait for their next
+    poll. The workers only claim deliveries from the topic partitions that the
+    process leases.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def notify(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self, workers: int = env.DELIVERY_WORKERS) -> None:
+        self._wakeup = asyncio.Event()
+        if workers > 0:
+            await partition_leases.start()
+        self._tasks = [
+            asyncio.create_task(
+                DeliveryWorker(wakeup=self._wakeup, leases=partition_leases).run()
+            )
+            for _ in range(workers)
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._tasks:
+            await partition_leases.stop()
+        self._tasks = []
+        self._wakeup = None
+
+
+delivery_bodies = DeliveryBodyCache(max_bytes=env.DELIVERY_BODY_CACHE_BYTES)
+delivery_workers = DeliveryWorkerPool()
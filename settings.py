@@ -1,6 +1,7 @@
+import json
 import os
 import sys
-from typing import Dict
+from typing import Dict, Literal, Optional
 
 from pydantic import BaseSettings, Field
 
@@ -41,6 +42,252 @@ class _Env(BaseSettings):
         env="PSQL_POOL_PRE_PING",
         description="The PSQL database pre pool ping.",
     )
+    DELIVERY_MAX_CONNECTIONS: int = Field(
+        100,
+        env="DELIVERY_MAX_CONNECTIONS",
+        description="Max open connections in the push delivery client pool.",
+    )
+    DELIVERY_MAX_KEEPALIVE_CONNECTIONS: int = Field(
+        20,
+        env="DELIVERY_MAX_KEEPALIVE_CONNECTIONS",
+        description="Max idle keep-alive connections in the push delivery client pool.",
+    )
+    DELIVERY_MAX_CONNECTIONS_PER_HOST: int = Field(
+        10,
+        env="DELIVERY_MAX_CONNECTIONS_PER_HOST",
+        description="Max concurrent push delivery requests to a single host, per "
+        "delivery process.",
+    )
+    DELIVERY_MAX_MESSAGES_PER_SECOND_PER_HOST: Optional[float] = Field(
+        None,
+        env="DELIVERY_MAX_MESSAGES_PER_SECOND_PER_HOST",
+        description="Max push deliveries per second to a single host, per delivery "
+        "process; unlimited if unset.",
+    )
+    DELIVERY_LIMITER_MAX_QUEUES: int = Field(
+        10_000,
+        env="DELIVERY_LIMITER_MAX_QUEUES",
+        description="Max per-subscription and per-host delivery limit queues kept "
+        "per process; the least recently used idle queues are dropped.",
+    )
+    DELIVERY_BREAKER_WINDOW_SIZE: int = Field(
+        20,
+        env="DELIVERY_BREAKER_WINDOW_SIZE",
+        description="Number of recent push requests to a host that its circuit "
+        "breaker's failure rate is computed over.",
+    )
+    DELIVERY_BREAKER_MIN_REQUESTS: int = Field(
+        10,
+        env="DELIVERY_BREAKER_MIN_REQUESTS",
+        description="Push requests to a host needed before its circuit breaker "
+        "can open.",
+    )
+    DELIVERY_BREAKER_FAILURE_RATE: float = Field(
+        0.5,
+        env="DELIVERY_BREAKER_FAILURE_RATE",
+        description="Failure rate of recent push requests to a host, from 0 to "
+        "1, at which its circuit breaker opens.",
+    )
+    DELIVERY_BREAKER_OPEN_SECONDS: float = Field(
+        30.0,
+        env="DELIVERY_BREAKER_OPEN_SECONDS",
+        description="Seconds a host's circuit breaker stays open before a trial "
+        "request is let through.",
+    )
+    DELIVERY_KEEPALIVE_EXPIRY_SECONDS: float = Field(
+        30.0,
+        env="DELIVERY_KEEPALIVE_EXPIRY_SECONDS",
+        description="Seconds an idle push delivery connection is kept alive.",
+    )
+    DELIVERY_HTTP2: bool = Field(
+        False,
+        env="DELIVERY_HTTP2",
+        description="Enable HTTP/2 for push delivery; requires the http2 extra.",
+    )
+    DELIVERY_CONNECT_TIMEOUT_SECONDS: float = Field(
+        5.0,
+        env="DELIVERY_CONNECT_TIMEOUT_SECONDS",
+        description="Push delivery connect timeout in seconds.",
+    )
+    DELIVERY_READ_TIMEOUT_SECONDS: float = Field(
+        30.0,
+        env="DELIVERY_READ_TIMEOUT_SECONDS",
+        description="Push delivery read timeout in seconds.",
+    )
+    DELIVERY_WRITE_TIMEOUT_SECONDS: float = Field(
+        30.0,
+        env="DELIVERY_WRITE_TIMEOUT_SECONDS",
+        description="Push delivery write timeout in seconds.",
+    )
+    DELIVERY_POOL_TIMEOUT_SECONDS: float = Field(
+        10.0,
+        env="DELIVERY_POOL_TIMEOUT_SECONDS",
+        description="Seconds to wait for a free push delivery connection.",
+    )
+    MESSAGE_MAX_BYTES: int = Field(
+        10_000_000,
+        env="MESSAGE_MAX_BYTES",
+        description="Max size of a published message's data in bytes.",
+    )
+    MAX_REQUEST_BODY_BYTES: int = Field(
+        16_000_000,
+        env="MAX_REQUEST_BODY_BYTES",
+        description="Max size of a request body in bytes, enforced while it is "
+        "received.",
+    )
+    PUBLISH_BATCH_MAX_MESSAGES: int = Field(
+        1000,
+        env="PUBLISH_BATCH_MAX_MESSAGES",
+        description="Max messages accepted by a single batch publish request.",
+    )
+    DELIVERY_WORKERS: int = Field(
+        4,
+        env="DELIVERY_WORKERS",
+        description="Number of background delivery workers run by the server.",
+    )
+    TOPIC_PARTITIONS: int = Field(
+        16,
+        env="TOPIC_PARTITIONS",
+        description="Partitions that push deliveries are split into, each claimed "
+        "by one server process at a time.",
+    )
+    TOPIC_PARTITION_REBALANCE_INTERVAL_SECONDS: float = Field(
+        5.0,
+        env="TOPIC_PARTITION_REBALANCE_INTERVAL_SECONDS",
+        description="Seconds between a process's heartbeats, when it takes or "
+        "releases topic partitions to keep its fair share.",
+    )
+    DELIVERY_CONCURRENCY: int = Field(
+        32,
+        env="DELIVERY_CONCURRENCY",
+        description="Max push requests each delivery worker sends at once.",
+    )
+    DELIVERY_CLAIM_BATCH_SIZE: int = Field(
+        100,
+        env="DELIVERY_CLAIM_BATCH_SIZE",
+        description="Max deliveries a worker claims from the outbox at once.",
+    )
+    DELIVERY_POLL_INTERVAL_SECONDS: float = Field(
+        1.0,
+        env="DELIVERY_POLL_INTERVAL_SECONDS",
+        description="Seconds an idle delivery worker waits before polling again.",
+    )
+    DELIVERY_BODY_CACHE_BYTES: int = Field(
+        64_000_000,
+        env="DELIVERY_BODY_CACHE_BYTES",
+        description="Max bytes of push delivery bodies kept in memory so a "
+        "message fanned out to many subscriptions is only loaded and encoded "
+        "once.",
+    )
+    DELIVERY_LEASE_SECONDS: float = Field(
+        60.0,
+        env="DELIVERY_LEASE_SECONDS",
+        description="Seconds a claimed delivery is hidden from other workers.",
+    )
+    PULL_MAX_WAIT_SECONDS: float = Field(
+        60.0,
+        env="PULL_MAX_WAIT_SECONDS",
+        description="Max seconds a long-polling pull may wait for messages.",
+    )
+    PULL_POLL_INTERVAL_SECONDS: float = Field(
+        5.0,
+        env="PULL_POLL_INTERVAL_SECONDS",
+        description="Seconds a long-polling pull waits before checking for "
+        "expired leases without a notification.",
+    )
+    STREAM_KEEPALIVE_SECONDS: float = Field(
+        15.0,
+        env="STREAM_KEEPALIVE_SECONDS",
+        description="Seconds between keepalive comments on idle event streams.",
+    )
+    STREAM_MAX_QUEUED_MESSAGES: int = Field(
+        1000,
+        env="STREAM_MAX_QUEUED_MESSAGES",
+        description="Max messages queued for one event stream watcher before it "
+        "is disconnected to resume from its Last-Event-ID.",
+    )
+    STREAM_LATE_COMMIT_SECONDS: float = Field(
+        5.0,
+        env="STREAM_LATE_COMMIT_SECONDS",
+        description="Seconds an event stream keeps re-reading behind its position "
+        "for publishes that commit after later ones.",
+    )
+    PSQL_LISTEN: bool = Field(
+        True,
+        env="PSQL_LISTEN",
+        description="Listen for publishes from other processes with Postgres "
+        "LISTEN/NOTIFY.",
+    )
+    MESSAGE_COMPRESSION: Literal["identity", "gzip", "zstd"] = Field(
+        "gzip",
+        env="MESSAGE_COMPRESSION",
+        description="How message data is compressed when stored; zstd requires "
+        "the zstd extra.",
+    )
+    MESSAGE_COMPRESSION_MIN_BYTES: int = Field(
+        1024,
+        env="MESSAGE_COMPRESSION_MIN_BYTES",
+        description="Smallest message data, or push request body, that is "
+        "compressed.",
+    )
+    PARTITION_MAINTENANCE_INTERVAL_SECONDS: float = Field(
+        3600.0,
+        env="PARTITION_MAINTENANCE_INTERVAL_SECONDS",
+        description="Seconds between runs of the task that creates upcoming "
+        "daily message and delivery partitions and drops expired ones.",
+    )
+    PARTITION_PRECREATE_DAYS: int = Field(
+        3,
+        env="PARTITION_PRECREATE_DAYS",
+        description="Days ahead for which message and delivery partitions are "
+        "created.",
+    )
+    SEEK_MAX_MESSAGES_PER_SECOND: float = Field(
+        100.0,
+        env="SEEK_MAX_MESSAGES_PER_SECOND",
+        description="Default rate at which messages are replayed to a "
+        "subscription after a seek.",
+    )
+    IDEMPOTENCY_CACHE_KEYS: int = Field(
+        100_000,
+        env="IDEMPOTENCY_CACHE_KEYS",
+        description="Max recently published idempotency keys remembered in "
+        "memory, so retried publishes are answered without a database lookup.",
+    )
+    IDEMPOTENCY_CACHE_TTL_SECONDS: float = Field(
+        600,
+        env="IDEMPOTENCY_CACHE_TTL_SECONDS",
+        description="Seconds an idempotency key is remembered in memory.",
+    )
+    PUBLISH_GROUP_COMMIT_MAX_MESSAGES: int = Field(
+        500,
+        env="PUBLISH_GROUP_COMMIT_MAX_MESSAGES",
+        description="Messages from concurrent publishes written in one commit.",
+    )
+    PUBLISH_GROUP_COMMIT_MAX_DELAY_SECONDS: float = Field(
+        0.005,
+        env="PUBLISH_GROUP_COMMIT_MAX_DELAY_SECONDS",
+        description="Max seconds a publish waits for others to commit with.",
+    )
+    SUBSCRIPTION_FILTERS_TTL_SECONDS: float = Field(
+        30,
+        env="SUBSCRIPTION_FILTERS_TTL_SECONDS",
+        description="Max seconds a topic's index of subscription filters is used "
+        "before it is rebuilt, in case a change to its subscriptions was missed.",
+    )
+    METRICS_DIR: Optional[str] = Field(
+        None,
+        env="METRICS_DIR",
+        description="Directory where every server and delivery worker process "
+        "writes its metrics, so /metrics reports the sum over all processes; set "
+        "automatically when the server runs with several workers, and required "
+        "by the worker command.",
+    )
+    METRICS_FLUSH_INTERVAL_SECONDS: float = Field(
+        5,
+        env="METRICS_FLUSH_INTERVAL_SECONDS",
+        description="Seconds between writes of a process's metrics to METRICS_DIR.",
+    )
     VOLUMES: Dict[str, str] = Field(
         dict(),
         env="VOLUMES",
@@ -50,12 +297,20 @@ class _Env(BaseSettings):
     )
 
     def to_modal_secret(self) -> Dict[str, str]:
-        _result = self.dict()
-        for k, v in _result.items():
+        _result = {}
+        for k, v in self.dict().items():
+            # unset optional settings are left out, so they stay None
+            if v is None:
+                continue
             if isinstance(v, bool):
                 _result[k] = str(v).lower()
+            elif isinstance(v, (dict, list)):
+                # complex settings are parsed from JSON
+                _result[k] = json.dumps(v)
             elif not isinstance(v, str):
                 _result[k] = str(v)
+            else:
+                _result[k] = v
         return _result
 
     class Config:
@@ -1,9 +1,11 @@
 from multiprocessing import Process
 
+import pytest
 from typer.testing import CliRunner
 
 from modalci import __version__
 from modalci.cli import app
+from settings import env
 
 
 def test_cli_version(runner: CliRunner) -> None:
@@ -17,3 +19,24 @@ def test_cli_start_server(runner: CliRunner) -> None:
     p.start()
     p.terminate()
     p.join()
+
+
+def test_cli_start_worker(runner: CliRunner) -> None:
+    p = Process(target=runner.invoke, args=(app, ["worker", "--processes", "1"]))
+    p.start()
+    p.terminate()
+    p.join()
+
+
+def test_cli_worker_rejects_no_processes(runner: CliRunner) -> None:
+    result = runner.invoke(app, ["worker", "--processes", "0"])
+    assert result.exit_code == 2
+
+
+def test_cli_worker_requires_metrics_dir(
+    runner: CliRunner, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(env, "METRICS_DIR", None)
+    result = runner.invoke(app, ["worker"])
+    assert result.exit_code == 1
+    assert "METRICS_DIR" in result.output
@@ -0,0 +1,68 @@
+from uuid import uuid4
+
+import pytest
+
+from modalci.filters import FilterIndex, FilterSyntaxError, compile_filter
+
+
+@pytest.mark.parametrize(
+    "expression,attributes,matches",
+    [
+        ('attributes.region = "us"', {"region": "us"}, True),
+        ('attributes.region = "us"', {"region": "eu"}, False),
+        ('attributes.region = "us"', {}, False),
+        ('attributes.region != "us"', {}, True),
+        ('attributes.kind IN ("a", "b")', {"kind": "b"}, True),
+        ('attributes.kind NOT IN ("a", "b")', {"kind": "b"}, False),
+        (
+            'attributes.region = "us" AND attributes.kind IN ("a", "b")',
+            {"region": "us", "kind": "c"},
+            False,
+        ),
+        (
+            'attributes.region = "us" OR NOT (attributes.kind = "a")',
+            {"region": "eu", "kind": "c"},
+            True,
+        ),
+        ('attributes.quote = "say \\"hi\\""', {"quote": 'say "hi"'}, True),
+    ],
+)
+def test_compile_filter(expression: str, attributes: dict, matches: bool) -> None:
+    assert compile_filter(expression).matches(attributes) is matches
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        "",
+        'region = "us"',
+        'attributes.region = "us" AND',
+        "attributes.region = us",
+        '(attributes.region = "us"',
+        "attributes.region IN ()",
+        'attributes.region = "us" attributes.kind = "a"',
+    ],
+)
+def test_compile_filter_invalid_fails(expression: str) -> None:
+    with pytest.raises(FilterSyntaxError):
+        compile_filter(expression)
+
+
+def test_filter_index_only_checks_candidates() -> None:
+    us, a_or_b, not_eu, either = (uuid4() for _ in range(4))
+    index = FilterIndex(
+        [
+            (us, compile_filter('attributes.region = "us"')),
+            (a_or_b, compile_filter('attributes.kind IN ("a", "b")')),
+            (not_eu, compile_filter('attributes.region != "eu"')),
+            (
+                either,
+                compile_filter('attributes.kind = "a" OR attributes.kind = "c"'),
+            ),
+        ]
+    )
+    # only the filter that can't be anchored on a value is always a candidate
+    assert index._unanchored == [(not_eu, compile_filter('attributes.region != "eu"'))]
+    assert index.match({"region": "us", "kind": "a"}) == {us, a_or_b, not_eu, either}
+    assert index.match({"region": "eu", "kind": "c"}) == {either}
+    assert index.match({}) == {not_eu}
@@ -0,0 +1,107 @@
+import time
+from unittest import mock
+
+import httpx
+import pytest
+from httpx import AsyncClient
+
+from modalci._types import BreakerState
+from modalci.models import Subscription
+from modalci.server.breakers import CircuitBreaker, DeliveryBreakers
+from modalci.server.workers import DeliveryBody, DeliveryWorker
+
+
+def _breaker(
+    window_size: int = 4,
+    min_requests: int = 2,
+    failure_rate: float = 0.5,
+    open_seconds: float = 60.0,
+) -> CircuitBreaker:
+    return CircuitBreaker(
+        window_size=window_size,
+        min_requests=min_requests,
+        failure_rate=failure_rate,
+        open_seconds=open_seconds,
+    )
+
+
+def test_breaker_opens_at_failure_rate() -> None:
+    breaker = _breaker()
+    assert breaker.acquire() is None
+    breaker.release(failed=True)
+    # too few requests to judge the host yet
+    assert breaker.state == BreakerState.CLOSED
+    assert breaker.acquire() is None
+    breaker.release(failed=False)
+    assert breaker.state == BreakerState.OPEN
+
+    parked = breaker.acquire()
+    assert parked is not None and 59 < parked <= 60
+    stats = breaker.stats()
+    assert stats.parked == 1
+    assert stats.open_until is not None
+
+
+def test_breaker_window_forgets_old_outcomes() -> None:
+    breaker = _breaker(min_requests=4, failure_rate=0.75)
+    for failed in (True, True, False, False, False, False, True, True):
+        assert breaker.acquire() is None
+        breaker.release(failed=failed)
+    assert breaker.state == BreakerState.CLOSED
+    assert breaker.stats().failures == 2
+
+
+def test_breaker_half_open_trial() -> None:
+    breaker = _breaker(open_seconds=0.0)
+    for _ in range(2):
+        breaker.acquire()
+        breaker.release(failed=True)
+    assert breaker.state == BreakerState.OPEN
+
+    # one trial request at a time once the breaker has been open long enough
+    assert breaker.acquire() is None
+    assert breaker.state == BreakerState.HALF_OPEN
+    assert breaker.acquire() is not None
+    breaker.release(failed=True)
+    assert breaker.state == BreakerState.OPEN
+
+    time.sleep(0.001)
+    assert breaker.acquire() is None
+    breaker.release(failed=None)
+    assert breaker.state == BreakerState.HALF_OPEN
+    assert breaker.acquire() is None
+    breaker.release(failed=False)
+    assert breaker.state == BreakerState.CLOSED
+    assert breaker.stats().requests == 0
+
+
+async def test_deliver_parks_when_breaker_open(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    breakers = DeliveryBreakers()
+    post = mock.AsyncMock(side_effect=httpx.ConnectError("refused"))
+    monkeypatch.setattr("modalci.server.workers.delivery_breakers", breakers)
+    monkeypatch.setattr("modalci.server.workers.delivery_client.post", post)
+    subscription = Subscription(
+        name="default",
+        delivery_type="push",
+        push_endpoint="https://example.com/default",
+    )
+    body = DeliveryBody.from_data(data=b"{}", content_type="application/json")
+    worker = DeliveryWorker(wakeup=mock.Mock())
+    for _ in range(10):
+        result = await worker.deliver(subscription=subscription, body=body)
+        assert result.failed and result.parked_until is None
+
+    result = await worker.deliver(subscription=subscription, body=body)
+    assert result.parked_until is not None
+    assert post.call_count == 10
+    stats = breakers.stats().hosts["example.com"]
+    assert stats.state == BreakerState.OPEN
+    assert stats.parked == 1
+
+
+async def test_get_delivery_breakers(client: AsyncClient) -> None:
+    response = await client.get("/delivery/breakers")
+    assert response.status_code == 200
+    assert isinstance(response.json()["hosts"], dict)
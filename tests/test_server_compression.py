@@ -0,0 +1,64 @@
+import gzip
+
+import pytest
+import zstandard
+
+from modalci._types import ContentEncoding
+from modalci.server.compression import (
+    DecompressedTooLarge,
+    DecompressionError,
+    UnsupportedEncoding,
+    compress,
+    compress_for_storage,
+    decompress,
+)
+from settings import env
+
+
+@pytest.mark.parametrize("encoding", [ContentEncoding.GZIP, ContentEncoding.ZSTD])
+def test_compress_round_trips(encoding: ContentEncoding) -> None:
+    data = b'{"message": "Hello world!"}' * 100
+    compressed = compress(data, encoding)
+    assert len(compressed) < len(data)
+    assert decompress(compressed, encoding.value, max_bytes=len(data)) == data
+
+
+@pytest.mark.parametrize(
+    "compressed,encoding",
+    [
+        (gzip.compress(b"\x00" * 10_000_000), "gzip"),
+        (zstandard.ZstdCompressor().compress(b"\x00" * 10_000_000), "zstd"),
+    ],
+)
+def test_decompress_stops_at_max_bytes(compressed: bytes, encoding: str) -> None:
+    with pytest.raises(DecompressedTooLarge):
+        decompress(compressed, encoding, max_bytes=1000)
+
+
+def test_decompress_invalid_data_fails() -> None:
+    with pytest.raises(DecompressionError):
+        decompress(b"not gzip", "gzip", max_bytes=1000)
+    with pytest.raises(DecompressionError):
+        decompress(gzip.compress(b"x" * 1000)[:-10], "gzip", max_bytes=1000)
+    with pytest.raises(DecompressionError):
+        decompress(b"not zstd", "zstd", max_bytes=1000)
+    with pytest.raises(UnsupportedEncoding):
+        decompress(b"", "br", max_bytes=1000)
+    assert decompress(b"data", None, max_bytes=1) == b"data"
+
+
+def test_compress_for_storage_only_compresses_when_worth_it(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(env, "MESSAGE_COMPRESSION", "gzip")
+    monkeypatch.setattr(env, "MESSAGE_COMPRESSION_MIN_BYTES", 100)
+    data = b'{"a": 1}' * 100
+    compressed, encoding = compress_for_storage(data)
+    assert encoding == "gzip"
+    assert gzip.decompress(compressed) == data
+    # small and incompressible data is stored as is
+    assert compress_for_storage(b'{"a": 1}') == (b'{"a": 1}', None)
+    random = bytes(range(256)) * 1
+    assert compress_for_storage(random) == (random, None)
+    monkeypatch.setattr(env, "MESSAGE_COMPRESSION", "identity")
+    assert compress_for_storage(data) == (data, None)
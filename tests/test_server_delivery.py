@@ -0,0 +1,57 @@
+import httpx
+from httpx import AsyncClient
+
+from modalci.server.delivery import DeliveryClient
+
+
+async def test_get_delivery_stats(client: AsyncClient) -> None:
+    response = await client.get("/delivery/stats")
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["requests"] >= 0
+    assert stats["errors"] >= 0
+    assert isinstance(stats["in_flight"], dict)
+
+
+async def test_delivery_client_reuses_pooled_client() -> None:
+    delivery_client = DeliveryClient()
+    await delivery_client.start()
+    client = delivery_client.client
+    assert delivery_client.client is client
+    stats = delivery_client.stats()
+    assert stats.connections == 0
+    assert stats.idle_connections == 0
+    await delivery_client.close()
+    assert delivery_client._client is None
+    assert delivery_client.client is not client
+    await delivery_client.close()
+
+
+async def test_delivery_client_post_tracks_requests_and_errors() -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/fail":
+            raise httpx.ConnectError("boom", request=request)
+        assert request.content == b'"hello"'
+        return httpx.Response(status_code=204)
+
+    delivery_client = DeliveryClient()
+    delivery_client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    response = await delivery_client.post(
+        "https://example.com/ok",
+        content=b'"hello"',
+        headers={"Content-Type": "application/json"},
+    )
+    assert response.status_code == 204
+    try:
+        await delivery_client.post(
+            "https://example.com/fail",
+            content=b'"hello"',
+            headers={"Content-Type": "application/json"},
+        )
+    except httpx.ConnectError:
+        pass
+    stats = delivery_client.stats()
+    assert stats.requests == 2
+    assert stats.errors == 1
+    assert stats.in_flight == {}
+    await delivery_client.close()
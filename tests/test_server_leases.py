@@ -0,0 +1,97 @@
+import base64
+from unittest import mock
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import text
+
+from modalci.db import async_session
+from modalci.server.leases import PartitionLeases
+from modalci.server.workers import DeliveryWorker
+from settings import env
+
+
+async def test_partition_leases_rebalance() -> None:
+    first, second = PartitionLeases(), PartitionLeases()
+    try:
+        assert await first.rebalance() == set(range(env.TOPIC_PARTITIONS))
+        # the first process holds every partition until it sees the second one
+        assert await second.rebalance() == set()
+        assert len(await first.rebalance()) == env.TOPIC_PARTITIONS // 2
+        assert len(await second.rebalance()) == env.TOPIC_PARTITIONS // 2
+        assert first.owned | second.owned == set(range(env.TOPIC_PARTITIONS))
+        assert second.stats().workers == 2
+
+        await second.stop()
+        assert second.owned == set()
+        assert await first.rebalance() == set(range(env.TOPIC_PARTITIONS))
+    finally:
+        await first.stop()
+        await second.stop()
+
+
+async def test_partition_leases_released_on_error() -> None:
+    first, second = PartitionLeases(), PartitionLeases()
+    try:
+        assert await first.rebalance() == set(range(env.TOPIC_PARTITIONS))
+        assert await second.rebalance() == set()
+        # releasing the partitions over its share fails
+        with mock.patch.object(first, "_lock", side_effect=RuntimeError("boom")):
+            with pytest.raises(RuntimeError):
+                await first.rebalance()
+        assert first.owned == set()
+        # the failed process's connection is closed, not pooled with its locks
+        assert len(await second.rebalance()) == env.TOPIC_PARTITIONS // 2
+    finally:
+        await first.stop()
+        await second.stop()
+
+
+async def test_worker_only_claims_leased_partitions(client: AsyncClient) -> None:
+    response = await client.post("/namespaces", json={"name": "default"})
+    namespace_id = response.json()["id"]
+    response = await client.post(
+        f"/namespaces/{namespace_id}/topics",
+        json={"name": "default", "namespace_id": namespace_id},
+    )
+    topic_path = f"/namespaces/{namespace_id}/topics/{response.json()['id']}"
+    response = await client.post(
+        f"{topic_path}/subscriptions",
+        json={
+            "name": "default",
+            "topic_id": response.json()["id"],
+            "delivery_type": "push",
+            "push_endpoint": "https://example.com",
+        },
+    )
+    assert response.status_code == 200
+    response = await client.post(
+        f"{topic_path}/publish",
+        json={"data": base64.b64encode(b"{}").decode(), "ordering_key": "a"},
+    )
+    assert response.status_code == 202
+
+    leases = PartitionLeases()
+    worker = DeliveryWorker(wakeup=None, leases=leases)  # type: ignore
+    async with async_session() as psql:
+        assert await worker.claim(psql=psql) == []
+        # messages with the same ordering key always land in the same partition
+        leases.owned = set(range(env.TOPIC_PARTITIONS))
+        (delivery,) = await worker.claim(psql=psql)
+        partition = delivery.partition_hash % env.TOPIC_PARTITIONS
+        leases.owned = set(range(env.TOPIC_PARTITIONS)) - {partition}
+        await psql.execute(
+            text(
+                "UPDATE deliveries "
+                "SET next_attempt_at = next_attempt_at - interval '1 hour'"
+            )
+        )
+        assert await worker.claim(psql=psql) == []
+        leases.owned = {partition}
+        assert len(await worker.claim(psql=psql)) == 1
+
+
+async def test_get_delivery_partitions(client: AsyncClient) -> None:
+    response = await client.get("/delivery/partitions")
+    assert response.status_code == 200
+    assert isinstance(response.json()["partitions"], list)
@@ -0,0 +1,155 @@
+import asyncio
+import time
+from unittest import mock
+
+import pytest
+from httpx import AsyncClient
+
+from modalci.models import Subscription
+from modalci.server.limits import DeliveryLimiter, TokenBucket
+from modalci.server.workers import DeliveryBody, DeliveryWorker
+from settings import env
+
+
+def _subscription(**kwargs: object) -> Subscription:
+    return Subscription(
+        name="default",
+        delivery_type="push",
+        push_endpoint="https://example.com/default",
+        **kwargs,
+    )
+
+
+def test_token_bucket_queues_reservations() -> None:
+    bucket = TokenBucket(rate=10.0, capacity=2.0)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+async def test_token_bucket_acquire_waits() -> None:
+    bucket = TokenBucket(rate=100.0, capacity=1.0)
+    await bucket.acquire()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    await bucket.acquire()
+    assert loop.time() - start >= 0.005
+
+
+async def test_limiter_caps_subscription_in_flight() -> None:
+    limiter = DeliveryLimiter()
+    subscription = _subscription(max_in_flight=2, max_messages_per_second=1000.0)
+    in_flight = 0
+    peak = 0
+
+    async def _deliver() -> None:
+        nonlocal in_flight, peak
+        async with limiter.acquire(subscription=subscription):
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+    await asyncio.gather(*[_deliver() for _ in range(6)])
+    assert peak == 2
+
+    stats = limiter.stats().queues
+    queue = stats[f"subscription:{subscription.id}"]
+    assert queue.waits == 6
+    assert queue.waiting == 0
+    assert queue.in_flight == 0
+    assert queue.max_wait_seconds > 0
+    assert stats["host:example.com"].waits == 6
+
+
+async def test_limiter_releases_cancelled_waiters() -> None:
+    limiter = DeliveryLimiter()
+    subscription = _subscription(max_in_flight=1)
+
+    async def _hold() -> None:
+        async with limiter.acquire(subscription=subscription):
+            await asyncio.sleep(1)
+
+    holder = asyncio.create_task(_hold())
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(_hold())
+    await asyncio.sleep(0)
+    assert limiter.stats().queues[f"subscription:{subscription.id}"].waiting == 1
+    waiter.cancel()
+    holder.cancel()
+    await asyncio.gather(holder, waiter, return_exceptions=True)
+    queue = limiter.stats().queues[f"subscription:{subscription.id}"]
+    assert queue.waiting == 0
+    assert queue.in_flight == 0
+
+
+async def test_limiter_acquire_times_out() -> None:
+    limiter = DeliveryLimiter()
+    subscription = _subscription(max_in_flight=1, max_messages_per_second=1.0)
+    async with limiter.acquire(subscription=subscription, timeout=0.0):
+        with pytest.raises(asyncio.TimeoutError):
+            async with limiter.acquire(subscription=subscription, timeout=0.01):
+                pass  # pragma: no cover
+    # the token bucket's reservation was handed back, the semaphore wasn't taken
+    queue = limiter.stats().queues[f"subscription:{subscription.id}"]
+    assert queue.waiting == 0
+    assert queue.in_flight == 0
+    with pytest.raises(asyncio.TimeoutError):
+        async with limiter.acquire(subscription=subscription, timeout=0.5):
+            pass  # pragma: no cover
+
+    subscription.max_messages_per_second = None
+    async with limiter.acquire(subscription=subscription, timeout=0.0):
+        with pytest.raises(asyncio.TimeoutError):
+            async with limiter.acquire(subscription=subscription, timeout=0.01):
+                pass  # pragma: no cover
+    async with limiter.acquire(subscription=subscription, timeout=0.0):
+        pass
+
+
+async def test_limiter_drops_least_recently_used_idle_queues(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(env, "DELIVERY_LIMITER_MAX_QUEUES", 3)
+    limiter = DeliveryLimiter()
+    busy, idle, other = (_subscription(max_in_flight=1) for _ in range(3))
+    async with limiter.acquire(subscription=busy):
+        async with limiter.acquire(subscription=idle):
+            pass
+        async with limiter.acquire(subscription=other):
+            pass
+        queues = limiter.stats().queues
+        assert f"subscription:{busy.id}" in queues
+        assert f"subscription:{idle.id}" not in queues
+        assert set(queues) == {
+            f"subscription:{busy.id}",
+            f"subscription:{other.id}",
+            "host:example.com",
+        }
+
+
+async def test_deliver_parks_when_lease_would_lapse(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    limiter = DeliveryLimiter()
+    post = mock.AsyncMock()
+    monkeypatch.setattr("modalci.server.workers.delivery_limiter", limiter)
+    monkeypatch.setattr("modalci.server.workers.delivery_client.post", post)
+    subscription = _subscription(max_in_flight=1)
+    body = DeliveryBody.from_data(data=b"{}", content_type="application/json")
+    worker = DeliveryWorker(wakeup=mock.Mock())
+    async with limiter.acquire(subscription=subscription):
+        result = await worker.deliver(
+            subscription=subscription,
+            body=body,
+            leased_until=time.monotonic() + env.DELIVERY_READ_TIMEOUT_SECONDS,
+        )
+    assert result.parked_until is not None
+    assert not post.called
+
+
+async def test_get_delivery_limits(client: AsyncClient) -> None:
+    response = await client.get("/delivery/limits")
+    assert response.status_code == 200
+    assert isinstance(response.json()["queues"], dict)
@@ -0,0 +1,73 @@
+import json
+import os
+
+import pytest
+from httpx import AsyncClient
+
+from modalci.server.metrics import MetricsRegistry
+from settings import env
+
+
+async def test_metrics(client: AsyncClient) -> None:
+    response = await client.get("/healthcheck")
+    assert response.status_code == 200
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE modalci_http_request_duration_seconds histogram" in response.text
+    assert (
+        "modalci_http_request_duration_seconds_count"
+        '{method="GET",route="/healthcheck",status_code="200"}'
+    ) in response.text
+
+
+def test_metrics_registry_renders_prometheus_text() -> None:
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "Requests.", ["path"])
+    gauge = registry.gauge("in_flight", "In flight.")
+    histogram = registry.histogram(
+        "latency_seconds", "Latency.", ["path"], buckets=[0.1, 1.0]
+    )
+    counter.inc(path='/a"b')
+    counter.inc(2, path='/a"b')
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    for value in [0.05, 0.1, 0.5, 5.0]:
+        histogram.observe(value, path="/a")
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{path="/a\\"b"} 3.0',
+        "# HELP in_flight In flight.",
+        "# TYPE in_flight gauge",
+        "in_flight 1.0",
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{path="/a",le="0.1"} 2.0',
+        'latency_seconds_bucket{path="/a",le="1.0"} 3.0',
+        'latency_seconds_bucket{path="/a",le="+Inf"} 4.0',
+        'latency_seconds_sum{path="/a"} 5.65',
+        'latency_seconds_count{path="/a"} 4.0',
+    ]
+
+
+def test_metrics_registry_sums_processes(
+    tmp_path: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(env, "METRICS_DIR", str(tmp_path))
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "Requests.")
+    gauge = registry.gauge("in_flight", "In flight.")
+    counter.inc()
+    gauge.inc()
+    registry.write_snapshot()
+    assert os.path.exists(os.path.join(tmp_path, f"{os.getpid()}.json"))
+    # another live process and one that has exited
+    snapshot = {"requests_total": [[[], 2.0]], "in_flight": [[[], 3.0]]}
+    for pid in [os.getppid(), 2**22 + 1]:
+        with open(os.path.join(tmp_path, f"{pid}.json"), "w") as f:
+            json.dump(snapshot, f)
+    rendered = registry.render()
+    assert "requests_total 5.0" in rendered
+    assert "in_flight 4.0" in rendered
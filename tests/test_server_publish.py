@@ -1,11 +1,35 @@
+import asyncio
 import base64
+import gzip
 import json
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional
+from unittest import mock
 from uuid import uuid4
 
+import httpx
+import pytest
+import zstandard
+from fastapi import FastAPI, Request, Response
 from httpx import AsyncClient
+from pydantic import ValidationError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from modalci._types import DeliveryStatus, Message
+from modalci.models import Delivery, TopicMessage
+from modalci.server.delivery import delivery_client
+from modalci.server.group_commit import GroupCommit
+from modalci.server.idempotency import IdempotencyCache, published_messages
+from modalci.server.services import topics_service
+from modalci.server.utils import MaxBodySizeMiddleware, RequestDecompressionMiddleware
+from modalci.server.workers import DeliveryWorker
+from settings import env
 
-async def test_publish_message_push(client: AsyncClient) -> None:
+
+async def test_publish_message_push(
+    client: AsyncClient, async_db_session: AsyncSession
+) -> None:
     response = await client.post("/namespaces", json={"name": "default"})
     assert response.status_code == 200
     namespace = response.json()
@@ -44,7 +68,27 @@ async def test_publish_message_push(client: AsyncClient) -> None:
         f"/namespaces/{namespace['id']}/topics/{topic['id']}/publish",
         json={"data": data},
     )
-    assert response.status_code == 200
+    assert response.status_code == 202
+    message_id = response.json()["message_id"]
+
+    async with async_db_session as session:
+        message = (
+            await session.execute(
+                select(TopicMessage).where(TopicMessage.id == message_id)
+            )
+        ).scalar_one()
+        assert json.loads(message.data) == {"message": "Hello world!"}
+        deliveries = (
+            (
+                await session.execute(
+                    select(Delivery).where(Delivery.message_id == message_id)
+                )
+            )
+            .scalars()
+            .all()
+        )
+        assert len(deliveries) == 2
+        assert all(d.status == DeliveryStatus.PENDING for d in deliveries)
 
 
 async def test_publish_message_missing_namespace_fails(
@@ -81,7 +125,7 @@ async def test_publish_message_too_big_fails(client: AsyncClient) -> None:
     response = await client.post(
         f"/namespaces/{namespace['id']}/topics/{topic['id']}/publish",
         json={
-            "data": base64.b64encode(("A" * 10_000_000).encode("utf8")).decode("utf8")
+            "data": base64.b64encode(("A" * 10_000_001).encode("utf8")).decode("utf8")
         },
     )
     assert response.status_code == 422
@@ -89,13 +133,24 @@ async def test_publish_message_too_big_fails(client: AsyncClient) -> None:
         "detail": [
             {
                 "loc": ["body", "data"],
-                "msg": "Message data must be less than or equal to 10MB.",
+                "msg": "Message data must be less than or equal to 10000000 bytes.",
                 "type": "value_error",
             }
         ]
     }
 
 
+def test_message_max_bytes_applies_to_decoded_data(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(env, "MESSAGE_MAX_BYTES", 6)
+    # eight base64 characters decode to six bytes
+    message = Message(data=base64.b64encode(b'"1234"').decode())
+    assert message.decoded() == b'"1234"'
+    with pytest.raises(ValidationError, match="less than or equal to 6 bytes"):
+        Message(data=base64.b64encode(b'"12345"').decode())
+
+
 async def test_publish_message_invalid_b64_fails(client: AsyncClient) -> None:
     response = await client.post("/namespaces", json={"name": "default"})
     assert response.status_code == 200
@@ -120,3 +175,546 @@ async def test_publish_message_invalid_b64_fails(client: AsyncClient) -> None:
             }
         ]
     }
+
+
+async def test_publish_batch_to_several_topics(
+    client: AsyncClient, async_db_session: AsyncSession
+) -> None:
+    response = await client.post("/namespaces", json={"name": "default"})
+    assert response.status_code == 200
+    namespace = response.json()
+    topics = []
+    for name in ["first", "second"]:
+        response = await client.post(
+            f"/namespaces/{namespace['id']}/topics",
+            json={"name": name, "namespace_id": namespace["id"]},
+        )
+        assert response.status_code == 200
+        topic = response.json()
+        topics.append(topic)
+        response = await client.post(
+            f"/namespaces/{namespace['id']}/topics/{topic['id']}/subscriptions",
+            json={
+                "name": "default",
+                "topic_id": topic["id"],
+                "delivery_type": "push",
+                "push_endpoint": f"https://example.com/{name}",
+            },
+        )
+        assert response.status_code == 200
+
+    data = base64.b64encode(json.dumps({"n": 1}).encode("utf-8")).decode("utf-8")
+    response = await client.post(
+        f"/namespaces/{namespace['id']}/topics/{topics[0]['id']}/publish/batch",
+        json={
+            "messages": [
+                {"data": data},
+                {"data": data, "topic_id": topics[1]["id"]},
+                {"data": data, "topic_id": str(uuid4())},
+                {"data": data},
+            ]
+        },
+    )
+    assert response.status_code == 202
+    results = response.json()["results"]
+    assert [r["status"] for r in results] == [
+        "accepted",
+        "accepted",
+        "topic_not_found",
+        "accepted",
+    ]
+    assert results[2]["message_id"] is None
+    assert len({r["message_id"] for r in results}) == 4
+
+    async with async_db_session as session:
+        messages = (await session.execute(select(TopicMessage))).scalars().all()
+        assert len(messages) == 3
+        deliveries = (await session.execute(select(Delivery))).scalars().all()
+        assert len(deliveries) == 3
+
+
+async def test_publish_batch_missing_namespace_fails(client: AsyncClient) -> None:
+    response = await client.post(
+        f"/namespaces/{uuid4()}/topics/{uuid4()}/publish/batch",
+        json={"messages": [{"data": "eyJtc2ciOiJoZWxsbyB3b3JsZCEifQo="}]},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Namespace not found."
+
+
+async def test_publish_batch_unknown_topics_are_not_persisted(
+    client: AsyncClient,
+) -> None:
+    response = await client.post("/namespaces", json={"name": "default"})
+    assert response.status_code == 200
+    namespace = response.json()
+    response = await client.post(
+        f"/namespaces/{namespace['id']}/topics/{uuid4()}/publish/batch",
+        json={"messages": [{"data": "eyJtc2ciOiJoZWxsbyB3b3JsZCEifQo="}]},
+    )
+    assert response.status_code == 202
+    assert response.json() == {
+        "results": [{"status": "topic_not_found", "message_id": None}]
+    }
+
+
+async def test_publish_batch_size_is_limited(
+    client: AsyncClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(env, "PUBLISH_BATCH_MAX_MESSAGES", 1)
+    response = await client.post(
+        f"/namespaces/{uuid4()}/topics/{uuid4()}/publish/batch",
+        json={"messages": [{"data": "eyJtc2ciOiJoZWxsbyB3b3JsZCEifQo="}] * 2},
+    )
+    assert response.status_code == 422
+    response = await client.post(
+        f"/namespaces/{uuid4()}/topics/{uuid4()}/publish/batch",
+        json={"messages": []},
+    )
+    assert response.status_code == 422
+
+
+async def test_publish_raw_message_is_stored_and_delivered_as_is(
+    client: AsyncClient,
+    async_db_session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    posted = []
+
+    async def _post(url: str, content: bytes, headers: Dict) -> httpx.Response:
+        posted.append((content, headers["Content-Type"]))
+        return httpx.Response(status_code=200)
+
+    monkeypatch.setattr(delivery_client, "post", _post)
+    response = await client.post("/namespaces", json={"name": "default"})
+    namespace = response.json()
+    response = await client.post(
+        f"/namespaces/{namespace['id']}/topics",
+        json={"name": "default", "namespace_id": namespace["id"]},
+    )
+    topic = response.json()
+    response = await client.post(
+        f"/namespaces/{namespace['id']}/topics/{topic['id']}/subscriptions",
+        json={
+            "name": "default",
+            "topic_id": topic["id"],
+            "delivery_type": "push",
+            "push_endpoint": "https://example.com/default",
+        },
+    )
+    assert response.status_code == 200
+
+    for content, content_type in [
+        (b'{"message": "Hello world!"}', "application/json"),
+        (b"\x00\x01\x02", "application/octet-stream"),
+    ]:
+        response = await client.post(
+            f"/namespaces/{namespace['id']}/topics/{topic['id']}/publish/raw",
+            content=content,
+            headers={"Content-Type": content_type},
+        )
+        assert response.status_code == 202
+        async with async_db_session as session:
+            message = (
+                await session.execute(
+                    select(TopicMessage).where(
+                        TopicMessage.id == response.json()["message_id"]
+                    )
+                )
+            ).scalar_one()
+            assert message.data == content
+            assert message.content_type == content_type
+
+    assert await DeliveryWorker(wakeup=asyncio.Event()).run_once() == 2
+    assert sorted(posted) == [
+        (b"\x00\x01\x02", "application/octet-stream"),
+        (b'{"message": "Hello world!"}', "application/json"),
+    ]
+
+
+async def test_publish_raw_message_invalid_body_fails(
+    client: AsyncClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    path = f"/namespaces/{uuid4()}/topics/{uuid4()}/publish/raw"
+    response = await client.post(
+        path, content=b"hello", headers={"Content-Type": "text/plain"}
+    )
+    assert response.status_code == 415
+
+    response = await client.post(
+        path, content=b"{", headers={"Content-Type": "application/json"}
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Message data is not JSON."
+
+    monkeypatch.setattr(env, "MESSAGE_MAX_BYTES", 2)
+    response = await client.post(
+        path, content=b"123", headers={"Content-Type": "application/octet-stream"}
+    )
+    assert response.status_code == 413
+
+    response = await client.post(
+        path, content=b"12", headers={"Content-Type": "application/octet-stream"}
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Namespace not found."
+
+
+async def test_max_body_size_middleware_rejects_large_bodies() -> None:
+    app = FastAPI()
+    app.add_middleware(MaxBodySizeMiddleware, max_body_bytes=4)
+
+    @app.post("/echo")
+    async def _echo(request: Request) -> Response:
+        return Response(content=await request.body())
+
+    async def _chunks(size: int) -> AsyncIterator[bytes]:
+        for _ in range(size):
+            yield b"x"
+
+    async with AsyncClient(app=app, base_url="http://testserver") as client:
+        response = await client.post("/echo", content=b"1234")
+        assert response.status_code == 200
+        response = await client.post("/echo", content=b"12345")
+        assert response.status_code == 413
+        # without a Content-Length the body is counted as it streams in
+        response = await client.post("/echo", content=_chunks(4))
+        assert response.status_code == 200
+        response = await client.post("/echo", content=_chunks(5))
+        assert response.status_code == 413
+
+
+async def test_request_decompression_middleware() -> None:
+    app = FastAPI()
+    app.add_middleware(RequestDecompressionMiddleware, max_body_bytes=1000)
+    app.add_middleware(MaxBodySizeMiddleware, max_body_bytes=100)
+
+    @app.post("/echo")
+    async def _echo(request: Request) -> Response:
+        return Response(content=await request.body())
+
+    async with AsyncClient(app=app, base_url="http://testserver") as client:
+        for encoding, compressed in [
+            ("gzip", gzip.compress(b"x" * 1000)),
+            ("zstd", zstandard.ZstdCompressor().compress(b"x" * 1000)),
+        ]:
+            response = await client.post(
+                "/echo", content=compressed, headers={"Content-Encoding": encoding}
+            )
+            assert response.status_code == 200
+            assert response.content == b"x" * 1000
+        response = await client.post(
+            "/echo",
+            content=gzip.compress(b"x" * 1001),
+            headers={"Content-Encoding": "gzip"},
+        )
+        assert response.status_code == 413
+        response = await client.post(
+            "/echo", content=b"not gzip", headers={"Content-Encoding": "gzip"}
+        )
+        assert response.status_code == 400
+        response = await client.post(
+            "/echo", content=b"12", headers={"Content-Encoding": "br"}
+        )
+        assert response.status_code == 415
+        # the compressed body itself is still limited
+        response = await client.post(
+            "/echo", content=bytes(range(256)), headers={"Content-Encoding": "gzip"}
+        )
+        assert response.status_code == 413
+
+
+def test_message_keeps_decoded_data() -> None:
+    message = Message(data=base64.b64encode(b'{"msg": "hello"}').decode())
+    assert message.decoded() == b'{"msg": "hello"}'
+    assert Message.construct(data=message.data[:]).decoded() == b'{"msg": "hello"}'
+
+
+async def test_publish_with_idempotency_key_is_delivered_once(
+    client: AsyncClient,
+    async_db_session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    response = await client.post("/namespaces", json={"name": "default"})
+    assert response.status_code == 200
+    namespace = response.json()
+    response = await client.post(
+        f"/namespaces/{namespace['id']}/topics",
+        json={"name": "default", "namespace_id": namespace["id"]},
+    )
+    assert response.status_code == 200
+    topic = response.json()
+    response = await client.post(
+        f"/namespaces/{namespace['id']}/topics/{topic['id']}/subscriptions",
+        json={
+            "name": "default",
+            "topic_id": topic["id"],
+            "delivery_type": "push",
+            "push_endpoint": "https://example.com/default",
+        },
+    )
+    assert response.status_code == 200
+
+    url = f"/namespaces/{namespace['id']}/topics/{topic['id']}/publish"
+    data = base64.b64encode(json.dumps({"n": 1}).encode("utf-8")).decode("utf-8")
+    response = await client.post(url, json={"data": data, "idempotency_key": "a"})
+    assert response.status_code == 202
+    message_id = response.json()["message_id"]
+    response = await client.post(url, json={"data": data, "idempotency_key": "a"})
+    assert response.status_code == 202
+    assert response.json()["message_id"] == message_id
+
+    # without the cache, the unique index catches the duplicate
+    monkeypatch.setattr(published_messages, "_message_ids", OrderedDict())
+    response = await client.post(
+        f"{url}/batch",
+        json={
+            "messages": [
+                {"data": data, "idempotency_key": "a"},
+                {"data": data, "idempotency_key": "b"},
+                {"data": data, "idempotency_key": "b"},
+            ]
+        },
+    )
+    assert response.status_code == 202
+    results = response.json()["results"]
+    assert results[0]["message_id"] == message_id
+    assert results[1]["message_id"] != message_id
+    assert results[2]["message_id"] == results[1]["message_id"]
+    response = await client.post(
+        f"{url}/raw",
+        content=b'{"n": 1}',
+        headers={"Content-Type": "application/json", "Idempotency-Key": "b"},
+    )
+    assert response.status_code == 202
+    assert response.json()["message_id"] == results[1]["message_id"]
+
+    async with async_db_session as session:
+        messages = (await session.execute(select(TopicMessage))).scalars().all()
+        assert {m.idempotency_key for m in messages} == {"a", "b"}
+        deliveries = (await session.execute(select(Delivery))).scalars().all()
+        assert len(deliveries) == 2
+
+
+def test_idempotency_cache_expires_and_evicts(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = 0.0
+    monkeypatch.setattr("modalci.server.idempotency.time.monotonic", lambda: now)
+    cache = IdempotencyCache(max_keys=2, ttl_seconds=10)
+    topic_id = uuid4()
+    message_ids = [uuid4() for _ in range(3)]
+    cache.put((topic_id, "a"), message_ids[0])
+    cache.put((topic_id, "b"), message_ids[1])
+    assert cache.get((topic_id, "a")) == message_ids[0]
+    # "b" is the least recently used key
+    cache.put((topic_id, "c"), message_ids[2])
+    assert cache.get((topic_id, "b")) is None
+    assert cache.get((topic_id, "a")) == message_ids[0]
+    assert cache.get((uuid4(), "a")) is None
+    now = 10.0
+    assert cache.get((topic_id, "a")) is None
+    assert cache.get((topic_id, "c")) is None
+
+
+async def test_group_commit_writes_concurrent_submits_together() -> None:
+    writes: List[List[int]] = []
+
+    async def _write(items: List[int]) -> None:
+        writes.append(items)
+        if -1 in items:
+            raise ValueError("bad item")
+
+    group_commit = GroupCommit(write=_write, max_items=4, max_delay_seconds=10)
+    await asyncio.wait_for(
+        asyncio.gather(group_commit.submit([1]), group_commit.submit([2, 3, 4])),
+        timeout=1,
+    )
+    assert writes == [[1, 2, 3, 4]]
+
+    # a failed shared write is retried per submit, so only the bad one fails
+    writes.clear()
+    group_commit.max_delay_seconds = 0.01
+    results = await asyncio.gather(
+        group_commit.submit([1]),
+        group_commit.submit([-1]),
+        return_exceptions=True,
+    )
+    assert results[0] is None
+    assert isinstance(results[1], ValueError)
+    assert writes == [[1, -1], [1], [-1]]
+
+
+async def test_concurrent_publishes_share_a_commit(
+    client: AsyncClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    response = await client.post("/namespaces", json={"name": "default"})
+    namespace = response.json()
+    response = await client.post(
+        f"/namespaces/{namespace['id']}/topics",
+        json={"name": "default", "namespace_id": namespace["id"]},
+    )
+    url = f"/namespaces/{namespace['id']}/topics/{response.json()['id']}/publish"
+    write = mock.AsyncMock(wraps=topics_service._write)
+    monkeypatch.setattr(topics_service.group_commit, "write", write)
+    monkeypatch.setattr(topics_service.group_commit, "max_delay_seconds", 1.0)
+    monkeypatch.setattr(topics_service.group_commit, "max_items", 3)
+    data = base64.b64encode(b"{}").decode()
+    responses = await asyncio.gather(
+        *(client.post(url, json={"data": data}) for _ in range(3))
+    )
+    assert [r.status_code for r in responses] == [202] * 3
+    assert write.await_count == 1
+    assert len(write.await_args_list[0].args[0]) == 3
+
+
+async def test_more_concurrent_publishes_than_connections(
+    client: AsyncClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    response = await client.post("/namespaces", json={"name": "default"})
+    namespace = response.json()
+    response = await client.post(
+        f"/namespaces/{namespace['id']}/topics",
+        json={"name": "default", "namespace_id": namespace["id"]},
+    )
+    url = f"/namespaces/{namespace['id']}/topics/{response.json()['id']}/publish"
+    # every publish waits for the flush, which needs a connection of its own
+    publishes = env.PSQL_POOL_SIZE + env.PSQL_MAX_OVERFLOW + 5
+    monkeypatch.setattr(topics_service.group_commit, "max_delay_seconds", 1.0)
+    monkeypatch.setattr(topics_service.group_commit, "max_items", publishes)
+    data = base64.b64encode(b"{}").decode()
+
+    async def _publish(i: int) -> httpx.Response:
+        if i % 3 == 0:
+            return await client.post(url, json={"data": data})
+        if i % 3 == 1:
+            return await client.post(
+                f"{url}/raw",
+                content=b"{}",
+                headers={"Content-Type": "application/json"},
+            )
+        return await client.post(f"{url}/batch", json={"messages": [{"data": data}]})
+
+    responses = await asyncio.wait_for(
+        asyncio.gather(*(_publish(i) for i in range(publishes))), timeout=20
+    )
+    assert [r.status_code for r in responses] == [202] * publishes
+
+
+async def test_publish_only_delivers_to_matching_filters(
+    client: AsyncClient, async_db_session: AsyncSession
+) -> None:
+    response = await client.post("/namespaces", json={"name": "default"})
+    assert response.status_code == 200
+    namespace = response.json()
+    response = await client.post(
+        f"/namespaces/{namespace['id']}/topics",
+        json={"name": "default", "namespace_id": namespace["id"]},
+    )
+    assert response.status_code == 200
+    topic = response.json()
+    url = f"/namespaces/{namespace['id']}/topics/{topic['id']}"
+
+    async def _subscribe(name: str, filter: Optional[str]) -> str:
+        response = await client.post(
+            f"{url}/subscriptions",
+            json={
+                "name": name,
+                "topic_id": topic["id"],
+                "delivery_type": "pull",
+                "filter": filter,
+            },
+        )
+        assert response.status_code == 200
+        return response.json()["id"]
+
+    everything = await _subscribe("everything", None)
+    us = await _subscribe("us", 'attributes.region = "us"')
+    data = base64.b64encode(json.dumps({"n": 1}).encode("utf-8")).decode("utf-8")
+    response = await client.post(
+        f"{url}/publish/batch",
+        json={
+            "messages": [
+                {"data": data, "attributes": {"region": "us"}},
+                {"data": data, "attributes": {"region": "eu"}},
+                {"data": data},
+            ]
+        },
+    )
+    assert response.status_code == 202
+    first = [r["message_id"] for r in response.json()["results"]]
+    # the topic's filters are reloaded when a filtered subscription is created
+    kinds = await _subscribe("kinds", 'attributes.kind IN ("a", "b")')
+    response = await client.post(
+        f"{url}/publish",
+        json={"data": data, "attributes": {"region": "us", "kind": "a"}},
+    )
+    assert response.status_code == 202
+    second = response.json()["message_id"]
+
+    async with async_db_session as session:
+        deliveries = (await session.execute(select(Delivery))).scalars().all()
+        delivered: Dict[str, set] = {}
+        for delivery in deliveries:
+            delivered.setdefault(str(delivery.subscription_id), set()).add(
+                str(delivery.message_id)
+            )
+        assert delivered == {
+            everything: {*first, second},
+            us: {first[0], second},
+            kinds: {second},
+        }
+
+    response = await client.post(f"{url}/subscriptions/{us}/pull", json={})
+    assert response.status_code == 200
+    assert [m["attributes"] for m in response.json()["received_messages"]] == [
+        {"region": "us"},
+        {"region": "us", "kind": "a"},
+    ]
+
+
+async def test_publish_fans_out_to_many_filtered_subscriptions(
+    client: AsyncClient, async_db_session: AsyncSession
+) -> None:
+    response = await client.post("/namespaces", json={"name": "default"})
+    namespace = response.json()
+    response = await client.post(
+        f"/namespaces/{namespace['id']}/topics",
+        json={"name": "default", "namespace_id": namespace["id"]},
+    )
+    topic = response.json()
+    url = f"/namespaces/{namespace['id']}/topics/{topic['id']}"
+    # more matched pairs than a query could take as two parameters each
+    subscriptions = 20
+    for i in range(subscriptions):
+        response = await client.post(
+            f"{url}/subscriptions",
+            json={
+                "name": f"us-{i}",
+                "topic_id": topic["id"],
+                "delivery_type": "pull",
+                "filter": 'attributes.region = "us"',
+            },
+        )
+        assert response.status_code == 200
+    data = base64.b64encode(b"{}").decode()
+    response = await client.post(
+        f"{url}/publish/batch",
+        json={
+            "messages": [
+                {"data": data, "attributes": {"region": "us"}}
+                for _ in range(env.PUBLISH_BATCH_MAX_MESSAGES)
+            ]
+        },
+    )
+    assert response.status_code == 202
+    async with async_db_session as session:
+        deliveries = (await session.execute(select(Delivery))).scalars().all()
+    assert len(deliveries) == subscriptions * env.PUBLISH_BATCH_MAX_MESSAGES
+
+
+async def test_publish_message_attributes_are_validated(client: AsyncClient) -> None:
+    data = base64.b64encode(json.dumps({"n": 1}).encode("utf-8")).decode("utf-8")
+    response = await client.post(
+        f"/namespaces/{uuid4()}/topics/{uuid4()}/publish",
+        json={"data": data, "attributes": {"not a key": "x"}},
+    )
+    assert response.status_code == 422
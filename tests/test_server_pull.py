@@ -0,0 +1,384 @@
+import asyncio
+import base64
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from fastapi import WebSocketDisconnect, status
+from httpx import AsyncClient
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from modalci.models import Subscription
+from modalci.server.notify import Notifier
+from modalci.server.streams import SubscriptionStream
+from modalci.server.workers import DeliveryWorker
+
+
+async def _create_subscription(
+    client: AsyncClient, delivery_type: str = "pull", **subscription: Any
+) -> str:
+    response = await client.post("/namespaces", json={"name": "default"})
+    assert response.status_code == 200
+    namespace = response.json()
+    response = await client.post(
+        f"/namespaces/{namespace['id']}/topics",
+        json={"name": "default", "namespace_id": namespace["id"]},
+    )
+    assert response.status_code == 200
+    topic = response.json()
+    response = await client.post(
+        f"/namespaces/{namespace['id']}/topics/{topic['id']}/subscriptions",
+        json={
+            "name": "default",
+            "topic_id": topic["id"],
+            "delivery_type": delivery_type,
+            **subscription,
+        },
+    )
+    assert response.status_code == 200
+    return (
+        f"/namespaces/{namespace['id']}/topics/{topic['id']}"
+        f"/subscriptions/{response.json()['id']}"
+    )
+
+
+async def _publish(client: AsyncClient, subscription_path: str, data: Dict) -> str:
+    topic_path = subscription_path.split("/subscriptions/")[0]
+    response = await client.post(
+        f"{topic_path}/publish",
+        json={"data": base64.b64encode(json.dumps(data).encode("utf-8")).decode()},
+    )
+    assert response.status_code == 202
+    return response.json()["message_id"]
+
+
+async def test_pull_ack_and_modify_ack_deadline(client: AsyncClient) -> None:
+    subscription_path = await _create_subscription(client)
+    message_id = await _publish(client, subscription_path, {"msg": "hello"})
+
+    # push delivery workers leave pull subscriptions alone
+    assert await DeliveryWorker(wakeup=asyncio.Event()).run_once() == 0
+
+    response = await client.post(f"{subscription_path}/pull", json={})
+    assert response.status_code == 200
+    received = response.json()["received_messages"]
+    assert len(received) == 1
+    assert received[0]["message_id"] == message_id
+    assert received[0]["delivery_attempt"] == 1
+    assert json.loads(base64.b64decode(received[0]["data"])) == {"msg": "hello"}
+
+    # the message is leased until its ack deadline
+    response = await client.post(f"{subscription_path}/pull", json={})
+    assert response.json()["received_messages"] == []
+
+    response = await client.post(
+        f"{subscription_path}/modify-ack-deadline",
+        json={"ack_ids": [received[0]["ack_id"]], "ack_deadline_seconds": 0},
+    )
+    assert response.status_code == 200
+    assert response.json() == {"modified": 1}
+
+    response = await client.post(f"{subscription_path}/pull", json={})
+    received = response.json()["received_messages"]
+    assert len(received) == 1
+    assert received[0]["delivery_attempt"] == 2
+
+    response = await client.post(
+        f"{subscription_path}/acknowledge",
+        json={"ack_ids": [received[0]["ack_id"]]},
+    )
+    assert response.status_code == 200
+    assert response.json() == {"acknowledged": 1}
+
+    response = await client.post(
+        f"{subscription_path}/modify-ack-deadline",
+        json={"ack_ids": [received[0]["ack_id"]], "ack_deadline_seconds": 0},
+    )
+    assert response.json() == {"modified": 0}
+    response = await client.post(f"{subscription_path}/pull", json={})
+    assert response.json()["received_messages"] == []
+
+
+async def test_expired_ack_id_leaves_redelivery_alone(client: AsyncClient) -> None:
+    subscription_path = await _create_subscription(client)
+    await _publish(client, subscription_path, {"msg": "hello"})
+
+    response = await client.post(f"{subscription_path}/pull", json={})
+    expired = response.json()["received_messages"][0]["ack_id"]
+    await client.post(
+        f"{subscription_path}/modify-ack-deadline",
+        json={"ack_ids": [expired], "ack_deadline_seconds": 0},
+    )
+    response = await client.post(f"{subscription_path}/pull", json={})
+    received = response.json()["received_messages"]
+    assert len(received) == 1
+    assert received[0]["ack_id"] != expired
+
+    # the first lease can neither extend nor acknowledge the redelivery
+    response = await client.post(
+        f"{subscription_path}/modify-ack-deadline",
+        json={"ack_ids": [expired], "ack_deadline_seconds": 600},
+    )
+    assert response.json() == {"modified": 0}
+    response = await client.post(
+        f"{subscription_path}/acknowledge", json={"ack_ids": [expired]}
+    )
+    assert response.json() == {"acknowledged": 0}
+
+    response = await client.post(
+        f"{subscription_path}/acknowledge",
+        json={"ack_ids": [received[0]["ack_id"]]},
+    )
+    assert response.json() == {"acknowledged": 1}
+
+
+async def test_malformed_ack_id_fails(client: AsyncClient) -> None:
+    subscription_path = await _create_subscription(client)
+    response = await client.post(
+        f"{subscription_path}/acknowledge", json={"ack_ids": [str(uuid4())]}
+    )
+    assert response.status_code == 422
+
+
+async def test_pull_respects_max_messages_and_max_bytes(client: AsyncClient) -> None:
+    subscription_path = await _create_subscription(client)
+    for i in range(3):
+        await _publish(client, subscription_path, {"i": i})
+
+    response = await client.post(f"{subscription_path}/pull", json={"max_messages": 2})
+    assert len(response.json()["received_messages"]) == 2
+
+    # a message larger than max_bytes is still handed out on its own
+    response = await client.post(f"{subscription_path}/pull", json={"max_bytes": 1})
+    assert len(response.json()["received_messages"]) == 1
+
+
+async def test_pull_dead_letters_exhausted_messages(client: AsyncClient) -> None:
+    subscription_path = await _create_subscription(client, max_delivery_attempts=1)
+    await _publish(client, subscription_path, {"msg": "hello"})
+
+    response = await client.post(f"{subscription_path}/pull", json={})
+    received = response.json()["received_messages"]
+    assert len(received) == 1
+    await client.post(
+        f"{subscription_path}/modify-ack-deadline",
+        json={"ack_ids": [received[0]["ack_id"]], "ack_deadline_seconds": 0},
+    )
+
+    response = await client.post(f"{subscription_path}/pull", json={})
+    assert response.json()["received_messages"] == []
+    response = await client.get(f"{subscription_path}/dead-letters")
+    assert len(response.json()) == 1
+
+
+async def test_pull_from_push_subscription_fails(client: AsyncClient) -> None:
+    subscription_path = await _create_subscription(
+        client, delivery_type="push", push_endpoint="https://example.com"
+    )
+    for path, body in [
+        ("pull", {}),
+        ("acknowledge", {"ack_ids": []}),
+        ("modify-ack-deadline", {"ack_ids": [], "ack_deadline_seconds": 0}),
+    ]:
+        response = await client.post(f"{subscription_path}/{path}", json=body)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Subscription is not a pull subscription."
+
+
+async def test_pull_missing_subscription_fails(client: AsyncClient) -> None:
+    response = await client.post(
+        f"/namespaces/{uuid4()}/topics/{uuid4()}/subscriptions/{uuid4()}/pull",
+        json={},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Subscription not found."
+
+
+async def test_seek_replays_messages_in_order(client: AsyncClient) -> None:
+    subscription_path = await _create_subscription(client)
+    first = await _publish(client, subscription_path, {"i": 0})
+    second = await _publish(client, subscription_path, {"i": 1})
+    response = await client.post(f"{subscription_path}/pull", json={})
+    received = response.json()["received_messages"]
+    await client.post(
+        f"{subscription_path}/acknowledge",
+        json={"ack_ids": [m["ack_id"] for m in received]},
+    )
+
+    response = await client.post(
+        f"{subscription_path}/seek", json={"message_id": second}
+    )
+    assert response.status_code == 200
+    assert response.json() == {"replayed": 1, "acknowledged": 0}
+    response = await client.post(f"{subscription_path}/pull", json={})
+    received = response.json()["received_messages"]
+    assert [m["message_id"] for m in received] == [second]
+    assert received[0]["delivery_attempt"] == 1
+
+    # the replay is paced, so only the first message is due right away
+    response = await client.post(
+        f"{subscription_path}/seek",
+        json={"time": "2000-01-01T00:00:00", "max_messages_per_second": 0.1},
+    )
+    assert response.json() == {"replayed": 2, "acknowledged": 0}
+    response = await client.post(f"{subscription_path}/pull", json={})
+    assert [m["message_id"] for m in response.json()["received_messages"]] == [first]
+
+    # seeking to the future acknowledges everything
+    response = await client.post(
+        f"{subscription_path}/seek", json={"time": "2100-01-01T00:00:00"}
+    )
+    assert response.json() == {"replayed": 0, "acknowledged": 2}
+
+
+async def test_seek_fails(client: AsyncClient) -> None:
+    subscription_path = await _create_subscription(client)
+    response = await client.post(f"{subscription_path}/seek", json={})
+    assert response.status_code == 422
+    response = await client.post(
+        f"{subscription_path}/seek", json={"message_id": str(uuid4())}
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Message not found."
+    response = await client.post(
+        f"/namespaces/{uuid4()}/topics/{uuid4()}/subscriptions/{uuid4()}/seek",
+        json={"time": "2000-01-01T00:00:00"},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Subscription not found."
+
+
+async def test_pull_waits_for_published_messages(client: AsyncClient) -> None:
+    subscription_path = await _create_subscription(client)
+    pull = asyncio.create_task(
+        client.post(f"{subscription_path}/pull", json={"wait_seconds": 30})
+    )
+    await asyncio.sleep(0.2)
+    assert not pull.done()
+
+    start = time.monotonic()
+    message_id = await _publish(client, subscription_path, {"msg": "hello"})
+    response = await asyncio.wait_for(pull, timeout=10)
+    assert time.monotonic() - start < 10
+    received = response.json()["received_messages"]
+    assert [m["message_id"] for m in received] == [message_id]
+
+
+async def test_pull_wait_times_out_empty(client: AsyncClient) -> None:
+    subscription_path = await _create_subscription(client)
+    start = time.monotonic()
+    response = await client.post(
+        f"{subscription_path}/pull", json={"wait_seconds": 0.3}
+    )
+    assert response.status_code == 200
+    assert response.json()["received_messages"] == []
+    assert time.monotonic() - start >= 0.3
+
+    response = await client.post(f"{subscription_path}/pull", json={"wait_seconds": 61})
+    assert response.status_code == 422
+
+
+async def test_notifier_wakes_watchers_of_a_topic() -> None:
+    notifier = Notifier()
+    topic_id, other_topic_id = uuid4(), uuid4()
+    with notifier.watch(topic_id) as event, notifier.watch(other_topic_id) as other:
+        notifier.notify(topic_id)
+        assert event.is_set()
+        assert not other.is_set()
+    assert notifier._events == {}
+
+
+class _WebSocket:
+    def __init__(self) -> None:
+        self.received: asyncio.Queue = asyncio.Queue()
+        self.sent: asyncio.Queue = asyncio.Queue()
+        self.closed: Optional[Tuple[int, str]] = None
+
+    async def receive_json(self) -> Any:
+        frame = await self.received.get()
+        if frame is None:
+            raise WebSocketDisconnect()
+        # raw frames are decoded like the socket would
+        if isinstance(frame, str):
+            return json.loads(frame)
+        return frame
+
+    async def send_text(self, data: str) -> None:
+        await self.sent.put(json.loads(data))
+
+    async def close(self, code: int, reason: str) -> None:
+        self.closed = (code, reason)
+
+
+async def _received_messages(websocket: _WebSocket, count: int) -> List[Dict]:
+    received: List[Dict] = []
+    while len(received) < count:
+        frame = await asyncio.wait_for(websocket.sent.get(), timeout=10)
+        assert frame["type"] == "messages"
+        received.extend(frame["received_messages"])
+    return received
+
+
+async def test_stream_sends_credited_messages_and_takes_acks(
+    client: AsyncClient, async_db_session: AsyncSession
+) -> None:
+    subscription_path = await _create_subscription(client)
+    for i in range(2):
+        await _publish(client, subscription_path, {"i": i})
+    async with async_db_session as session:
+        subscription: Optional[Subscription] = await session.get(
+            Subscription, subscription_path.split("/")[-1]
+        )
+    assert subscription is not None
+
+    websocket = _WebSocket()
+    stream = SubscriptionStream(
+        websocket=websocket, subscription=subscription  # type: ignore
+    )
+    running = asyncio.create_task(stream.run())
+    await websocket.received.put({"type": "credit", "credits": 1})
+    received = await _received_messages(websocket, 1)
+    # out of credits, so the second message waits
+    await asyncio.sleep(0.2)
+    assert websocket.sent.empty()
+
+    await websocket.received.put({"type": "credit", "credits": 5})
+    received += await _received_messages(websocket, 1)
+    # messages published while the stream is open are sent right away
+    await _publish(client, subscription_path, {"i": 2})
+    received += await _received_messages(websocket, 1)
+    assert [json.loads(base64.b64decode(m["data"])) for m in received] == [
+        {"i": 0},
+        {"i": 1},
+        {"i": 2},
+    ]
+
+    await websocket.received.put(
+        {"type": "acknowledge", "ack_ids": [m["ack_id"] for m in received]}
+    )
+    frame = await asyncio.wait_for(websocket.sent.get(), timeout=10)
+    assert frame == {"type": "acknowledged", "acknowledged": 3}
+
+    await websocket.received.put({"type": "bogus"})
+    frame = await asyncio.wait_for(websocket.sent.get(), timeout=10)
+    assert frame["type"] == "error"
+    await asyncio.wait_for(running, timeout=10)
+    assert websocket.closed is not None
+    assert websocket.closed[0] == status.WS_1003_UNSUPPORTED_DATA
+
+
+async def test_stream_closes_on_malformed_frame() -> None:
+    websocket = _WebSocket()
+    stream = SubscriptionStream(
+        websocket=websocket,  # type: ignore
+        subscription=Subscription(name="default", delivery_type="pull"),
+    )
+    running = asyncio.create_task(stream.run())
+    await websocket.received.put('{"type": "credit", ')
+    await asyncio.wait_for(running, timeout=10)
+    assert websocket.closed == (
+        status.WS_1007_INVALID_FRAME_PAYLOAD_DATA,
+        "Frame is not valid JSON.",
+    )
+    assert websocket.sent.empty()
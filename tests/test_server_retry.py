@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+from modalci.models import Delivery, Subscription, TopicMessage
+from modalci.server.retry import backoff_seconds, is_exhausted, is_expired
+
+
+def _subscription(**kwargs: object) -> Subscription:
+    return Subscription(
+        name="default",
+        delivery_type="push",
+        push_endpoint="https://example.com",
+        **kwargs,
+    )
+
+
+def test_backoff_is_exponential_and_capped() -> None:
+    subscription = _subscription(
+        min_backoff_seconds=1.0, max_backoff_seconds=10.0, backoff_jitter=False
+    )
+    assert [backoff_seconds(subscription, attempts) for attempts in range(6)] == [
+        1.0,
+        1.0,
+        2.0,
+        4.0,
+        8.0,
+        10.0,
+    ]
+
+
+def test_backoff_jitter_stays_within_bounds() -> None:
+    subscription = _subscription(
+        min_backoff_seconds=1.0, max_backoff_seconds=10.0, backoff_jitter=True
+    )
+    for attempts in range(10):
+        assert 1.0 <= backoff_seconds(subscription, attempts) <= 10.0
+
+
+def test_is_exhausted() -> None:
+    now = datetime.utcnow()
+    subscription = _subscription(max_delivery_attempts=3, max_message_age_seconds=60)
+    message = TopicMessage(data=b"{}", created_at=now)
+    assert not is_exhausted(subscription, Delivery(attempts=2), message, now)
+    assert is_exhausted(subscription, Delivery(attempts=3), message, now)
+
+    old_message = TopicMessage(data=b"{}", created_at=now - timedelta(minutes=2))
+    assert is_expired(subscription, old_message, now)
+    assert is_exhausted(subscription, Delivery(attempts=1), old_message, now)
@@ -298,3 +298,31 @@ async def test_create_subscription_needs_https_endpoint(
     )
     assert response.status_code == 422
     assert response.json()["detail"][0]["msg"] == "push_endpoint must be a HTTPS URL"
+
+
+async def test_create_subscription_with_invalid_filter_fails(
+    client: AsyncClient,
+) -> None:
+    response = await client.post("/namespaces", json={"name": "modalci"})
+    assert response.status_code == 200
+    namespace = response.json()
+    response = await client.post(
+        f"/namespaces/{namespace['id']}/topics",
+        json={"name": "default", "namespace_id": namespace["id"]},
+    )
+    assert response.status_code == 200
+    topic = response.json()
+    response = await client.post(
+        f"/namespaces/{namespace['id']}/topics/{topic['id']}/subscriptions",
+        json={
+            "name": "default",
+            "topic_id": topic["id"],
+            "delivery_type": "pull",
+            "filter": 'attributes.region = "us" AND',
+        },
+    )
+    assert response.status_code == 422
+    assert (
+        response.json()["detail"][0]["msg"]
+        == "Expected attribute at the end of the filter."
+    )
@@ -1,9 +1,20 @@
-from uuid import uuid4
+import asyncio
+import base64
+import json
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict
+from uuid import UUID, uuid4
 
 from httpx import AsyncClient
 from sqlalchemy import text
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from modalci.models import TopicMessage
+from modalci.server.notify import notifier
+from modalci.server.partitions import PartitionMaintenance, partition_name
+from modalci.server.streams import MAX_RECENT_SEQUENCES, TopicBroadcaster, _Tail
+from settings import env
+
 
 async def test_create_topics(client: AsyncClient) -> None:
     response = await client.post("/namespaces", json={"name": "test"})
@@ -83,6 +94,100 @@ async def test_delete_namespace_cascades_topics(
         assert result.scalars().all() == []
 
 
+async def test_partition_maintenance_drops_expired_partitions(
+    client: AsyncClient, async_db_session: AsyncSession
+) -> None:
+    maintained = await PartitionMaintenance().run_once()
+    assert maintained == (2 * (env.PARTITION_PRECREATE_DAYS + 1), 0)
+    assert await PartitionMaintenance().run_once() == (0, 0)
+
+    response = await client.post("/namespaces", json={"name": "test"})
+    namespace_id = response.json()["id"]
+    response = await client.post(
+        f"/namespaces/{namespace_id}/topics",
+        json={"name": "test", "namespace_id": namespace_id},
+    )
+    topic_path = f"/namespaces/{namespace_id}/topics/{response.json()['id']}"
+    await client.post(
+        f"{topic_path}/subscriptions",
+        json={
+            "name": "test",
+            "topic_id": response.json()["id"],
+            "delivery_type": "pull",
+        },
+    )
+    message_ids = []
+    for _ in range(2):
+        response = await client.post(
+            f"{topic_path}/publish",
+            json={"data": base64.b64encode(b"{}").decode()},
+        )
+        assert response.status_code == 202
+        message_ids.append(response.json()["message_id"])
+
+    async with async_db_session.begin():
+        await async_db_session.execute(
+            text(
+                "CREATE TABLE messages_p20000101 PARTITION OF messages "
+                "FOR VALUES FROM ('2000-01-01') TO ('2000-01-02')"
+            )
+        )
+        await async_db_session.execute(
+            text("UPDATE messages SET created_at = '2000-01-01 12:00' WHERE id = :id"),
+            {"id": message_ids[0]},
+        )
+    assert await PartitionMaintenance().run_once() == (0, 1)
+    async with async_db_session.begin():
+        result = await async_db_session.execute(text("SELECT id FROM messages"))
+        assert [str(i) for i in result.scalars().all()] == message_ids[1:]
+        result = await async_db_session.execute(
+            text("SELECT count(*) FROM messages_default")
+        )
+        assert result.scalar() == 0
+
+
+async def test_partition_maintenance_moves_default_partition_rows(
+    client: AsyncClient, async_db_session: AsyncSession
+) -> None:
+    response = await client.post("/namespaces", json={"name": "test"})
+    namespace_id = response.json()["id"]
+    response = await client.post(
+        f"/namespaces/{namespace_id}/topics",
+        json={"name": "test", "namespace_id": namespace_id},
+    )
+    topic_path = f"/namespaces/{namespace_id}/topics/{response.json()['id']}"
+    message_ids = []
+    for _ in range(2):
+        response = await client.post(
+            f"{topic_path}/publish",
+            json={"data": base64.b64encode(b"{}").decode()},
+        )
+        assert response.status_code == 202
+        message_ids.append(response.json()["message_id"])
+    # published before maintenance ran, and far ahead of today
+    future = datetime.utcnow() + timedelta(days=env.PARTITION_PRECREATE_DAYS)
+    async with async_db_session.begin():
+        await async_db_session.execute(
+            text("UPDATE messages SET created_at = :created_at WHERE id = :id"),
+            {"created_at": future, "id": message_ids[1]},
+        )
+
+    maintained = await PartitionMaintenance().run_once()
+    assert maintained == (2 * (env.PARTITION_PRECREATE_DAYS + 1), 0)
+    async with async_db_session.begin():
+        result = await async_db_session.execute(
+            text("SELECT id, tableoid::regclass::text FROM messages ORDER BY sequence")
+        )
+        assert [(str(i), table) for i, table in result.all()] == [
+            (message_ids[0], partition_name("messages", datetime.utcnow().date())),
+            (message_ids[1], partition_name("messages", future.date())),
+        ]
+        result = await async_db_session.execute(
+            text("SELECT count(*) FROM messages_default")
+        )
+        assert result.scalar() == 0
+
+
 async def test_get_topic_with_query(client: AsyncClient) -> None:
     response = await client.post("/namespaces", json={"name": "test"})
     assert response.status_code == 200
@@ -153,3 +258,115 @@ async def test_delete_topic_not_found_fails(client: AsyncClient) -> None:
     response = await client.delete(f"/namespaces/{namespace_id}/topics/{uuid4()}")
     assert response.status_code == 400
     assert response.json()["detail"] == "Topic not found."
+
+
+async def _next_event(events: AsyncIterator[str]) -> Dict[str, Any]:
+    event = await asyncio.wait_for(events.__anext__(), timeout=10)
+    fields = dict(line.split(": ", 1) for line in event.strip().split("\n"))
+    return {"id": int(fields["id"]), **json.loads(fields["data"])}
+
+
+async def test_stream_topic_broadcasts_and_resumes(client: AsyncClient) -> None:
+    response = await client.post("/namespaces", json={"name": "test"})
+    namespace_id = response.json()["id"]
+    response = await client.post(
+        f"/namespaces/{namespace_id}/topics",
+        json={"name": "test", "namespace_id": namespace_id},
+    )
+    topic_id = response.json()["id"]
+
+    async def _publish(i: int) -> str:
+        data = base64.b64encode(json.dumps({"i": i}).encode("utf-8")).decode()
+        response = await client.post(
+            f"/namespaces/{namespace_id}/topics/{topic_id}/publish",
+            json={"data": data},
+        )
+        assert response.status_code == 202
+        return response.json()["message_id"]
+
+    first_message_id = await _publish(0)
+    broadcaster = TopicBroadcaster()
+    watchers = [broadcaster.events(topic_id=UUID(topic_id)) for _ in range(2)]
+    pending = [asyncio.ensure_future(w.__anext__()) for w in watchers]
+    await asyncio.sleep(0.2)
+    # both watchers share one tail, which starts after the first message
+    assert len(broadcaster._tails) == 1
+
+    second_message_id = await _publish(1)
+    events = [await asyncio.wait_for(p, timeout=10) for p in pending]
+    assert all(second_message_id in e for e in events)
+    assert all(first_message_id not in e for e in events)
+
+    # resuming replays the missed messages from the log, then goes live
+    resumed = broadcaster.events(topic_id=UUID(topic_id), last_event_id=0)
+    event = await _next_event(resumed)
+    assert event["message_id"] == first_message_id
+    event = await _next_event(resumed)
+    assert event["message_id"] == second_message_id
+    third_message_id = await _publish(2)
+    event = await _next_event(resumed)
+    assert event["message_id"] == third_message_id
+    assert event["id"] > 0
+    assert json.loads(base64.b64decode(event["data"])) == {"i": 2}
+
+    for w in [*watchers, resumed]:
+        await w.aclose()  # type: ignore
+    assert broadcaster._tails == {}
+
+
+async def test_stream_topic_sends_late_commits(
+    client: AsyncClient, async_db_session: AsyncSession
+) -> None:
+    response = await client.post("/namespaces", json={"name": "test"})
+    namespace_id = response.json()["id"]
+    response = await client.post(
+        f"/namespaces/{namespace_id}/topics",
+        json={"name": "test", "namespace_id": namespace_id},
+    )
+    topic_id = response.json()["id"]
+    broadcaster = TopicBroadcaster()
+    watcher = broadcaster.events(topic_id=UUID(topic_id))
+    pending = asyncio.ensure_future(watcher.__anext__())
+    await asyncio.sleep(0.2)
+
+    # a publish takes its sequence, then commits after a later publish
+    async with async_db_session.begin():
+        late_sequence = (
+            await async_db_session.execute(
+                text("SELECT nextval('messages_sequence_seq')")
+            )
+        ).scalar()
+    response = await client.post(
+        f"/namespaces/{namespace_id}/topics/{topic_id}/publish",
+        json={"data": base64.b64encode(b"{}").decode()},
+    )
+    assert response.json()["message_id"] in await asyncio.wait_for(pending, timeout=10)
+    late = TopicMessage(topic_id=UUID(topic_id), data=b"{}", sequence=late_sequence)
+    async with async_db_session.begin():
+        async_db_session.add(late)
+    notifier.notify(UUID(topic_id))
+
+    event = await asyncio.wait_for(watcher.__anext__(), timeout=10)
+    assert str(late.id) in event
+    # resuming from the late message's sequence would replay later ones
+    assert not event.startswith("id: ")
+    await watcher.aclose()  # type: ignore
+
+
+def test_stream_tail_caps_recent_sequences() -> None:
+    tail = _Tail()
+    tail.checkpoint()
+    for sequence in range(1, MAX_RECENT_SEQUENCES + 11):
+        tail.sequence = sequence
+        tail.add(sequence)
+    tail.checkpoint()
+    # the oldest sequences past the cap are no longer re-read
+    assert len(tail.recent) == MAX_RECENT_SEQUENCES
+    assert tail.floor == 10
+    assert min(tail.recent) == 11
+
+
+async def test_stream_topic_not_found_fails(client: AsyncClient) -> None:
+    response = await client.get(f"/namespaces/{uuid4()}/topics/{uuid4()}/stream")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Topic not found."
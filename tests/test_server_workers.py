@@ -0,0 +1,577 @@
+import asyncio
+import base64
+import gzip
+import json
+from collections import OrderedDict
+from datetime import datetime
+from functools import partial
+from typing import Any, Dict, List
+from uuid import uuid4
+
+import httpx
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from modalci._types import ContentEncoding, DeliveryStatus
+from modalci.models import Delivery, Subscription, TopicMessage
+from modalci.server.delivery import delivery_client
+from modalci.server.ordering import KeyedExecutor
+from modalci.server.workers import (
+    DeliveryBody,
+    DeliveryBodyCache,
+    DeliveryWorker,
+    DeliveryWorkerPool,
+    delivery_bodies,
+)
+from settings import env
+
+
+async def _publish(
+    client: AsyncClient, endpoints: List[str], **subscription: Any
+) -> Dict[str, Any]:
+    response = await client.post("/namespaces", json={"name": "default"})
+    assert response.status_code == 200
+    namespace = response.json()
+    response = await client.post(
+        f"/namespaces/{namespace['id']}/topics",
+        json={"name": "default", "namespace_id": namespace["id"]},
+    )
+    assert response.status_code == 200
+    topic = response.json()
+    for i, endpoint in enumerate(endpoints):
+        response = await client.post(
+            f"/namespaces/{namespace['id']}/topics/{topic['id']}/subscriptions",
+            json={
+                "name": f"default{i}",
+                "topic_id": topic["id"],
+                "delivery_type": "push",
+                "push_endpoint": endpoint,
+                **subscription,
+            },
+        )
+        assert response.status_code == 200
+        subscription_id = response.json()["id"]
+    data = base64.b64encode(json.dumps({"msg": "hello"}).encode("utf-8")).decode()
+    response = await client.post(
+        f"/namespaces/{namespace['id']}/topics/{topic['id']}/publish",
+        json={"data": data},
+    )
+    assert response.status_code == 202
+    return {
+        "namespace_id": namespace["id"],
+        "topic_id": topic["id"],
+        "subscription_id": subscription_id,
+        **response.json(),
+    }
+
+
+async def test_worker_delivers_pending_messages(
+    client: AsyncClient,
+    async_db_session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    posted = []
+
+    async def _post(url: str, content: bytes, headers: Dict) -> httpx.Response:
+        posted.append((url, content))
+        return httpx.Response(status_code=200)
+
+    monkeypatch.setattr(delivery_client, "post", _post)
+    published = await _publish(
+        client, ["https://example.com/a", "https://example.com/b"]
+    )
+
+    worker = DeliveryWorker(wakeup=asyncio.Event())
+    assert await worker.run_once() == 2
+    assert await worker.run_once() == 0
+    assert sorted(url for url, _ in posted) == [
+        "https://example.com/a",
+        "https://example.com/b",
+    ]
+    assert json.loads(posted[0][1]) == {"msg": "hello"}
+
+    async with async_db_session as session:
+        deliveries = (
+            (
+                await session.execute(
+                    select(Delivery).where(
+                        Delivery.message_id == published["message_id"]
+                    )
+                )
+            )
+            .scalars()
+            .all()
+        )
+        assert [d.status for d in deliveries] == [DeliveryStatus.DELIVERED] * 2
+        assert [d.attempts for d in deliveries] == [1, 1]
+
+
+async def test_worker_leaves_failed_deliveries_pending(
+    client: AsyncClient,
+    async_db_session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    async def _post(url: str, content: bytes, headers: Dict) -> httpx.Response:
+        raise httpx.ConnectError("boom")
+
+    monkeypatch.setattr(delivery_client, "post", _post)
+    published = await _publish(client, ["https://example.com/a"])
+
+    worker = DeliveryWorker(wakeup=asyncio.Event())
+    assert await worker.run_once() == 1
+    # the failed delivery is not claimed again until its backoff has passed
+    assert await worker.run_once() == 0
+
+    async with async_db_session as session:
+        delivery = (
+            await session.execute(
+                select(Delivery).where(Delivery.message_id == published["message_id"])
+            )
+        ).scalar_one()
+        assert delivery.status == DeliveryStatus.PENDING
+        assert delivery.last_error is not None
+        assert delivery.next_attempt_at > delivery.updated_at
+
+
+async def test_worker_retries_non_2xx_responses(
+    client: AsyncClient,
+    async_db_session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    async def _post(url: str, content: bytes, headers: Dict) -> httpx.Response:
+        return httpx.Response(status_code=503)
+
+    monkeypatch.setattr(delivery_client, "post", _post)
+    published = await _publish(client, ["https://example.com/a"])
+
+    worker = DeliveryWorker(wakeup=asyncio.Event())
+    assert await worker.run_once() == 1
+
+    async with async_db_session as session:
+        delivery = (
+            await session.execute(
+                select(Delivery).where(Delivery.message_id == published["message_id"])
+            )
+        ).scalar_one()
+        assert delivery.status == DeliveryStatus.PENDING
+        assert delivery.last_status_code == 503
+
+
+async def test_worker_dead_letters_and_redrives_exhausted_deliveries(
+    client: AsyncClient,
+    async_db_session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    status_code = 500
+
+    async def _post(url: str, content: bytes, headers: Dict) -> httpx.Response:
+        return httpx.Response(status_code=status_code)
+
+    monkeypatch.setattr(delivery_client, "post", _post)
+    published = await _publish(
+        client, ["https://example.com/a"], max_delivery_attempts=1
+    )
+    subscription_path = (
+        f"/namespaces/{published['namespace_id']}/topics/{published['topic_id']}"
+        f"/subscriptions/{published['subscription_id']}"
+    )
+
+    worker = DeliveryWorker(wakeup=asyncio.Event())
+    assert await worker.run_once() == 1
+
+    response = await client.get(f"{subscription_path}/dead-letters")
+    assert response.status_code == 200
+    dead_letters = response.json()
+    assert len(dead_letters) == 1
+    assert dead_letters[0]["message_id"] == published["message_id"]
+    assert dead_letters[0]["status"] == DeliveryStatus.DEAD_LETTERED
+    assert dead_letters[0]["last_status_code"] == 500
+
+    response = await client.post(f"{subscription_path}/redrive")
+    assert response.status_code == 200
+    assert response.json() == {"redriven": 1, "expired": 0}
+
+    status_code = 200
+    assert await worker.run_once() == 1
+    response = await client.get(f"{subscription_path}/dead-letters")
+    assert response.json() == []
+
+
+async def test_redrive_leaves_expired_dead_letters(
+    client: AsyncClient,
+    async_db_session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    async def _post(url: str, content: bytes, headers: Dict) -> httpx.Response:
+        return httpx.Response(status_code=500)
+
+    monkeypatch.setattr(delivery_client, "post", _post)
+    published = await _publish(
+        client, ["https://example.com/a"], max_delivery_attempts=1
+    )
+    subscription_path = (
+        f"/namespaces/{published['namespace_id']}/topics/{published['topic_id']}"
+        f"/subscriptions/{published['subscription_id']}"
+    )
+    worker = DeliveryWorker(wakeup=asyncio.Event())
+    assert await worker.run_once() == 1
+
+    # the message has outlived the subscription's max_message_age_seconds
+    async with async_db_session as session:
+        await session.execute(
+            update(Subscription)
+            .where(Subscription.id == published["subscription_id"])
+            .values(max_message_age_seconds=0)
+        )
+        await session.commit()
+    response = await client.post(f"{subscription_path}/redrive")
+    assert response.status_code == 200
+    assert response.json() == {"redriven": 0, "expired": 1}
+    response = await client.get(f"{subscription_path}/dead-letters")
+    assert [d["message_id"] for d in response.json()] == [published["message_id"]]
+
+
+async def test_dead_letters_missing_subscription_fails(client: AsyncClient) -> None:
+    response = await client.get(
+        f"/namespaces/{uuid4()}/topics/{uuid4()}/subscriptions/{uuid4()}"
+        "/dead-letters"
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Subscription not found."
+    response = await client.post(
+        f"/namespaces/{uuid4()}/topics/{uuid4()}/subscriptions/{uuid4()}/redrive"
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Subscription not found."
+
+
+async def test_worker_pool_start_notify_stop() -> None:
+    pool = DeliveryWorkerPool()
+    pool.notify()
+    await pool.start(workers=2)
+    assert len(pool._tasks) == 2
+    pool.notify()
+    await asyncio.sleep(0)
+    await pool.stop()
+    assert pool._tasks == []
+
+
+def test_worker_batches_by_count_and_bytes() -> None:
+    batching = Subscription(
+        name="batching",
+        delivery_type="push",
+        push_endpoint="https://example.com/batching",
+        batch_max_messages=3,
+        batch_max_bytes=10,
+    )
+    single = Subscription(
+        name="single", delivery_type="push", push_endpoint="https://example.com"
+    )
+    messages = {m.id: m for m in [TopicMessage(data=b"1234") for _ in range(5)]}
+    deliveries = [
+        Delivery(message_id=message_id, subscription_id=subscription.id)
+        for message_id in messages
+        for subscription in [batching, single]
+    ]
+    batches = DeliveryWorker(wakeup=asyncio.Event()).batch(
+        deliveries=deliveries,
+        bodies={
+            m.id: DeliveryBody.from_data(data=m.data, content_type=m.content_type)
+            for m in messages.values()
+        },
+        subscriptions={batching.id: batching, single.id: single},
+    )
+    assert [
+        (batch[0].subscription_id == batching.id, len(batch)) for batch in batches
+    ] == [
+        (True, 2),
+        (False, 1),
+        (False, 1),
+        (True, 2),
+        (False, 1),
+        (False, 1),
+        (True, 1),
+        (False, 1),
+    ]
+
+
+def test_worker_does_not_batch_non_json_messages() -> None:
+    subscription = Subscription(
+        name="batching",
+        delivery_type="push",
+        push_endpoint="https://example.com/batching",
+        batch_max_messages=10,
+    )
+    messages = {
+        m.id: m
+        for m in [
+            TopicMessage(data=b"1"),
+            TopicMessage(data=b"\x00", content_type="application/octet-stream"),
+            TopicMessage(data=b"2"),
+        ]
+    }
+    batches = DeliveryWorker(wakeup=asyncio.Event()).batch(
+        deliveries=[
+            Delivery(message_id=message_id, subscription_id=subscription.id)
+            for message_id in messages
+        ],
+        bodies={
+            m.id: DeliveryBody.from_data(data=m.data, content_type=m.content_type)
+            for m in messages.values()
+        },
+        subscriptions={subscription.id: subscription},
+    )
+    assert [[messages[d.message_id].data for d in batch] for batch in batches] == [
+        [b"1", b"2"],
+        [b"\x00"],
+    ]
+
+
+async def test_worker_delivers_batches_as_json_arrays(
+    client: AsyncClient,
+    async_db_session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    posted = []
+
+    async def _post(url: str, content: bytes, headers: Dict) -> httpx.Response:
+        posted.append(json.loads(content))
+        return httpx.Response(status_code=200)
+
+    monkeypatch.setattr(delivery_client, "post", _post)
+    published = await _publish(
+        client,
+        ["https://example.com/a"],
+        batch_max_messages=10,
+        batch_max_linger_ms=60_000,
+    )
+    data = base64.b64encode(json.dumps({"msg": "again"}).encode("utf-8")).decode()
+    response = await client.post(
+        f"/namespaces/{published['namespace_id']}/topics/{published['topic_id']}"
+        "/publish",
+        json={"data": data},
+    )
+    assert response.status_code == 202
+
+    worker = DeliveryWorker(wakeup=asyncio.Event())
+    # both deliveries are still lingering
+    assert await worker.run_once() == 0
+
+    async with async_db_session as session:
+        await session.execute(
+            update(Delivery)
+            .where(Delivery.message_id == published["message_id"])
+            .values(next_attempt_at=datetime.utcnow())
+        )
+        await session.commit()
+
+    # the due delivery pulls the lingering one into its batch
+    assert await worker.run_once() == 2
+    assert len(posted) == 1
+    assert posted[0] == [{"msg": "hello"}, {"msg": "again"}]
+
+    async with async_db_session as session:
+        deliveries = (await session.execute(select(Delivery))).scalars().all()
+        assert [d.status for d in deliveries] == [DeliveryStatus.DELIVERED] * 2
+
+
+async def test_worker_batches_leave_paced_replays_waiting(
+    client: AsyncClient,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    posted = []
+
+    async def _post(url: str, content: bytes, headers: Dict) -> httpx.Response:
+        posted.append(json.loads(content))
+        return httpx.Response(status_code=200)
+
+    monkeypatch.setattr(delivery_client, "post", _post)
+    published = await _publish(
+        client,
+        ["https://example.com/a"],
+        batch_max_messages=10,
+        batch_max_linger_ms=0,
+    )
+    topic_path = (
+        f"/namespaces/{published['namespace_id']}/topics/{published['topic_id']}"
+    )
+    for _ in range(2):
+        response = await client.post(
+            f"{topic_path}/publish",
+            json={"data": base64.b64encode(b'{"msg": "again"}').decode()},
+        )
+        assert response.status_code == 202
+    worker = DeliveryWorker(wakeup=asyncio.Event())
+    assert await worker.run_once() == 3
+    assert len(posted) == 1
+
+    response = await client.post(
+        f"{topic_path}/subscriptions/{published['subscription_id']}/seek",
+        json={"time": "2000-01-01T00:00:00", "max_messages_per_second": 0.1},
+    )
+    assert response.json()["replayed"] == 3
+    # only the first replayed message is due, the others keep their pace
+    assert await worker.run_once() == 1
+    assert posted[1] == [{"msg": "hello"}]
+
+
+def test_delivery_body_cache_evicts_least_recently_used() -> None:
+    cache = DeliveryBodyCache(max_bytes=4)
+    first, second, third = uuid4(), uuid4(), uuid4()
+    cache.put(first, DeliveryBody.from_data(data=b"12", content_type="a/b"))
+    cache.put(second, DeliveryBody.from_data(data=b"34", content_type="a/b"))
+    assert cache.get(first) is not None
+    cache.put(third, DeliveryBody.from_data(data=b"56", content_type="a/b"))
+    assert cache.get(second) is None
+    assert cache.get(first) is not None
+    assert cache.get(third) is not None
+    assert cache.bytes == 4
+    # bodies larger than the cache are not kept at all
+    cache.put(uuid4(), DeliveryBody.from_data(data=b"12345", content_type="a/b"))
+    assert cache.bytes == 4
+
+
+def test_delivery_body_has_precomputed_headers() -> None:
+    body = DeliveryBody.from_data(data=b'{"a": 1}', content_type="application/json")
+    assert body.headers == {"Content-Type": "application/json", "Content-Length": "8"}
+    assert body.is_json
+    batch = DeliveryBody.from_batch([body, body])
+    assert batch.content == b'[{"a": 1},{"a": 1}]'
+    assert batch.headers["Content-Length"] == str(len(batch.content))
+
+
+async def test_worker_compresses_bodies_for_subscriptions_that_opt_in(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(env, "MESSAGE_COMPRESSION_MIN_BYTES", 10)
+    monkeypatch.setattr(delivery_bodies, "_bodies", OrderedDict())
+    gzipped = Subscription(
+        name="gzipped",
+        delivery_type="push",
+        push_endpoint="https://example.com",
+        push_content_encoding="gzip",
+    )
+    plain = Subscription(
+        name="plain", delivery_type="push", push_endpoint="https://example.com"
+    )
+    small, large = TopicMessage(data=b"{}"), TopicMessage(data=b'{"a": 1}' * 10)
+    bodies = {
+        m.id: DeliveryBody.from_data(data=m.data, content_type=m.content_type)
+        for m in [small, large]
+    }
+    worker = DeliveryWorker(wakeup=asyncio.Event())
+
+    async def _body(subscription: Subscription, *messages: TopicMessage) -> Dict:
+        body = await worker.body(
+            subscription=subscription,
+            batch=[
+                Delivery(message_id=m.id, subscription_id=subscription.id)
+                for m in messages
+            ],
+            bodies=bodies,
+        )
+        if body.headers.get("Content-Encoding") == "gzip":
+            return {**body.headers, "content": gzip.decompress(body.content)}
+        return {**body.headers, "content": body.content}
+
+    assert await _body(plain, large) == {
+        "Content-Type": "application/json",
+        "Content-Length": "80",
+        "content": large.data,
+    }
+    # bodies under the threshold are not worth compressing
+    assert "Content-Encoding" not in await _body(gzipped, small)
+    encoded = await _body(gzipped, large)
+    assert encoded["Content-Encoding"] == "gzip"
+    assert encoded["content"] == large.data
+    assert delivery_bodies.get((large.id, ContentEncoding.GZIP)) is not None
+    encoded = await _body(gzipped, small, large)
+    assert encoded["Content-Encoding"] == "gzip"
+    assert encoded["content"] == b"[" + small.data + b"," + large.data + b"]"
+
+
+async def test_worker_bounds_concurrent_deliveries(
+    client: AsyncClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    in_flight = 0
+    max_in_flight = 0
+
+    async def _post(url: str, content: bytes, headers: Dict) -> httpx.Response:
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return httpx.Response(status_code=200)
+
+    monkeypatch.setattr(delivery_client, "post", _post)
+    monkeypatch.setattr(env, "DELIVERY_CONCURRENCY", 2)
+    await _publish(client, [f"https://example.com/{i}" for i in range(5)])
+
+    assert await DeliveryWorker(wakeup=asyncio.Event()).run_once() == 5
+    assert max_in_flight == 2
+
+
+async def test_worker_delivers_ordering_keys_in_order(
+    client: AsyncClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    posted: List[Dict] = []
+
+    async def _post(url: str, content: bytes, headers: Dict) -> httpx.Response:
+        payload = json.loads(content)
+        posted.append(payload)
+        # the first attempt of the head of "a" fails
+        failed = payload == {"i": 1} and posted.count(payload) == 1
+        return httpx.Response(status_code=503 if failed else 200)
+
+    monkeypatch.setattr(delivery_client, "post", _post)
+    published = await _publish(
+        client,
+        ["https://example.com/a"],
+        enable_message_ordering=True,
+        min_backoff_seconds=0,
+        max_backoff_seconds=0,
+    )
+    for i, ordering_key in [(1, "a"), (2, "a"), (3, "b"), (4, "b")]:
+        data = base64.b64encode(json.dumps({"i": i}).encode("utf-8")).decode()
+        response = await client.post(
+            f"/namespaces/{published['namespace_id']}/topics/{published['topic_id']}"
+            "/publish",
+            json={"data": data, "ordering_key": ordering_key},
+        )
+        assert response.status_code == 202
+
+    worker = DeliveryWorker(wakeup=asyncio.Event())
+    # the unkeyed message and the head of each key go out
+    assert await worker.run_once() == 3
+    assert sorted(p.get("i", 0) for p in posted) == [0, 1, 3]
+    # the failed head of "a" is retried before the rest of "a"
+    assert await worker.run_once() == 2
+    assert sorted(p.get("i", 0) for p in posted[3:]) == [1, 4]
+    assert await worker.run_once() == 1
+    assert posted[5:] == [{"i": 2}]
+    assert await worker.run_once() == 0
+
+
+async def test_keyed_executor_serializes_keys_and_forgets_idle_ones() -> None:
+    executor = KeyedExecutor()
+    events: List[str] = []
+
+    async def _task(name: str) -> str:
+        events.append(f"start {name}")
+        await asyncio.sleep(0.01)
+        events.append(f"end {name}")
+        return name
+
+    results = await asyncio.gather(
+        executor.run("a", partial(_task, "a1")),
+        executor.run("a", partial(_task, "a2")),
+        executor.run("b", partial(_task, "b1")),
+    )
+    assert results == ["a1", "a2", "b1"]
+    assert events.index("end a1") < events.index("start a2")
+    assert events.index("start b1") < events.index("end a1")
+    assert executor._keys == {}